@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""Phase timings of do_solve over a grid of weighted sum problems.
+
+    python benchmarks/solve_grid.py run --sugar-jar sugar.jar \\
+        --actors 100 200 400 --range-sizes 5 15 -o before.json
+    python benchmarks/solve_grid.py compare before.json after.json
+
+Every actor gets range_size values of the same parity. A satisfiable
+problem sums up a random choice, an unsatisfiable one is off by one from
+such a sum, so sugar can not rule it out by the bounds alone.
+--sat-ratio sets the share of satisfiable problems per grid cell.
+
+Every problem is solved in a fresh process, peak_child_rss is the peak
+RSS of the biggest child (java or minisat) of that run. run writes JSON,
+compare reports metrics whose median per grid cell got worse by more
+than --threshold and exits with 1 if there are any.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csp_solver import (
+    ENCODERS,
+    SAT_BACKENDS,
+    add_csp_config_params_to_argparse_parser,
+    do_solve
+)
+from csp_trace import get_child_max_rss
+
+
+# lower is better for all of them
+METRICS = (
+    'create_csp_time', 'csp_to_cnf_time', 'minisat_time',
+    'minisat_cpu_time', 'decode_time', 'overall_solve_csp_time',
+    'csp_file_size', 'cnf_file_size', 'map_file_size', 'peak_child_rss'
+)
+
+# time differences below this many seconds are noise
+MIN_TIME_DIFFERENCE = 0.05
+
+
+def get_problem(actors, range_size, satisfiable, seed):
+    """(variables, reference_value) of a weighted sum problem."""
+    rng = random.Random(seed)
+    variables = []
+    for _ in range(actors):
+        lb = rng.randrange(-2 * range_size, 2 * range_size) * 2
+        variables.append(list(range(lb, lb + 2 * range_size, 2)))
+    reference_value = sum(rng.choice(variable) for variable in variables)
+    if not satisfiable:
+        # all sums are even
+        reference_value += 1
+    return variables, reference_value
+
+
+def measure(measurement):
+    variables, reference_value = get_problem(
+        measurement['actors'], measurement['range_size'],
+        measurement['satisfiable'], measurement['seed'])
+    result = do_solve(
+        variables=variables,
+        reference_value=reference_value,
+        csp_solver_config=measurement['csp_solver_config'],
+        encoder=measurement['encoder'],
+        sat_backend=measurement['sat_backend'],
+        timeout=measurement['timeout']
+    )
+    run = dict((key, result[key]) for key in METRICS if key in result)
+    run['status'] = result['status']
+    run['peak_child_rss'] = get_child_max_rss()
+    # solve_csp prints as well, the result is the last line
+    print()
+    print(json.dumps(run))
+
+
+def iter_grid(parsed_args):
+    rng = random.Random(parsed_args.seed)
+    sat_count = int(round(parsed_args.instances * parsed_args.sat_ratio))
+    for actors in parsed_args.actors:
+        for range_size in parsed_args.range_sizes:
+            for instance in range(parsed_args.instances):
+                yield dict(
+                    actors=actors,
+                    range_size=range_size,
+                    satisfiable=instance < sat_count,
+                    seed=rng.randrange(1 << 30)
+                )
+
+
+def run_grid(parsed_args):
+    csp_solver_config = dict(
+        sugarjar_path=parsed_args.sugar_jar,
+        minisat_path=parsed_args.minisat,
+        tmp_folder=parsed_args.tmp_folder,
+        sat_library_path=parsed_args.sat_library
+    )
+    runs = []
+    for problem in iter_grid(parsed_args):
+        measurement = dict(
+            problem,
+            csp_solver_config=csp_solver_config,
+            encoder=parsed_args.encoder,
+            sat_backend=parsed_args.sat_backend,
+            timeout=parsed_args.timeout
+        )
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__),
+             '--measure', json.dumps(measurement)],
+            universal_newlines=True
+        )
+        run = dict(problem, **json.loads(output.splitlines()[-1]))
+        runs.append(run)
+        print("{actors:>6} {range_size:>5} {satisfiable!s:>6} "
+              "{status:>14} {0:>8.3f} {1:>8.3f} {2:>10.1f}".format(
+                  run.get('csp_to_cnf_time', 0.0),
+                  run.get('minisat_time', 0.0),
+                  run['peak_child_rss'] / 1024.0 ** 2,
+                  **run), file=sys.stderr)
+
+    benchmark = dict(
+        created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        encoder=parsed_args.encoder,
+        sat_backend=parsed_args.sat_backend,
+        timeout=parsed_args.timeout,
+        runs=runs
+    )
+    if parsed_args.output:
+        with open(parsed_args.output, 'w') as output_fp:
+            json.dump(benchmark, output_fp, indent=1, sort_keys=True)
+    else:
+        print(json.dumps(benchmark, indent=1, sort_keys=True))
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def get_cells(benchmark):
+    """{(actors, range_size, satisfiable): [run, ...]}"""
+    cells = {}
+    for run in benchmark['runs']:
+        cell = (run['actors'], run['range_size'], run['satisfiable'])
+        cells.setdefault(cell, []).append(run)
+    return cells
+
+
+def get_regressions(base, new, threshold):
+    """Yields (cell, metric, base value, new value) for medians that
+    grew by more than threshold, and status changes as metric 'status'."""
+    base_cells = get_cells(base)
+    for cell, new_runs in sorted(get_cells(new).items()):
+        base_runs = base_cells.get(cell)
+        if not base_runs:
+            continue
+        base_unknown = sum(run['status'] == 'UNKNOWN' for run in base_runs)
+        new_unknown = sum(run['status'] == 'UNKNOWN' for run in new_runs)
+        if new_unknown > base_unknown:
+            yield cell, 'status', base_unknown, new_unknown
+        for metric in METRICS:
+            base_values = [run[metric] for run in base_runs if metric in run]
+            new_values = [run[metric] for run in new_runs if metric in run]
+            if not base_values or not new_values:
+                continue
+            base_value, new_value = median(base_values), median(new_values)
+            if metric.endswith('_time') and \
+                    new_value - base_value < MIN_TIME_DIFFERENCE:
+                continue
+            if new_value > base_value * (1 + threshold):
+                yield cell, metric, base_value, new_value
+
+
+def compare(parsed_args):
+    with open(parsed_args.base) as base_fp:
+        base = json.load(base_fp)
+    with open(parsed_args.new) as new_fp:
+        new = json.load(new_fp)
+    regressions = list(get_regressions(base, new, parsed_args.threshold))
+    for (actors, range_size, satisfiable), metric, base_value, new_value \
+            in regressions:
+        print("{0:>6} {1:>5} {2!s:>6} {3:>24} {4:>14.4g} -> {5:<14.4g}".format(
+            actors, range_size, satisfiable, metric, base_value, new_value))
+    if not regressions:
+        print("No regressions")
+    return 1 if regressions else 0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help="Solve the grid")
+    run_parser.add_argument('--actors', type=int, nargs='+',
+        default=[100, 200, 400])
+    run_parser.add_argument('--range-sizes', type=int, nargs='+',
+        default=[5, 15])
+    run_parser.add_argument('--instances', type=int, default=3,
+        help="Problems per grid cell")
+    run_parser.add_argument('--sat-ratio', type=float, default=0.5,
+        help="Share of satisfiable problems")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--encoder', choices=ENCODERS, default='sugar')
+    run_parser.add_argument('--sat-backend', choices=SAT_BACKENDS,
+        default='subprocess')
+    run_parser.add_argument('--timeout', type=float,
+        help="Seconds per problem, slower ones are UNKNOWN")
+    run_parser.add_argument('-o', '--output',
+        help="JSON file to write, default is stdout")
+    add_csp_config_params_to_argparse_parser(run_parser)
+
+    compare_parser = subparsers.add_parser('compare',
+        help="Report regressions of new against base")
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+        help="Relative growth of a median that counts as regression")
+    return parser
+
+
+def main(args=sys.argv[1:]):
+    if args[:1] == ['--measure']:
+        return measure(json.loads(args[1]))
+
+    parsed_args = get_parser().parse_args(args)
+    if parsed_args.command == 'run':
+        return run_grid(parsed_args)
+    if parsed_args.command == 'compare':
+        return compare(parsed_args)
+    get_parser().print_help()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
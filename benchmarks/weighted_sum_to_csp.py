@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Time and peak memory of creating weighted sum CSP files.
+
+    python benchmarks/weighted_sum_to_csp.py --sizes 1000 10000 100000 1000000
+
+'stream' writes with write_weighted_sum_csp, 'string' builds the whole
+text with weighted_sum_to_csp first. Every measurement runs in a fresh
+process so the peak RSS of one run does not hide the next one.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csp_solver import weighted_sum_to_csp, write_weighted_sum_csp
+
+
+DOMAINS = [
+    list(range(1, 16)), list(range(-15, 0)), [1, 2], [-1, -2, -3]
+]
+
+MODES = ('stream', 'string')
+
+
+def get_max_rss():
+    """Peak RSS of this process in bytes."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on Mac OS X
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def measure(mode, size):
+    random.seed(size)
+    variables = [random.choice(DOMAINS) for _ in range(size)]
+    max_rss_before = get_max_rss()
+    with tempfile.TemporaryFile('w') as csp_fp:
+        b = time.time()
+        if mode == 'stream':
+            write_weighted_sum_csp(variables, 0, csp_fp)
+        else:
+            csp_fp.write(weighted_sum_to_csp(variables, 0))
+        took = time.time() - b
+        csp_file_size = csp_fp.tell()
+    print(took, get_max_rss() - max_rss_before, csp_file_size)
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--measure', nargs=2, help=argparse.SUPPRESS)
+    parsed_args = parser.parse_args(args)
+
+    if parsed_args.measure:
+        mode, size = parsed_args.measure
+        return measure(mode, int(size))
+
+    print("{0:>10} {1:>8} {2:>10} {3:>12} {4:>12}".format(
+        'variables', 'mode', 'time [s]', 'peak [MB]', 'csp [MB]'))
+    for size in parsed_args.sizes:
+        for mode in MODES:
+            took, max_rss_increase, csp_file_size = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__),
+                 '--measure', mode, str(size)],
+                universal_newlines=True
+            ).split()
+            print("{0:>10} {1:>8} {2:>10.3f} {3:>12.1f} {4:>12.1f}".format(
+                size, mode, float(took),
+                int(max_rss_increase) / 1024.0 ** 2,
+                int(csp_file_size) / 1024.0 ** 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""asyncio versions of solve_csp and do_solve, needs python 3.5+.
+
+sugar and minisat run as asyncio subprocesses, so one event loop drives
+many solves without blocking a thread per solve. All solves of an event
+loop share a semaphore that bounds the number of running JVM and minisat
+processes. Cancelling a solve kills its child process and removes its
+temporary files.
+
+The phases are the ones of csp_solver (iter_solve_csp_steps and
+iter_do_solve_steps), only running the processes is done here. The
+python encoder and decoder, the dp backend and the library sat_backend
+run in the default executor. A SugarWorker (sugar_worker, cnf_stream)
+is a JVM shared beyond one solve that neither the semaphore nor a
+cancel can control, they are refused.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import weakref
+
+from csp_solver import (
+    ConfigurationException,
+    LimitReached,
+    check_minisat_exit,
+    get_java_cmd,
+    get_remaining_time,
+    get_rlimit_preexec_fn,
+    get_sat_answer,
+    iter_do_solve_steps,
+    iter_solve_csp_steps,
+    raise_portfolio_failure,
+)
+
+
+# child processes running at once per event loop
+MAX_PROCESSES = os.cpu_count() or 1
+
+_process_semaphores = weakref.WeakKeyDictionary()
+
+
+def get_process_semaphore():
+    """The semaphore shared by all solves of the running event loop."""
+    loop = asyncio.get_event_loop()
+    if loop not in _process_semaphores:
+        _process_semaphores[loop] = asyncio.Semaphore(MAX_PROCESSES)
+    return _process_semaphores[loop]
+
+
+async def run_process(cmd, semaphore, deadline=None, preexec_fn=None):
+    """Runs cmd once semaphore allows it and returns (returncode,
+    stdout, stderr). The process is killed if the deadline passes
+    (LimitReached) or the calling task is cancelled."""
+    async with semaphore:
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            preexec_fn=preexec_fn)
+        try:
+            output, error_output = await asyncio.wait_for(
+                process.communicate(), get_remaining_time(deadline))
+        except asyncio.TimeoutError:
+            raise LimitReached('timeout')
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+    return (process.returncode,
+            output.decode('utf-8', 'replace'),
+            error_output.decode('utf-8', 'replace'))
+
+
+async def run_sat_solver_async(solver_cmd, semaphore, deadline=None,
+                               memory_limit=None):
+    """Coroutine version of csp_solver.run_sat_solver."""
+    returncode, output, error_output = await run_process(
+        solver_cmd, semaphore, deadline=deadline,
+        preexec_fn=get_rlimit_preexec_fn(
+            memory_limit, get_remaining_time(deadline)))
+    check_minisat_exit(returncode, output, error_output,
+                       deadline, memory_limit)
+    return returncode, output, error_output
+
+
+async def race_sat_solvers_async(portfolio, cnf_file, out_file, semaphore,
+                                 deadline=None, memory_limit=None):
+    """Coroutine version of csp_solver.race_sat_solvers, every solver
+    takes semaphore. The solvers that did not win are killed, also when
+    the calling task is cancelled."""
+    out_files = ['{0}.{1}'.format(out_file, i)
+                 for i in range(len(portfolio))]
+    if memory_limit:
+        memory_limit = max(memory_limit // len(portfolio), 1)
+
+    async def run_solver(i):
+        return (i,) + await run_process(
+            portfolio[i] + [cnf_file, out_files[i]], semaphore,
+            deadline=deadline,
+            preexec_fn=get_rlimit_preexec_fn(
+                memory_limit, get_remaining_time(deadline)))
+
+    tasks = [asyncio.ensure_future(run_solver(i))
+             for i in range(len(portfolio))]
+    try:
+        failures = []
+        for answer in asyncio.as_completed(tasks):
+            i, returncode, solver_output, solver_error_output = \
+                await answer
+            if get_sat_answer(returncode, solver_output):
+                if os.path.exists(out_files[i]):
+                    os.rename(out_files[i], out_file)
+                return i, returncode, solver_output, solver_error_output
+            failures.append(
+                (i, returncode, solver_output, solver_error_output))
+        raise_portfolio_failure(portfolio, failures, deadline, memory_limit)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # run_process kills the process of a cancelled task
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for solver_out_file in out_files:
+            if os.path.exists(solver_out_file):
+                os.remove(solver_out_file)
+
+
+async def run_sugar_async(sugar_args, sugarjar_path, semaphore,
+                          deadline=None, memory_limit=None):
+    sugar_cmd = get_java_cmd(memory_limit) + \
+        ['-jar', sugarjar_path] + list(sugar_args)
+    returncode, output, error_output = await run_process(
+        sugar_cmd, semaphore, deadline=deadline)
+    if returncode:
+        if memory_limit and 'java.lang.OutOfMemoryError' in \
+                output + error_output:
+            raise LimitReached('memory')
+        raise subprocess.CalledProcessError(
+            returncode, sugar_cmd, output=output)
+    return output
+
+
+async def run_solve_steps_async(steps, semaphore=None):
+    """Coroutine version of csp_solver.run_solve_steps: sugar and
+    minisat steps, also every solver of a portfolio, run as asyncio
+    subprocesses limited by semaphore (default get_process_semaphore),
+    call steps in the default executor.
+    A cancelled task is thrown into the steps, so they clean up."""
+    if semaphore is None:
+        semaphore = get_process_semaphore()
+    value, exc_info = None, None
+    while True:
+        if exc_info is None:
+            step = steps.send(value)
+        else:
+            step = steps.throw(*exc_info)
+        value, exc_info = None, None
+        if step[0] == 'result':
+            steps.close()
+            return step[1]
+        try:
+            if step[0] == 'sugar':
+                sugar_args, sugarjar_path, deadline, memory_limit = step[1:]
+                value = await run_sugar_async(
+                    sugar_args, sugarjar_path, semaphore,
+                    deadline=deadline, memory_limit=memory_limit)
+            elif step[0] == 'minisat':
+                solver_cmd, deadline, memory_limit = step[1:]
+                value = await run_sat_solver_async(
+                    solver_cmd, semaphore,
+                    deadline=deadline, memory_limit=memory_limit)
+            elif step[0] == 'portfolio':
+                value = await race_sat_solvers_async(
+                    *step[1:4], semaphore=semaphore,
+                    deadline=step[4], memory_limit=step[5])
+            elif step[0] == 'call':
+                value = await asyncio.get_event_loop().run_in_executor(
+                    None, step[1])
+            elif step[0] == 'steps':
+                value = await run_solve_steps_async(step[1], semaphore)
+            else:
+                raise ValueError("unknown step {0!r}".format(step[0]))
+        except BaseException:
+            exc_info = sys.exc_info()
+
+
+def check_async_options(kwargs):
+    for option in ('sugar_worker', 'cnf_stream'):
+        if kwargs.get(option):
+            raise ConfigurationException(
+                "{0} needs a SugarWorker, which the async "
+                "versions do not support".format(option))
+
+
+async def solve_csp_async(csp_file, remove_tmp_files, csp_solver_config,
+                          *, semaphore=None, **kwargs):
+    """Coroutine version of solve_csp, returns (time, result) as well.
+    semaphore bounds the concurrent child processes, see
+    run_solve_steps_async."""
+    check_async_options(kwargs)
+    b = time.time()
+    result = await run_solve_steps_async(
+        iter_solve_csp_steps(csp_file, remove_tmp_files, csp_solver_config,
+                             **kwargs),
+        semaphore)
+    return time.time() - b, result
+
+
+async def do_solve_async(variables, reference_value, csp_solver_config,
+                         *, semaphore=None, **kwargs):
+    """Coroutine version of do_solve, see solve_csp_async."""
+    check_async_options(kwargs)
+    return await run_solve_steps_async(
+        iter_do_solve_steps(variables, reference_value, csp_solver_config,
+                            **kwargs),
+        semaphore)
@@ -0,0 +1,134 @@
+"""Solving many weighted sum problems as one batch.
+
+do_solve_many validates the solver configuration once and gives the
+batch its own scratch folder inside tmp_folder, in which every job's
+files get unique names. Jobs run in a multiprocessing pool and results
+are yielded as the jobs finish, not in submission order. BatchStats
+counts submitted and completed jobs for throughput and queue depth.
+"""
+from __future__ import print_function
+
+import shutil
+import tempfile
+import threading
+import time
+
+from csp_solver import (
+    ConfigurationException,
+    SugarWorker,
+    ValidCspSolverConfig,
+    do_solve,
+    ensure_valid_csp_solver_config
+)
+
+
+class BatchStats(object):
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.started = time.time()
+        self.finished = None
+
+    def submit(self):
+        with self._lock:
+            self.submitted += 1
+
+    def complete(self):
+        with self._lock:
+            self.completed += 1
+
+    def finish(self):
+        self.finished = time.time()
+
+    @property
+    def queue_depth(self):
+        """Submitted jobs without a result yet."""
+        return self.submitted - self.completed
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def jobs_per_second(self):
+        elapsed = self.elapsed
+        return self.completed / elapsed if elapsed else 0.0
+
+    def as_dict(self):
+        return dict(
+            submitted=self.submitted,
+            completed=self.completed,
+            queue_depth=self.queue_depth,
+            elapsed=self.elapsed,
+            jobs_per_second=self.jobs_per_second
+        )
+
+
+def _solve_problem(job):
+    # multiprocessing needs a picklable module level function
+    problem_id, do_solve_kwargs = job
+    return problem_id, do_solve(**do_solve_kwargs)
+
+
+def do_solve_many(problems, csp_solver_config, workers=1, stats=None,
+                  chunksize=1, **do_solve_kwargs):
+    """Yields (problem_id, result) for every (problem_id, variables,
+    reference_value) of problems as soon as its do_solve finished.
+
+    do_solve_kwargs are passed to every do_solve. With workers > 1 they
+    have to be picklable, use sugar_worker=True to give every pool
+    process its own SugarWorker. Pass a BatchStats as stats to watch the
+    batch while it runs. The scratch folder is removed when the
+    generator is exhausted or closed, unless remove_tmp_files=False."""
+    if workers > 1 and isinstance(
+            do_solve_kwargs.get('sugar_worker'), SugarWorker):
+        raise ConfigurationException(
+            "A SugarWorker can not be shared by pool processes, "
+            "pass sugar_worker=True")
+
+    csp_solver_config = ensure_valid_csp_solver_config(csp_solver_config)
+    workspace = tempfile.mkdtemp(
+        prefix='csp_batch_', dir=csp_solver_config['tmp_folder'])
+    csp_solver_config = ValidCspSolverConfig(
+        csp_solver_config, tmp_folder=workspace)
+
+    if stats is None:
+        stats = BatchStats()
+    stats.start()
+
+    def iter_jobs():
+        for problem_id, variables, reference_value in problems:
+            stats.submit()
+            yield problem_id, dict(
+                do_solve_kwargs,
+                variables=variables,
+                reference_value=reference_value,
+                csp_solver_config=csp_solver_config
+            )
+
+    pool = None
+    try:
+        if workers > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(workers)
+            solved = pool.imap_unordered(
+                _solve_problem, iter_jobs(), chunksize)
+        else:
+            solved = (_solve_problem(job) for job in iter_jobs())
+        for problem_id, result in solved:
+            stats.complete()
+            yield problem_id, result
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if do_solve_kwargs.get('remove_tmp_files', True):
+            shutil.rmtree(workspace, ignore_errors=True)
+        stats.finish()
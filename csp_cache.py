@@ -0,0 +1,232 @@
+"""Content addressed on-disk cache for solve results.
+
+Entries are JSON files named by the SHA-1 of the whitespace normalized CSP
+text plus the SHA-1 of the sugar jar and the minisat binary, so updating
+a solver never returns stale results. Files are written to a temporary
+name and renamed into place, which makes the folder safe to share between
+processes. A hit touches the entry; when the folder grows beyond max_size
+the least recently used entries are removed.
+"""
+from __future__ import print_function
+
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+# evict down to this fraction of max_size to not evict on every store
+CACHE_LOW_WATERMARK = 0.9
+
+# rescan the folder after that many stores to see other processes' entries
+CACHE_RESCAN_INTERVAL = 100
+
+
+_file_hashes = {}
+_cache_lock = threading.Lock()
+
+
+def _to_bytes(text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return text
+
+
+def get_file_hash(file_name):
+    """SHA-1 of a file, memoized as long as size and mtime don't change."""
+    stat = os.stat(file_name)
+    memo_key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime)
+    if memo_key not in _file_hashes:
+        file_hash = hashlib.sha1()
+        with open(file_name, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 20), b''):
+                file_hash.update(block)
+        _file_hashes[memo_key] = file_hash.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def get_solver_versions(csp_solver_config):
+    versions = 'sugar:{0} minisat:{1}'.format(
+        get_file_hash(csp_solver_config['sugarjar_path']),
+        get_file_hash(csp_solver_config['minisat_path'])
+    )
+    if csp_solver_config.get('sat_library_path'):
+        versions += ' sat_library:{0}'.format(
+            get_file_hash(csp_solver_config['sat_library_path']))
+    return versions
+
+
+def iter_canonical_tokens(csp_pieces):
+    """Whitespace separated tokens of text given in arbitrary pieces."""
+    rest = ''
+    for csp_piece in csp_pieces:
+        tokens = (rest + csp_piece).split()
+        if tokens and csp_piece and not csp_piece[-1].isspace():
+            rest = tokens.pop()
+        else:
+            rest = ''
+        for token in tokens:
+            yield token
+    if rest:
+        yield rest
+
+
+def get_cache_key(csp_content, csp_solver_config, options=()):
+    """Canonical key of a problem: whitespace differences in the CSP
+    text do not matter, solver binaries and options do. csp_content
+    is a string or an iterable of pieces like iter_weighted_sum_csp."""
+    if isinstance(csp_content, basestring):
+        csp_content = [csp_content]
+    cache_key = hashlib.sha1()
+    separator = b''
+    for token in iter_canonical_tokens(csp_content):
+        cache_key.update(separator + _to_bytes(token))
+        separator = b' '
+    for part in [get_solver_versions(csp_solver_config)] + list(options):
+        cache_key.update(b'\0' + _to_bytes(part))
+    return cache_key.hexdigest()
+
+
+class ResultCache(object):
+    def __init__(self, cache_folder, max_size=CACHE_MAX_SIZE):
+        self.cache_folder = os.path.abspath(cache_folder)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._size = None
+        self._stores_since_scan = 0
+        _makedirs(self.cache_folder)
+
+    def _get_entry_file(self, cache_key):
+        return os.path.join(
+            self.cache_folder, cache_key[:2], '{0}.json'.format(cache_key))
+
+    def get(self, cache_key):
+        """Returns the stored result dict or None."""
+        entry_file = self._get_entry_file(cache_key)
+        try:
+            with open(entry_file) as entry_fp:
+                result = json.load(entry_fp)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            # mtime is the LRU clock
+            os.utime(entry_file, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return result
+
+    def put(self, cache_key, result):
+        entry_file = self._get_entry_file(cache_key)
+        entry_folder = os.path.dirname(entry_file)
+        _makedirs(entry_folder)
+        tmp_fd, tmp_file = tempfile.mkstemp(dir=entry_folder, suffix='.tmp')
+        try:
+            with os.fdopen(tmp_fd, 'w') as tmp_fp:
+                json.dump(result, tmp_fp)
+            getattr(os, 'replace', os.rename)(tmp_file, entry_file)
+        except:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        self.stores += 1
+        self._stores_since_scan += 1
+        if self._size is not None:
+            self._size += os.path.getsize(entry_file)
+        if (self._size is None or
+                self._size > self.max_size or
+                self._stores_since_scan >= CACHE_RESCAN_INTERVAL):
+            self.evict()
+
+    def _iter_entries(self):
+        for folder, _, file_names in os.walk(self.cache_folder):
+            for file_name in file_names:
+                if not file_name.endswith('.json'):
+                    continue
+                entry_file = os.path.join(folder, file_name)
+                try:
+                    stat = os.stat(entry_file)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, entry_file
+
+    def evict(self):
+        """Removes least recently used entries until the folder is below
+        the low watermark if it is above max_size."""
+        with self._locked():
+            entries = sorted(self._iter_entries())
+            size = sum(entry_size for _, entry_size, _ in entries)
+            if size > self.max_size:
+                low_watermark = self.max_size * CACHE_LOW_WATERMARK
+                for _, entry_size, entry_file in entries:
+                    if size <= low_watermark:
+                        break
+                    try:
+                        os.remove(entry_file)
+                        self.evictions += 1
+                    except OSError as exc:
+                        if exc.errno != errno.ENOENT:
+                            raise
+                    size -= entry_size
+            self._size = size
+            self._stores_since_scan = 0
+
+    def clear(self):
+        with self._locked():
+            for _, _, entry_file in list(self._iter_entries()):
+                try:
+                    os.remove(entry_file)
+                except OSError:
+                    pass
+            self._size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            stores=self.stores,
+            evictions=self.evictions,
+            hit_rate=float(self.hits) / lookups if lookups else 0.0
+        )
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with _cache_lock:
+            if fcntl is None:
+                yield
+                return
+            lock_file = os.path.join(self.cache_folder, '.lock')
+            with open(lock_file, 'a') as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+
+def _makedirs(folder):
+    try:
+        os.makedirs(folder)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
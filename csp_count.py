@@ -0,0 +1,196 @@
+"""Exact solution counting and uniform sampling for weighted sums.
+
+The number of assignments of variables that sum up to K is the
+coefficient of x**K in the product of the generating polynomials
+sum(x**value for value in domain). Domains are shifted to start at 0
+like in csp_dp and variables with the same domain share one polynomial
+that is raised to the size of the domain class (csp_symmetry), halving
+the exponent, so thousands of variables need few multiplications.
+
+Polynomials are lists of python integers, counts are exact. Two are
+multiplied by packing their coefficients into one big number each, in
+digit slots wide enough for the largest possible coefficient, so one
+big number multiplication does the convolution. With the C decimal
+module (python 3) the numbers are decimals, which it multiplies with a
+number theoretic transform, many times faster than the Karatsuba
+multiplication of python integers used otherwise. Coefficients beyond
+K are dropped, a target above the middle of the sum range is mirrored
+to keep K small.
+
+The prefix products over the domain classes are kept to draw solutions
+uniformly: walking back from the last class, the part of the sum a
+class contributes is chosen with probability proportional to the
+number of solutions it leaves, and inside a class the part is split
+the same way between halves of its variables.
+"""
+from __future__ import print_function
+
+import random
+
+from csp_symmetry import get_domain_classes
+
+try:
+    import _decimal
+except ImportError:
+    _decimal = None
+
+
+def multiply_polynomials(a, b, bound, max_degree):
+    """Coefficients of a * b up to x**max_degree, bound is at least as
+    big as every coefficient of the product."""
+    length = min(len(a) + len(b) - 1, max_degree + 1)
+    if _decimal is not None:
+        Decimal = _decimal.Decimal
+        digits = len(str(Decimal(bound)))
+        context = _decimal.Context(
+            prec=_decimal.MAX_PREC, Emax=_decimal.MAX_EMAX)
+        text = str(context.multiply(*[
+            Decimal(''.join(str(Decimal(c)).zfill(digits)
+                            for c in reversed(polynomial)))
+            for polynomial in (a, b)]))
+        text = text[-digits * length:].zfill(digits * length)
+        end = len(text)
+        # int(str) is limited to 4300 digits by python 3.11, int(Decimal)
+        # is not
+        return [int(Decimal(text[end - (i + 1) * digits:end - i * digits]))
+                for i in range(length)]
+
+    digits = len('%x' % bound)
+    product = int(''.join('%0*x' % (digits, c) for c in reversed(a)), 16) \
+        * int(''.join('%0*x' % (digits, c) for c in reversed(b)), 16)
+    product &= (1 << (4 * digits * length)) - 1
+    text = '%0*x' % (digits * length, product)
+    end = len(text)
+    return [int(text[end - (i + 1) * digits:end - i * digits], 16)
+            for i in range(length)]
+
+
+def choose_index(rng, weights, total):
+    """Index i with probability weights[i] / total."""
+    r = rng.randrange(total)
+    for i, weight in enumerate(weights):
+        if r < weight:
+            return i
+        r -= weight
+    raise AssertionError("weights do not add up to {0}".format(total))
+
+
+class WeightedSumCounter(object):
+    """The count tables of sum(variables) == reference_value, count is
+    the number of solutions."""
+
+    def __init__(self, variables, reference_value):
+        classes, self.variable_classes = get_domain_classes(variables)
+        offset = sum(values[0] * size for values, size in classes)
+        max_sum = sum((values[-1] - values[0]) * size
+                      for values, size in classes)
+        self.target = reference_value - offset
+        # counting from the other end keeps the polynomials shorter
+        self.mirrored = 2 * self.target > max_sum
+        if self.mirrored:
+            self.target = max_sum - self.target
+            classes = [[[-value for value in reversed(values)], size]
+                       for values, size in classes]
+        self.classes = classes
+
+        self.count = 0
+        if self.target < 0 or any(not values for values, _ in classes):
+            return
+
+        # class_powers[c][k] is the polynomial of k variables of class c
+        self.class_powers = []
+        # layers[c] counts the sums of the classes before c, with bounds
+        self.layers = [([1], 1)]
+        for values, size in classes:
+            polynomial = [0] * (values[-1] - values[0] + 1)
+            for value in values:
+                polynomial[value - values[0]] = 1
+            powers = {1: (polynomial[:self.target + 1], len(values))}
+            self.class_powers.append(powers)
+            class_polynomial, class_bound = self.get_power(powers, size)
+            layer, bound = self.layers[-1]
+            self.layers.append((multiply_polynomials(
+                layer, class_polynomial, bound * class_bound, self.target),
+                bound * class_bound))
+
+        layer, _ = self.layers[-1]
+        if self.target < len(layer):
+            self.count = layer[self.target]
+
+    def get_power(self, powers, exponent):
+        if exponent not in powers:
+            half = exponent // 2
+            a, a_bound = self.get_power(powers, half)
+            b, b_bound = self.get_power(powers, exponent - half)
+            powers[exponent] = (multiply_polynomials(
+                a, b, a_bound * b_bound, self.target), a_bound * b_bound)
+        return powers[exponent]
+
+    def coefficient(self, polynomial, degree):
+        if 0 <= degree < len(polynomial):
+            return polynomial[degree]
+        return 0
+
+    def split(self, powers, exponent, total, rng):
+        """Shifted values of exponent variables of one class that add up
+        to total, uniformly drawn."""
+        if exponent == 1:
+            return [total]
+        half = exponent // 2
+        a, _ = self.get_power(powers, half)
+        b, _ = self.get_power(powers, exponent - half)
+        weights = [self.coefficient(a, part) *
+                   self.coefficient(b, total - part)
+                   for part in range(min(total, len(a) - 1) + 1)]
+        part = choose_index(
+            rng, weights, self.coefficient(
+                self.get_power(powers, exponent)[0], total))
+        return self.split(powers, half, part, rng) + \
+            self.split(powers, exponent - half, total - part, rng)
+
+    def sample(self, rng=random):
+        """A solution_list drawn uniformly from all solutions, None if
+        there is none."""
+        if not self.count:
+            return None
+        remaining = self.target
+        class_values = [None] * len(self.classes)
+        for class_index in range(len(self.classes) - 1, -1, -1):
+            values, size = self.classes[class_index]
+            powers = self.class_powers[class_index]
+            class_polynomial, _ = self.get_power(powers, size)
+            layer, _ = self.layers[class_index]
+            weights = [self.coefficient(class_polynomial, part) *
+                       self.coefficient(layer, remaining - part)
+                       for part in range(
+                           min(remaining, len(class_polynomial) - 1) + 1)]
+            part = choose_index(
+                rng, weights,
+                self.coefficient(self.layers[class_index + 1][0], remaining))
+            shifted = self.split(powers, size, part, rng)
+            # handed out from the end
+            class_values[class_index] = [
+                value + values[0] for value in reversed(shifted)]
+            remaining -= part
+
+        solution_list = [class_values[class_index].pop()
+                         for class_index in self.variable_classes]
+        if self.mirrored:
+            solution_list = [-value for value in solution_list]
+        return solution_list
+
+
+def count_solutions(variables, reference_value):
+    """Number of assignments of variables that sum up to
+    reference_value, an exact python integer."""
+    return WeightedSumCounter(variables, reference_value).count
+
+
+def sample_solutions(variables, reference_value, n, rng=random):
+    """n solution_lists drawn uniformly and independently (so possibly
+    repeated) from all solutions, an empty list if there is none. rng
+    is a random.Random to make the draws reproducible."""
+    counter = WeightedSumCounter(variables, reference_value)
+    if not counter.count:
+        return []
+    return [counter.sample(rng) for _ in range(n)]
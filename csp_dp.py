@@ -0,0 +1,96 @@
+"""Reachability dynamic programming for pure weighted sum problems.
+
+Everything do_solve generates is one (weightedsum ... eq K) over small
+integer domains. Shifting every domain to start at 0 turns it into a
+subset-sum style problem: layer i holds the sums reachable with the first
+i variables as bits of a python integer, so adding a variable is one
+shift-and-or per domain value. The layers are kept to backtrack a
+solution. Only sums up to the target matter because shifted values are
+never negative, which bounds every layer by K - sum(min).
+"""
+from __future__ import print_function
+
+import time
+
+
+# bytes the stored layers may take before do_solve falls back to sugar
+DP_MEMORY_LIMIT = 64 * 1024 * 1024
+
+
+def get_shifted_domains(variables):
+    """Returns (offset, domains) with every domain sorted and shifted to
+    start at 0. offset is the sum of the domain minimums."""
+    offset = 0
+    domains = []
+    for variable in variables:
+        values = sorted(set(variable))
+        if not values:
+            return None, None
+        offset += values[0]
+        domains.append([value - values[0] for value in values])
+    return offset, domains
+
+
+def get_dp_table_size(variables, reference_value):
+    """Bytes needed for the reachability layers, 0 if the problem is
+    infeasible before any layer is built."""
+    offset, domains = get_shifted_domains(variables)
+    if domains is None:
+        return 0
+    target = reference_value - offset
+    if target < 0 or target > sum(domain[-1] for domain in domains):
+        return 0
+    return (len(domains) + 1) * (target // 8 + 1)
+
+
+def solve_weighted_sum(variables, reference_value,
+                       memory_limit=DP_MEMORY_LIMIT):
+    """Solves sum(variables) == reference_value.
+
+    Returns a result dict with satisfiable_bool, solution_list and
+    dp_time or None if the layers would need more than memory_limit
+    bytes. The solution prefers the smallest value of each variable,
+    starting from the last one.
+    """
+    b = time.time()
+    dp_table_size = get_dp_table_size(variables, reference_value)
+    if dp_table_size > memory_limit:
+        return None
+
+    result = {
+        'dp_table_size': dp_table_size,
+        'satisfiable_bool': False,
+        'solution_list': None,
+    }
+    offset, domains = get_shifted_domains(variables)
+    if not dp_table_size:
+        result['dp_time'] = time.time() - b
+        return result
+
+    target = reference_value - offset
+    mask = (1 << (target + 1)) - 1
+    layers = [1]
+    for domain in domains:
+        previous = layers[-1]
+        reachable = 0
+        for value in domain:
+            reachable |= previous << value
+        layers.append(reachable & mask)
+
+    if (layers[-1] >> target) & 1:
+        solution_list = []
+        remaining = target
+        for i in range(len(domains) - 1, -1, -1):
+            previous = layers[i]
+            for value in domains[i]:
+                if value <= remaining and \
+                        (previous >> (remaining - value)) & 1:
+                    break
+            solution_list.append(value + min(variables[i]))
+            remaining -= value
+        solution_list.reverse()
+        result['satisfiable_bool'] = True
+        result['solution_list'] = solution_list
+
+    result['dp_time'] = time.time() - b
+    return result
@@ -0,0 +1,416 @@
+"""Pure python replacement for sugar -encode.
+
+Compiles the part of the sugar CSP language that csp_solver generates,
+domain, int and weightedsum compared with eq, le, ge, lt or gt, to
+DIMACS CNF plus a .map file in sugar's format, so encoding needs no JVM.
+
+Integer variables use the order encoding sugar uses: SAT variable code+i
+means 'x <= i-th domain value' (see csp_solver.decode_order_encoding).
+A linear sum is added up by a balanced tree of order encoded partial
+sums (a totalizer). A partial sum only keeps the values that are
+reachable and can still satisfy the comparison given the bounds of the
+other terms, which keeps the adders of equality constraints small.
+Clauses are streamed to the CNF file and the header is rewritten at the
+end, like sugar does.
+"""
+from __future__ import print_function
+
+import array
+import bisect
+import os
+import re
+
+
+# room for 'p cnf <variables> <clauses>' that is written last
+CNF_HEADER_WIDTH = 64
+
+RELATIONS = ('eq', 'le', 'ge', 'lt', 'gt')
+
+_token_re = re.compile(r'\(|\)|;|[^\s();]+')
+
+
+class EncodeException(Exception):
+    pass
+
+
+def iter_csp_tokens(csp_fp, chunk_size=1 << 16):
+    """Yields the parentheses and atoms of a CSP file read in chunks,
+    ';' comments are skipped."""
+    rest = ''
+    in_comment = False
+    while True:
+        chunk = csp_fp.read(chunk_size)
+        text = rest + chunk
+        rest = ''
+        position = 0
+        while position < len(text):
+            if in_comment:
+                newline = text.find('\n', position)
+                if newline < 0:
+                    break
+                in_comment = False
+                position = newline + 1
+                continue
+            match = _token_re.search(text, position)
+            if match is None:
+                break
+            token = match.group()
+            if chunk and match.end() == len(text) and token not in '();':
+                # the atom might continue in the next chunk
+                rest = token
+                break
+            position = match.end()
+            if token == ';':
+                in_comment = True
+            else:
+                yield token
+        if not chunk:
+            return
+
+
+def iter_csp_expressions(csp_fp):
+    """Yields the top level s-expressions of a CSP file as nested lists
+    of atoms."""
+    stack = []
+    for token in iter_csp_tokens(csp_fp):
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            if not stack:
+                raise EncodeException("Unbalanced ')'")
+            expression = stack.pop()
+            if stack:
+                stack[-1].append(expression)
+            else:
+                yield expression
+        elif stack:
+            stack[-1].append(token)
+        else:
+            raise EncodeException("Unexpected atom {0}".format(token))
+    if stack:
+        raise EncodeException("Unbalanced '('")
+
+
+def parse_domain(domain_expression):
+    """Sorted values of '(lb ub)' style bounds or a list of values and
+    (lb ub) ranges, as a compact array."""
+    if len(domain_expression) == 2 and \
+            not isinstance(domain_expression[0], list):
+        lb, ub = domain_expression
+        return array.array('l', range(int(lb), int(ub) + 1))
+    if len(domain_expression) != 1 or \
+            not isinstance(domain_expression[0], list):
+        raise EncodeException(
+            "Invalid domain {0}".format(domain_expression))
+    values = set()
+    for value in domain_expression[0]:
+        if isinstance(value, list):
+            lb, ub = value
+            values.update(range(int(lb), int(ub) + 1))
+        else:
+            values.add(int(value))
+    return array.array('l', sorted(values))
+
+
+def negate(literal):
+    if literal is True or literal is False:
+        return not literal
+    return -literal
+
+
+class OrderVariable(object):
+    """Integer with sorted domain values, SAT variable code+i is
+    'x <= values[i]'. A domain of size n needs n-1 SAT variables."""
+
+    __slots__ = ('values', 'code')
+
+    def __init__(self, values, code):
+        self.values = values
+        self.code = code
+
+    def le(self, bound):
+        """Literal for x <= bound, True or False if that is constant."""
+        index = bisect.bisect_right(self.values, bound) - 1
+        if index < 0:
+            return False
+        if index >= len(self.values) - 1:
+            return True
+        return self.code + index
+
+
+class Term(object):
+    """coefficient * variable as a read only order encoded integer."""
+
+    __slots__ = ('variable', 'coefficient', 'values')
+
+    def __init__(self, variable, coefficient):
+        self.variable = variable
+        self.coefficient = coefficient
+        self.values = array.array('l', sorted(
+            coefficient * value for value in variable.values))
+
+    def le(self, bound):
+        if self.coefficient > 0:
+            return self.variable.le(bound // self.coefficient)
+        # c * x <= bound is x >= ceil(bound / c)
+        return negate(self.variable.le(
+            -(-bound // self.coefficient) - 1))
+
+
+class CnfWriter(object):
+    """Streams clauses to cnf_fp, constant True and False literals are
+    simplified away. close() writes the header."""
+
+    def __init__(self, cnf_fp):
+        self.cnf_fp = cnf_fp
+        self.variable_count = 0
+        self.clause_count = 0
+        self.unsatisfiable = False
+        cnf_fp.write(' ' * CNF_HEADER_WIDTH + '\n')
+
+    def new_variables(self, count):
+        """Returns the code of count new SAT variables."""
+        code = self.variable_count + 1
+        self.variable_count += count
+        return code
+
+    def add_clause(self, literals):
+        clause = []
+        for literal in literals:
+            if literal is True:
+                return
+            if literal is not False:
+                clause.append(literal)
+        if not clause:
+            self.unsatisfiable = True
+        self.write_clause(clause)
+        self.clause_count += 1
+
+    def write_clause(self, clause):
+        clause.append(0)
+        self.cnf_fp.write(' '.join(map(str, clause)) + '\n')
+
+    def add_order_variable(self, values):
+        variable = OrderVariable(
+            values, self.new_variables(max(len(values) - 1, 0)))
+        # x <= values[i] implies x <= values[i + 1]
+        for i in range(len(values) - 2):
+            self.add_clause([-(variable.code + i), variable.code + i + 1])
+        return variable
+
+    def close(self):
+        header = 'p cnf {0} {1}'.format(
+            self.variable_count, self.clause_count)
+        assert len(header) <= CNF_HEADER_WIDTH
+        self.cnf_fp.seek(0)
+        self.cnf_fp.write(header.ljust(CNF_HEADER_WIDTH))
+
+
+class SatSolverWriter(CnfWriter):
+    """Hands the clauses to a csp_sat solver instead of writing DIMACS."""
+
+    def __init__(self, sat_solver):
+        self.sat_solver = sat_solver
+        self.variable_count = 0
+        self.clause_count = 0
+        self.unsatisfiable = False
+
+    def write_clause(self, clause):
+        self.sat_solver.add_clause(clause)
+
+    def close(self):
+        pass
+
+
+def get_sum_values(x_values, y_values, lb, ub):
+    """Sorted values of x + y between lb and ub, computed on a bitset."""
+    x_min, y_min = x_values[0], y_values[0]
+    x_bits = 0
+    for value in x_values:
+        x_bits |= 1 << (value - x_min)
+    sum_bits = 0
+    for value in y_values:
+        sum_bits |= x_bits << (value - y_min)
+    offset = x_min + y_min
+    lb = max(lb, offset)
+    if lb > ub:
+        return array.array('l')
+    sum_bits >>= lb - offset
+    sum_bits &= (1 << (ub - lb + 1)) - 1
+    return array.array('l', (
+        lb + i for i, bit in enumerate(reversed(bin(sum_bits)[2:]))
+        if bit == '1'))
+
+
+def add_sum_clauses(writer, x, y, z):
+    """Clauses for z = x + y of order encoded integers. Clauses implied
+    by a stronger one for the same x value are left out."""
+    z_min, z_max = z.values[0], z.values[-1]
+    for a in x.values:
+        # x <= a and y <= b implies z <= a + b
+        not_x_le = negate(x.le(a))
+        impossible_b = None
+        for b in y.values:
+            if a + b >= z_max:
+                break
+            if a + b < z_min:
+                impossible_b = b
+                continue
+            writer.add_clause([not_x_le, negate(y.le(b)), z.le(a + b)])
+        if impossible_b is not None:
+            writer.add_clause([not_x_le, negate(y.le(impossible_b))])
+
+        # x >= a and y >= b implies z >= a + b
+        x_lt = x.le(a - 1)
+        impossible_b = None
+        for b in reversed(y.values):
+            if a + b <= z_min:
+                break
+            if a + b > z_max:
+                impossible_b = b
+                continue
+            writer.add_clause([x_lt, y.le(b - 1), negate(z.le(a + b - 1))])
+        if impossible_b is not None:
+            writer.add_clause([x_lt, y.le(impossible_b - 1)])
+
+
+def encode_linear(writer, terms, lb, ub):
+    """lb <= sum(terms) <= ub (None for no bound) with a totalizer."""
+    if not terms:
+        if (lb is not None and lb > 0) or (ub is not None and ub < 0):
+            writer.add_clause([])
+        return
+    total_min = sum(term.values[0] for term in terms)
+    total_max = sum(term.values[-1] for term in terms)
+    lb = total_min if lb is None else max(lb, total_min)
+    ub = total_max if ub is None else min(ub, total_max)
+    if lb > ub:
+        writer.add_clause([])
+        return
+    if len(terms) == 1:
+        writer.add_clause([terms[0].le(ub)])
+        writer.add_clause([negate(terms[0].le(lb - 1))])
+        return
+
+    # sums of the bounds of terms[:i]
+    min_prefix, max_prefix = [0], [0]
+    for term in terms:
+        min_prefix.append(min_prefix[-1] + term.values[0])
+        max_prefix.append(max_prefix[-1] + term.values[-1])
+
+    def add_up(start, end):
+        if end - start == 1:
+            return terms[start]
+        middle = (start + end) // 2
+        x = add_up(start, middle)
+        y = add_up(middle, end)
+        # the other terms have to make up for the rest
+        rest_min = total_min - (min_prefix[end] - min_prefix[start])
+        rest_max = total_max - (max_prefix[end] - max_prefix[start])
+        values = get_sum_values(
+            x.values, y.values, lb - rest_max, ub - rest_min)
+        if not values:
+            writer.add_clause([])
+            return x
+        z = writer.add_order_variable(values)
+        add_sum_clauses(writer, x, y, z)
+        return z
+
+    add_up(0, len(terms))
+
+
+def format_map_domain(values):
+    """Domain in the .map format, runs of values as lb..ub."""
+    parts = []
+    start = previous = values[0]
+    for value in values[1:]:
+        if value != previous + 1:
+            parts.append((start, previous))
+            start = value
+        previous = value
+    parts.append((start, previous))
+    return ' '.join(
+        str(lb) if lb == ub else '{0}..{1}'.format(lb, ub)
+        for lb, ub in parts)
+
+
+def encode_csp(csp_file, cnf_file, map_file, sat_solver=None):
+    """Writes the CNF and the .map file for csp_file like sugar -encode
+    and returns what sugar would print: nothing or 's UNSATISFIABLE\\n'
+    (then no files are left behind).
+
+    With a csp_sat solver as sat_solver the clauses are added to it and
+    no CNF file is written, cnf_file is ignored."""
+    if sat_solver is not None:
+        writer = SatSolverWriter(sat_solver)
+        with open(csp_file) as csp_fp:
+            variables, variable_order = encode_csp_expressions(
+                iter_csp_expressions(csp_fp), writer)
+    else:
+        with open(csp_file) as csp_fp:
+            with open(cnf_file, 'w') as cnf_fp:
+                writer = CnfWriter(cnf_fp)
+                variables, variable_order = encode_csp_expressions(
+                    iter_csp_expressions(csp_fp), writer)
+
+    if writer.unsatisfiable:
+        if sat_solver is None:
+            os.remove(cnf_file)
+        return 's UNSATISFIABLE\n'
+
+    with open(map_file, 'w') as map_fp:
+        for name in variable_order:
+            variable = variables[name]
+            map_fp.write('int {0} {1} {2}\n'.format(
+                name, variable.code, format_map_domain(variable.values)))
+    return ''
+
+
+def encode_csp_expressions(expressions, writer):
+    """Adds the clauses of the parsed expressions to writer and closes
+    it, returns the order variables by name and their names in order."""
+    domains = {}
+    variables = {}
+    variable_order = []
+    for expression in expressions:
+        if not expression:
+            raise EncodeException("Empty expression")
+        keyword = expression[0]
+        if keyword == 'domain':
+            domains[expression[1]] = parse_domain(expression[2:])
+        elif keyword == 'int':
+            name = expression[1]
+            if len(expression) == 3 and not isinstance(expression[2], list):
+                if expression[2] not in domains:
+                    raise EncodeException(
+                        "Unknown domain {0}".format(expression[2]))
+                values = domains[expression[2]]
+            else:
+                values = parse_domain(expression[2:])
+            if not values:
+                writer.add_clause([])
+                break
+            variables[name] = writer.add_order_variable(values)
+            variable_order.append(name)
+        elif keyword == 'weightedsum':
+            _, weighted_terms, relation, bound = expression
+            if relation not in RELATIONS:
+                raise EncodeException(
+                    "Unsupported relation {0}".format(relation))
+            terms = []
+            for coefficient, name in weighted_terms:
+                if name not in variables:
+                    raise EncodeException("Unknown variable {0}".format(name))
+                if int(coefficient):
+                    terms.append(Term(variables[name], int(coefficient)))
+            bound = int(bound)
+            lb = {'eq': bound, 'ge': bound, 'gt': bound + 1}.get(relation)
+            ub = {'eq': bound, 'le': bound, 'lt': bound - 1}.get(relation)
+            encode_linear(writer, terms, lb, ub)
+        else:
+            raise EncodeException(
+                "Unsupported expression {0}".format(keyword))
+        if writer.unsatisfiable:
+            break
+    writer.close()
+    return variables, variable_order
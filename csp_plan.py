@@ -0,0 +1,340 @@
+"""Estimates what solving a weighted sum costs before anything is
+encoded, and picks the backend for do_solve(backend='auto').
+
+The CNF estimate follows csp_encoder: every variable is order encoded
+with one SAT variable per domain value but the last, and the sum is
+added up by a balanced tree of partial sums that only keep the values
+between the bounds the other terms leave. Instead of the values the
+tree keeps their range, count and spacing, and the clauses of an adder
+are the pairs of child values whose sum is in range, counted as if the
+values were spread evenly. That is cheap for millions of variables and
+within a small factor of what the encoder writes.
+
+File sizes and minisat memory follow from the counts. minisat keeps
+every clause with its literals and two watches plus a learnt clause
+database that typically grows to the size of the problem, the
+constants below are that in bytes. CnfSizeModel.calibrate fits the
+estimates to the cnf_file_size and map_file_size that solve_csp reports,
+which also corrects for sugar encoding differently than csp_encoder.
+do_solve(backend='auto') calibrates the model of its encoder with every
+result it encoded, so the estimates improve while a process solves.
+
+plan_weighted_sum picks the cheapest backend that fits: dp if its table
+fits dp_memory_limit, otherwise sugar if minisat fits memory_limit (by
+default the memory available on the host) and the CNF and map files fit
+the tmp folder. If neither fits it raises PlanRefused with the estimate
+instead of letting minisat thrash the host.
+"""
+from __future__ import print_function
+
+import os
+import threading
+
+from csp_dp import DP_MEMORY_LIMIT, get_dp_table_size
+from csp_encoder import CNF_HEADER_WIDTH, format_map_domain
+from csp_solver import LimitReached
+
+
+MINISAT_BASE_MEMORY = 16 * 1024 * 1024
+MINISAT_VARIABLE_MEMORY = 100
+MINISAT_CLAUSE_MEMORY = 48
+MINISAT_LITERAL_MEMORY = 4
+# learnt clauses on top of the problem
+MINISAT_LEARNT_FACTOR = 2
+
+
+class PlanRefused(LimitReached):
+    """No backend fits, limit is 'memory' or 'disk' and plan the
+    estimate that plan_weighted_sum refused."""
+
+    def __init__(self, limit, plan):
+        LimitReached.__init__(self, limit)
+        self.plan = plan
+
+    def __str__(self):
+        if self.limit == 'disk':
+            return ("CNF and map files need about {0} MB, the tmp folder "
+                    "has {1} MB free".format(
+                        to_megabytes(self.plan['estimated_cnf_file_size'] +
+                                     self.plan['estimated_map_file_size']),
+                        to_megabytes(self.plan['disk_available'])))
+        return ("minisat needs about {0} MB, {1} MB are available and the "
+                "DP table needs {2} MB".format(
+                    to_megabytes(self.plan['estimated_minisat_memory']),
+                    to_megabytes(self.plan['memory_available']),
+                    to_megabytes(self.plan['dp_table_size'])))
+
+
+def to_megabytes(size):
+    return int(round(size / (1024.0 * 1024.0)))
+
+
+def gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return abs(a)
+
+
+def count_pairs_up_to(t, x_width, y_width):
+    """Pairs (i, j) with 0 <= i <= x_width, 0 <= j <= y_width and
+    i + j <= t."""
+    def triangle(k):
+        return k * (k + 1) // 2 if k > 0 else 0
+    return (triangle(t + 1) - triangle(t - x_width) -
+            triangle(t - y_width) + triangle(t - x_width - y_width - 1))
+
+
+def get_average_digits(n):
+    """Average number of decimal digits of 1..n."""
+    if n < 1:
+        return 1.0
+    total = 0
+    digits, low = 1, 1
+    while low <= n:
+        high = min(n, low * 10 - 1)
+        total += digits * (high - low + 1)
+        digits, low = digits + 1, low * 10
+    return total / float(n)
+
+
+class _Node(object):
+    """Range, number and spacing of the values of an order encoded
+    integer."""
+
+    __slots__ = ('count', 'low', 'high', 'step')
+
+    def __init__(self, count, low, high, step):
+        self.count = count
+        self.low = low
+        self.high = high
+        self.step = step
+
+
+def count_weighted_sum_cnf(variables, reference_value):
+    """Estimated SAT variables, clauses and literals csp_encoder writes
+    for sum(variables) == reference_value, as a dict."""
+    counts = dict(cnf_variable_count=0, cnf_clause_count=0,
+                  cnf_literal_count=0)
+
+    def add_order_variable(count):
+        counts['cnf_variable_count'] += max(count - 1, 0)
+        # x <= values[i] implies x <= values[i + 1]
+        counts['cnf_clause_count'] += max(count - 2, 0)
+        counts['cnf_literal_count'] += 2 * max(count - 2, 0)
+
+    leaves = []
+    for variable in variables:
+        values = sorted(set(variable))
+        if not values:
+            counts['cnf_clause_count'] += 1
+            return counts
+        step = 0
+        for value in values[1:]:
+            step = gcd(step, value - values[0])
+        leaves.append(_Node(len(values), values[0], values[-1], step))
+        add_order_variable(len(values))
+
+    total_min = sum(leaf.low for leaf in leaves)
+    total_max = sum(leaf.high for leaf in leaves)
+    if not total_min <= reference_value <= total_max or len(leaves) < 2:
+        counts['cnf_clause_count'] += 2
+        counts['cnf_literal_count'] += 2
+        return counts
+
+    min_prefix, max_prefix = [0], [0]
+    for leaf in leaves:
+        min_prefix.append(min_prefix[-1] + leaf.low)
+        max_prefix.append(max_prefix[-1] + leaf.high)
+
+    def add_up(start, end):
+        if end - start == 1:
+            return leaves[start]
+        middle = (start + end) // 2
+        x = add_up(start, middle)
+        y = add_up(middle, end)
+        rest_min = total_min - (min_prefix[end] - min_prefix[start])
+        rest_max = total_max - (max_prefix[end] - max_prefix[start])
+        low = max(x.low + y.low, reference_value - rest_max)
+        high = min(x.high + y.high, reference_value - rest_min)
+        step = gcd(x.step, y.step)
+        if low > high:
+            counts['cnf_clause_count'] += 1
+            return x
+        count = min(x.count * y.count,
+                    (high - low) // step + 1 if step else 1)
+        add_order_variable(count)
+
+        # pairs of child values whose sum is in [low, high], on the
+        # grid of the child ranges thinned out to their counts
+        x_width, y_width = x.high - x.low, y.high - y.low
+        offset = x.low + y.low
+        pairs = count_pairs_up_to(high - offset, x_width, y_width) - \
+            count_pairs_up_to(low - offset - 1, x_width, y_width)
+        pairs = pairs * x.count * y.count // (
+            (x_width + 1) * (y_width + 1))
+        # both directions, plus the clauses ruling out sums below and
+        # above the range
+        counts['cnf_clause_count'] += 2 * pairs + 2 * x.count
+        counts['cnf_literal_count'] += 6 * pairs + 4 * x.count
+        return _Node(count, low, high, step)
+
+    add_up(0, len(leaves))
+    return counts
+
+
+def get_map_file_size(variables):
+    """Bytes of the .map file, 'int V<i> <code> <domain>' per
+    variable."""
+    domain_sizes = {}
+    size = 0
+    code_digits = get_average_digits(
+        sum(max(len(set(variable)) - 1, 0) for variable in variables))
+    for variable in variables:
+        domain = frozenset(variable)
+        if domain not in domain_sizes:
+            domain_sizes[domain] = len(
+                format_map_domain(sorted(domain))) if domain else 0
+        size += domain_sizes[domain]
+    size += len(variables) * (
+        len('int V  \n') + get_average_digits(len(variables)) + code_digits)
+    return int(size)
+
+
+class CnfSizeModel(object):
+    """Estimates the CNF of a weighted sum, cnf_factor and map_factor
+    scale the csp_encoder estimate to the encoder in use."""
+
+    def __init__(self, cnf_factor=1.0, map_factor=1.0):
+        self.cnf_factor = cnf_factor
+        self.map_factor = map_factor
+        # [reported, estimated] bytes of all calibrate observations
+        self._sizes = dict(cnf_file_size=[0, 0], map_file_size=[0, 0])
+        self._lock = threading.Lock()
+
+    def get_raw_estimate(self, variables, reference_value):
+        estimate = count_weighted_sum_cnf(variables, reference_value)
+        # ' -123' per literal (about half are negated), ' 0\n' per clause
+        literal_size = get_average_digits(
+            estimate['cnf_variable_count']) + 1.5
+        estimate['cnf_file_size'] = int(
+            CNF_HEADER_WIDTH + 1 +
+            estimate['cnf_literal_count'] * literal_size +
+            estimate['cnf_clause_count'] * 2)
+        estimate['map_file_size'] = get_map_file_size(variables)
+        return estimate
+
+    def estimate(self, variables, reference_value):
+        """Dict of estimated_cnf_variable_count, estimated_cnf_clause_count,
+        estimated_cnf_file_size, estimated_map_file_size and
+        estimated_minisat_memory in bytes."""
+        raw = self.get_raw_estimate(variables, reference_value)
+        scaled = dict(
+            cnf_variable_count=raw['cnf_variable_count'] * self.cnf_factor,
+            cnf_clause_count=raw['cnf_clause_count'] * self.cnf_factor,
+            cnf_literal_count=raw['cnf_literal_count'] * self.cnf_factor,
+            cnf_file_size=raw['cnf_file_size'] * self.cnf_factor,
+            map_file_size=raw['map_file_size'] * self.map_factor,
+        )
+        scaled['minisat_memory'] = MINISAT_BASE_MEMORY + \
+            MINISAT_LEARNT_FACTOR * (
+                scaled['cnf_variable_count'] * MINISAT_VARIABLE_MEMORY +
+                scaled['cnf_clause_count'] * MINISAT_CLAUSE_MEMORY +
+                scaled['cnf_literal_count'] * MINISAT_LITERAL_MEMORY)
+        return dict(('estimated_' + key, int(value))
+                    for key, value in scaled.items())
+
+    def calibrate(self, observations):
+        """Fits the factors to (variables, reference_value, result)
+        triples, result a do_solve result with cnf_file_size and
+        map_file_size, and to the observations of earlier calls.
+        Results without them (UNSATISFIABLE from sugar, dp, the library
+        sat_backend) are skipped. Returns self."""
+        sizes = []
+        for variables, reference_value, result in observations:
+            if 'cnf_file_size' not in result or \
+                    'map_file_size' not in result:
+                continue
+            raw = self.get_raw_estimate(variables, reference_value)
+            sizes.append((result, raw))
+        with self._lock:
+            for result, raw in sizes:
+                for key, sums in self._sizes.items():
+                    sums[0] += result[key]
+                    sums[1] += raw[key]
+            reported, estimated = self._sizes['cnf_file_size']
+            if estimated:
+                self.cnf_factor = reported / float(estimated)
+            reported, estimated = self._sizes['map_file_size']
+            if estimated:
+                self.map_factor = reported / float(estimated)
+        return self
+
+
+# per encoder, do_solve(backend='auto') calibrates them
+cnf_size_models = {
+    'sugar': CnfSizeModel(),
+    'python': CnfSizeModel(),
+}
+
+
+def get_available_memory():
+    """Bytes of memory the host can give a new process, None if
+    unknown."""
+    try:
+        with open('/proc/meminfo') as meminfo_fp:
+            for line in meminfo_fp:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_free_disk_space(folder):
+    """Bytes free in folder for unprivileged users, None if unknown."""
+    try:
+        stat = os.statvfs(folder)
+    except (AttributeError, OSError):
+        return None
+    return stat.f_bavail * stat.f_frsize
+
+
+def plan_weighted_sum(variables, reference_value, tmp_folder=None,
+                      encoder='sugar', sat_backend='subprocess',
+                      memory_limit=None, dp_memory_limit=None,
+                      model=None):
+    """Returns a plan dict: backend ('dp' or 'sugar'), dp_table_size,
+    the estimates of CnfSizeModel.estimate and the memory_available and
+    disk_available they were checked against (None if unknown).
+    Raises PlanRefused if no backend fits.
+
+    memory_limit defaults to the memory available on the host,
+    dp_memory_limit to csp_dp.DP_MEMORY_LIMIT and model to the
+    cnf_size_models entry of encoder. The python encoder with
+    sat_backend 'library' writes no CNF file."""
+    plan = dict(
+        dp_table_size=get_dp_table_size(variables, reference_value))
+    if plan['dp_table_size'] <= (dp_memory_limit or DP_MEMORY_LIMIT):
+        plan['backend'] = 'dp'
+        return plan
+
+    if model is None:
+        model = cnf_size_models[encoder]
+    plan.update(model.estimate(variables, reference_value))
+    plan['memory_available'] = memory_limit or get_available_memory()
+    plan['disk_available'] = None
+    if tmp_folder is not None:
+        plan['disk_available'] = get_free_disk_space(tmp_folder)
+    if plan['memory_available'] is not None and \
+            plan['estimated_minisat_memory'] > plan['memory_available']:
+        raise PlanRefused('memory', plan)
+    writes_cnf = not (encoder == 'python' and sat_backend == 'library')
+    if writes_cnf and plan['disk_available'] is not None and \
+            plan['estimated_cnf_file_size'] + \
+            plan['estimated_map_file_size'] > plan['disk_available']:
+        raise PlanRefused('disk', plan)
+    plan['backend'] = 'sugar'
+    return plan
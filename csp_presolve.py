@@ -0,0 +1,114 @@
+"""Bounds propagation for weighted sum problems before encoding.
+
+For sum(x_i) == K every variable has to satisfy
+K - (sum(max) - max_i) <= x_i <= K - (sum(min) - min_i). Values outside
+these bounds can not appear in any solution and are dropped until
+nothing changes anymore. Variables left with one value are fixed and
+moved into the reference value.
+
+Some problems are decided on the way: an empty domain is UNSATISFIABLE,
+and if all remaining domains are ranges of consecutive integers every
+sum between sum(min) and sum(max) is reachable, so a solution is built
+without a solver.
+"""
+from __future__ import print_function
+
+import bisect
+import time
+
+
+def tighten_domains(domains, reference_value):
+    """Drops values of the sorted domains in place until they are
+    bounds consistent. Returns False if a domain runs empty."""
+    total_min = sum(domain[0] for domain in domains)
+    total_max = sum(domain[-1] for domain in domains)
+    changed = True
+    while changed:
+        if not total_min <= reference_value <= total_max:
+            return False
+        changed = False
+        for i, domain in enumerate(domains):
+            lb = reference_value - (total_max - domain[-1])
+            ub = reference_value - (total_min - domain[0])
+            if domain[0] >= lb and domain[-1] <= ub:
+                continue
+            tightened = domain[bisect.bisect_left(domain, lb):
+                               bisect.bisect_right(domain, ub)]
+            if not tightened:
+                return False
+            total_min += tightened[0] - domain[0]
+            total_max += tightened[-1] - domain[-1]
+            domains[i] = tightened
+            changed = True
+    return True
+
+
+def is_range(domain):
+    return domain[-1] - domain[0] + 1 == len(domain)
+
+
+def get_range_solution(domains, reference_value):
+    """Values of range domains summing up to reference_value, which has
+    to lie between sum(min) and sum(max)."""
+    missing = reference_value - sum(domain[0] for domain in domains)
+    solution_list = []
+    for domain in domains:
+        increase = min(missing, domain[-1] - domain[0])
+        solution_list.append(domain[0] + increase)
+        missing -= increase
+    return solution_list
+
+
+def presolve_weighted_sum(variables, reference_value):
+    """Tightens sum(variables) == reference_value.
+
+    Returns a dict with presolve_time, removed_value_count, fixed_count
+    and status 'UNSATISFIABLE', 'SATISFIABLE' with the solution_list or
+    'REDUCED'. A reduced problem is described by variables and
+    reference_value of the free variables, free_indexes (their
+    positions in the original problem) and solution_list with the
+    values of the fixed variables and None for free ones, see
+    expand_solution."""
+    b = time.time()
+    domains = [sorted(set(variable)) for variable in variables]
+    value_count = sum(len(domain) for domain in domains)
+    presolved = {}
+
+    if any(not domain for domain in domains) or \
+            not tighten_domains(domains, reference_value):
+        presolved['status'] = 'UNSATISFIABLE'
+        presolved['removed_value_count'] = value_count
+        presolved['fixed_count'] = 0
+        presolved['presolve_time'] = time.time() - b
+        return presolved
+
+    presolved['removed_value_count'] = \
+        value_count - sum(len(domain) for domain in domains)
+    free_indexes = [i for i, domain in enumerate(domains) if len(domain) > 1]
+    presolved['fixed_count'] = len(domains) - len(free_indexes)
+
+    if all(is_range(domains[i]) for i in free_indexes):
+        presolved['status'] = 'SATISFIABLE'
+        presolved['solution_list'] = get_range_solution(
+            domains, reference_value)
+    else:
+        presolved['status'] = 'REDUCED'
+        presolved['variables'] = [domains[i] for i in free_indexes]
+        presolved['free_indexes'] = free_indexes
+        presolved['reference_value'] = reference_value - sum(
+            domain[0] for domain in domains if len(domain) == 1)
+        presolved['solution_list'] = [
+            domain[0] if len(domain) == 1 else None for domain in domains]
+    presolved['presolve_time'] = time.time() - b
+    return presolved
+
+
+def expand_solution(presolved, solution_list):
+    """Solution of the original problem from a solution of the reduced
+    one, the None or [] of an unsatisfiable result stays as it is."""
+    if not solution_list:
+        return solution_list
+    expanded = list(presolved['solution_list'])
+    for i, value in zip(presolved['free_indexes'], solution_list):
+        expanded[i] = value
+    return expanded
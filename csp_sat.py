@@ -0,0 +1,235 @@
+"""SAT solver backends for the CNF of a CSP.
+
+'subprocess' runs minisat on the CNF file and reads the model file it
+writes, clauses added later and assumptions go into a copy of the CNF
+for every run. 'library' loads a SAT solver library with the IPASIR
+interface through ctypes (minisat, glucose and cadical build one, e.g.
+libipasirminisat.so from the IPASIR distribution), clauses go to the
+solver from memory and the model is read directly. A library solver is
+incremental: clauses added between solve calls keep what it learned
+so far, assumptions only hold for one solve call.
+
+Both solvers have add_clause, solve(assumptions), get_model and close,
+open_sat_solver returns one loaded with a CNF file.
+"""
+from __future__ import print_function
+
+import ctypes
+import ctypes.util
+import time
+
+from csp_solver import (
+    ConfigurationException,
+    LimitReached,
+    read_minisat_model,
+    solve_cnf_with_clauses
+)
+
+
+# ipasir_solve results, like the minisat exit codes
+IPASIR_SATISFIABLE = 10
+IPASIR_UNSATISFIABLE = 20
+
+TERMINATE_CALLBACK = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p)
+
+_libraries = {}
+
+
+class SatSolverException(Exception):
+    pass
+
+
+def load_sat_library(library_path=None):
+    """The IPASIR library at library_path (default: 'ipasir' found by
+    ctypes.util.find_library), loaded once per process."""
+    if library_path is None:
+        library_path = ctypes.util.find_library('ipasir')
+        if library_path is None:
+            raise ConfigurationException(
+                "Please pass an IPASIR SAT solver library "
+                "as sat_library_path")
+    if library_path in _libraries:
+        return _libraries[library_path]
+
+    try:
+        library = ctypes.CDLL(library_path)
+        library.ipasir_signature.argtypes = []
+        library.ipasir_signature.restype = ctypes.c_char_p
+        library.ipasir_init.argtypes = []
+        library.ipasir_init.restype = ctypes.c_void_p
+        library.ipasir_release.argtypes = [ctypes.c_void_p]
+        library.ipasir_release.restype = None
+        for name in ('ipasir_add', 'ipasir_assume'):
+            function = getattr(library, name)
+            function.argtypes = [ctypes.c_void_p, ctypes.c_int]
+            function.restype = None
+        library.ipasir_solve.argtypes = [ctypes.c_void_p]
+        library.ipasir_solve.restype = ctypes.c_int
+        for name in ('ipasir_val', 'ipasir_failed'):
+            function = getattr(library, name)
+            function.argtypes = [ctypes.c_void_p, ctypes.c_int]
+            function.restype = ctypes.c_int
+        library.ipasir_set_terminate.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, TERMINATE_CALLBACK]
+        library.ipasir_set_terminate.restype = None
+    except (OSError, AttributeError) as exc:
+        raise ConfigurationException(
+            "{0} is not an IPASIR SAT solver library: {1}".format(
+                library_path, exc))
+    _libraries[library_path] = library
+    return library
+
+
+class LibrarySatSolver(object):
+    """One IPASIR solver instance. solve raises LimitReached('timeout')
+    when the solver was stopped at deadline."""
+
+    def __init__(self, library, deadline=None):
+        self.library = library
+        self.handle = library.ipasir_init()
+        self.variable_count = 0
+        self.clause_count = 0
+        self.deadline = deadline
+        self._model = None
+        self._terminate = None
+        if deadline is not None:
+            def terminate(data):
+                return int(time.time() >= deadline)
+            # ctypes must not collect the callback while it is installed
+            self._terminate = TERMINATE_CALLBACK(terminate)
+            library.ipasir_set_terminate(self.handle, None, self._terminate)
+
+    @property
+    def signature(self):
+        return self.library.ipasir_signature().decode('ascii', 'replace')
+
+    def add_clause(self, literals):
+        add = self.library.ipasir_add
+        handle = self.handle
+        for literal in literals:
+            add(handle, literal)
+            if abs(literal) > self.variable_count:
+                self.variable_count = abs(literal)
+        add(handle, 0)
+        self.clause_count += 1
+
+    def add_clauses_from_file(self, cnf_file):
+        """Adds the clauses of a DIMACS CNF file."""
+        add = self.library.ipasir_add
+        handle = self.handle
+        with open(cnf_file) as cnf_fp:
+            for line in cnf_fp:
+                if line[:1] == 'p':
+                    self.variable_count = max(
+                        self.variable_count, int(line.split()[2]))
+                elif line[:1] != 'c':
+                    # the 0 that ends a clause ends it for ipasir_add too
+                    for literal in line.split():
+                        literal = int(literal)
+                        add(handle, literal)
+                        if not literal:
+                            self.clause_count += 1
+
+    def solve(self, assumptions=()):
+        """True if the clauses are satisfiable with all assumptions
+        (literals) true, False otherwise."""
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise LimitReached('timeout')
+        self._model = None
+        for literal in assumptions:
+            self.library.ipasir_assume(self.handle, literal)
+        answer = self.library.ipasir_solve(self.handle)
+        if answer == IPASIR_SATISFIABLE:
+            return True
+        if answer == IPASIR_UNSATISFIABLE:
+            return False
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise LimitReached('timeout')
+        raise SatSolverException(
+            "ipasir_solve returned {0}".format(answer))
+
+    def get_model(self):
+        """The model of the last satisfiable solve as a bitset like
+        csp_solver.read_minisat_model."""
+        if self._model is None:
+            val = self.library.ipasir_val
+            handle = self.handle
+            model = bytearray((self.variable_count >> 3) + 1)
+            for variable in range(1, self.variable_count + 1):
+                if val(handle, variable) > 0:
+                    model[variable >> 3] |= 1 << (variable & 7)
+            self._model = model
+        return self._model
+
+    def failed(self, literal):
+        """True if the assumption literal was used to prove the last
+        solve unsatisfiable."""
+        return bool(self.library.ipasir_failed(self.handle, literal))
+
+    def close(self):
+        if self.handle is not None:
+            self.library.ipasir_release(self.handle)
+            self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class SubprocessSatSolver(object):
+    """Runs minisat on cnf_file for every solve, added clauses and the
+    assumptions go into a copy of it, target_cnf_file."""
+
+    def __init__(self, minisat_path, cnf_file, out_file, target_cnf_file,
+                 deadline=None, memory_limit=None):
+        self.minisat_path = minisat_path
+        self.cnf_file = cnf_file
+        self.out_file = out_file
+        self.target_cnf_file = target_cnf_file
+        self.deadline = deadline
+        self.memory_limit = memory_limit
+        self.clauses = []
+
+    def add_clause(self, literals):
+        self.clauses.append(list(literals))
+
+    def solve(self, assumptions=()):
+        return solve_cnf_with_clauses(
+            self.minisat_path, self.cnf_file, self.out_file,
+            self.clauses + [[literal] for literal in assumptions],
+            self.target_cnf_file,
+            deadline=self.deadline, memory_limit=self.memory_limit)
+
+    def get_model(self):
+        return read_minisat_model(self.out_file)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_sat_solver(sat_backend, csp_solver_config, cnf_file, out_file,
+                    target_cnf_file, deadline=None, memory_limit=None):
+    """A solver of csp_solver.SAT_BACKENDS for the clauses of cnf_file.
+    memory_limit does not apply to a library solver, it runs in this
+    process."""
+    if sat_backend == 'library':
+        solver = LibrarySatSolver(
+            load_sat_library(csp_solver_config.get('sat_library_path')),
+            deadline=deadline)
+        try:
+            solver.add_clauses_from_file(cnf_file)
+        except:
+            solver.close()
+            raise
+        return solver
+    return SubprocessSatSolver(
+        csp_solver_config['minisat_path'], cnf_file, out_file,
+        target_cnf_file, deadline=deadline, memory_limit=memory_limit)
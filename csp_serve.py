@@ -0,0 +1,405 @@
+"""A local solve service, so the processes of a host share one bounded
+set of solver workers instead of each starting java and minisat.
+
+    csp_solver serve --socket /tmp/csp_solver.sock --workers 4 \\
+        --sugar-jar sugar.jar
+
+SolveService keeps a pool of worker processes, each with its own warm
+SugarWorker if asked to, and a priority queue in front of it: requests
+with a higher priority are dispatched first, requests of the same
+priority in arrival order. The queue is bounded, a request that finds
+it full is rejected right away with QueueFullException instead of
+piling up. The service answers newline delimited JSON over a Unix
+domain socket, SolveClient.do_solve has the signature of
+csp_solver.do_solve and SolveClient.stats returns queue depth, latency
+percentiles and throughput.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import errno
+import heapq
+import itertools
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from csp_solver import (
+    add_csp_config_params_to_argparse_parser,
+    do_solve,
+    ensure_valid_csp_solver_config,
+    get_sugar_worker,
+    get_valid_csp_solver_config
+)
+
+
+DEFAULT_SOCKET_PATH = '/tmp/csp_solver.sock'
+
+# do_solve keyword arguments a request may pass, the others are the
+# service's
+REQUEST_OPTIONS = (
+    'decoder', 'backend', 'dp_memory_limit', 'timeout', 'memory_limit',
+    'portfolio', 'encoder', 'presolve', 'value_counts', 'sat_backend'
+)
+
+# requests whose latency the percentiles are computed from
+LATENCY_WINDOW = 1000
+
+
+class ServiceException(Exception):
+    pass
+
+
+class QueueFullException(ServiceException):
+    pass
+
+
+class _Job(object):
+    def __init__(self, kwargs):
+        self.kwargs = kwargs
+        self.submitted = time.time()
+        self.finished = None
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_worker_sugar_worker = None
+
+
+def _init_worker(csp_solver_config, sugar_worker):
+    global _worker_sugar_worker
+    if sugar_worker:
+        _worker_sugar_worker = get_sugar_worker(
+            csp_solver_config['sugarjar_path'],
+            csp_solver_config['tmp_folder'])
+        _worker_sugar_worker.start()
+
+
+def _solve(kwargs):
+    # multiprocessing needs a picklable module level function
+    return do_solve(sugar_worker=_worker_sugar_worker, **kwargs)
+
+
+def get_percentile(sorted_values, percentile):
+    """Nearest rank percentile of sorted_values, None if empty."""
+    if not sorted_values:
+        return None
+    rank = int(round(percentile / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+class SolveService(object):
+    """Solves do_solve requests with workers processes, at most
+    max_queue requests wait. sugar_worker=True starts a SugarWorker in
+    every worker process."""
+
+    def __init__(self, csp_solver_config, workers=2, max_queue=100,
+                 sugar_worker=False):
+        self.csp_solver_config = ensure_valid_csp_solver_config(
+            csp_solver_config)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.sugar_worker = sugar_worker
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self._closed = False
+        self._pool = None
+        self._dispatchers = []
+        self.started = None
+        self.submitted = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        import multiprocessing
+        self.started = time.time()
+        self._pool = multiprocessing.Pool(
+            self.workers, _init_worker,
+            (self.csp_solver_config, self.sugar_worker))
+        # one dispatcher per worker process keeps them all busy
+        for _ in range(self.workers):
+            dispatcher = threading.Thread(target=self._dispatch)
+            dispatcher.daemon = True
+            dispatcher.start()
+            self._dispatchers.append(dispatcher)
+
+    def submit(self, kwargs, priority=0):
+        """Queues do_solve(**kwargs), returns the job to wait for.
+        Raises QueueFullException if max_queue requests are waiting."""
+        unknown = set(kwargs) - set(
+            REQUEST_OPTIONS + ('variables', 'reference_value'))
+        if unknown:
+            raise ServiceException(
+                "unsupported do_solve arguments: {0}".format(
+                    ', '.join(sorted(unknown))))
+        job = _Job(dict(
+            kwargs,
+            csp_solver_config=self.csp_solver_config,
+            quiet=True))
+        with self._condition:
+            if self._closed:
+                raise ServiceException("service is closed")
+            if len(self._queue) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullException(
+                    "{0} requests are queued".format(len(self._queue)))
+            heapq.heappush(
+                self._queue, (-priority, next(self._counter), job))
+            self.submitted += 1
+            self._condition.notify()
+        return job
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                _, _, job = heapq.heappop(self._queue)
+                self.in_flight += 1
+            try:
+                job.result = self._pool.apply(_solve, (job.kwargs,))
+            except Exception as exc:
+                job.error = '{0}: {1}'.format(type(exc).__name__, exc)
+            with self._condition:
+                self.in_flight -= 1
+                if job.error is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                job.finished = time.time()
+                self._latencies.append(job.finished - job.submitted)
+            job.done.set()
+
+    def stats(self):
+        with self._condition:
+            latencies = sorted(self._latencies)
+            stats = dict(
+                workers=self.workers,
+                max_queue=self.max_queue,
+                queue_depth=len(self._queue),
+                in_flight=self.in_flight,
+                submitted=self.submitted,
+                rejected=self.rejected,
+                completed=self.completed,
+                failed=self.failed,
+            )
+        uptime = time.time() - self.started if self.started else 0.0
+        stats['uptime'] = uptime
+        stats['throughput'] = \
+            (stats['completed'] + stats['failed']) / uptime if uptime \
+            else 0.0
+        for percentile in (50, 90, 99):
+            stats['latency_p{0}'.format(percentile)] = get_percentile(
+                latencies, percentile)
+        return stats
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            waiting = [job for _, _, job in self._queue]
+            del self._queue[:]
+            self._condition.notify_all()
+        for job in waiting:
+            job.error = 'ServiceException: service is closed'
+            job.done.set()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        for line in iter(self.rfile.readline, b''):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode('utf-8'))
+                if request.get('method') == 'stats':
+                    response = {'result': service.stats()}
+                else:
+                    job = service.submit(
+                        request['kwargs'], request.get('priority', 0))
+                    job.done.wait()
+                    if job.error is None:
+                        response = {'result': job.result}
+                    else:
+                        response = {'error': job.error}
+            except QueueFullException as exc:
+                response = {'error': str(exc), 'queue_full': True}
+            except Exception as exc:
+                response = {
+                    'error': '{0}: {1}'.format(type(exc).__name__, exc)}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+def remove_stale_socket(socket_path):
+    """Removes socket_path if it is left over from a server that was
+    killed, raises ServiceException if a server still answers there or
+    it is not a socket."""
+    try:
+        mode = os.stat(socket_path).st_mode
+    except OSError as exc:
+        if exc.errno == errno.ENOENT:
+            return
+        raise
+    if not stat.S_ISSOCK(mode):
+        # connecting to a regular file is refused as well
+        raise ServiceException(
+            "{0} exists and is not a socket".format(socket_path))
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except socket.error as exc:
+        if exc.errno == errno.ENOENT:
+            return
+        if exc.errno != errno.ECONNREFUSED:
+            raise
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise ServiceException(
+        "a server is already running on {0}".format(socket_path))
+
+
+class SolveServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        remove_stale_socket(socket_path)
+        socketserver.UnixStreamServer.__init__(
+            self, socket_path, _RequestHandler)
+        self.socket_path = socket_path
+        self.service = service
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+class SolveClient(object):
+    """Talks to a running csp_solver serve, one connection per
+    client. Not thread safe, use a client per thread."""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._socket = None
+        self._fp = None
+
+    def _request(self, request):
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(self.timeout)
+            self._socket.connect(self.socket_path)
+            self._fp = self._socket.makefile('rb')
+        self._socket.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        line = self._fp.readline()
+        if not line:
+            self.close()
+            raise ServiceException("service closed the connection")
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            if response.get('queue_full'):
+                raise QueueFullException(response['error'])
+            raise ServiceException(response['error'])
+        return response['result']
+
+    def do_solve(self, variables, reference_value, csp_solver_config=None,
+                 priority=0, **kwargs):
+        """csp_solver.do_solve on the service, which uses its own
+        csp_solver_config (the argument is accepted so calls can be
+        switched over). kwargs are REQUEST_OPTIONS, requests with a
+        higher priority are solved first. Raises QueueFullException if
+        the service is busy."""
+        return self._request({
+            'kwargs': dict(
+                kwargs, variables=variables,
+                reference_value=reference_value),
+            'priority': priority,
+        })
+
+    def stats(self):
+        return self._request({'method': 'stats'})
+
+    def close(self):
+        if self._socket is not None:
+            self._fp.close()
+            self._socket.close()
+            self._socket = self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='csp_solver serve')
+
+    def positive_int(value):
+        value = int(value)
+        if value < 1:
+            raise argparse.ArgumentTypeError(
+                "Needs to be at least 1: {0}".format(value))
+        return value
+
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH,
+        help="Unix domain socket to listen on")
+    parser.add_argument('--workers', type=positive_int, default=2,
+        help="Worker processes, each solves one request at a time")
+    parser.add_argument('--max-queue', type=positive_int, default=100,
+        help="Requests that may wait, more are rejected")
+    parser.add_argument('--sugar-worker', action="store_true",
+        help="Keep a warm JVM in every worker process (needs javac)")
+    return add_csp_config_params_to_argparse_parser(parser)
+
+
+def main(args=sys.argv[1:]):
+    parsed_args = get_parser().parse_args(args)
+    csp_solver_config = get_valid_csp_solver_config(
+        minisat_path=parsed_args.minisat,
+        sugarjar_path=parsed_args.sugar_jar,
+        tmp_folder=parsed_args.tmp_folder,
+        sat_library_path=parsed_args.sat_library
+    )
+    service = SolveService(
+        csp_solver_config,
+        workers=parsed_args.workers,
+        max_queue=parsed_args.max_queue,
+        sugar_worker=parsed_args.sugar_worker)
+    server = SolveServer(parsed_args.socket, service)
+    service.start()
+    # clean up the socket and the workers when stopped by a service manager
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("Serving on {0} with {1} workers".format(
+        parsed_args.socket, parsed_args.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
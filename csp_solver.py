@@ -1,11 +1,16 @@
 #!/usr/bin/env python
 from __future__ import print_function
 
+import atexit
 import functools
 import hashlib
+import json
 import sys
 import os
+import signal
+import threading
 import time
+import uuid
 import argparse
 import which
 
@@ -35,51 +40,1061 @@ def unique_hash(unique_string):
 get_file_size = lambda file_name: os.stat(file_name).st_size
 
 
-def weighted_sum_to_csp(variables, reference_value):
+def get_unique_repr(name):
+    """Prefix for temporary files that is unique across processes,
+    threads and calls within the same clock tick."""
+    return '{0}_{1}_{2}'.format(name, os.getpid(), uuid.uuid4().hex)
+
+
+def get_process_cpu_time():
+    """User and system time of this process and its waited children."""
+    return sum(os.times()[:4])
+
+
+class LimitReached(Exception):
+    """A solve ran out of its timeout or memory_limit,
+    limit is 'timeout' or 'memory' ('disk' from csp_plan)."""
+
+    def __init__(self, limit):
+        Exception.__init__(self, limit)
+        self.limit = limit
+
+
+def get_remaining_time(deadline):
+    """Seconds left until deadline (None for no deadline),
+    raises LimitReached if it has passed."""
+    if deadline is None:
+        return None
+    remaining_time = deadline - time.time()
+    if remaining_time <= 0:
+        raise LimitReached('timeout')
+    return remaining_time
+
+
+def get_rlimit_preexec_fn(memory_limit=None, cpu_time_limit=None):
+    """preexec_fn for Popen that caps the address space of the child at
+    memory_limit bytes and its CPU time at cpu_time_limit seconds.
+    Not suited for java: the JVM reserves far more address space than
+    it uses and counts GC threads against the CPU time, see get_java_cmd."""
+    if not memory_limit and cpu_time_limit is None:
+        return None
+    import math
+    import resource
+
+    def set_rlimits():
+        if memory_limit:
+            resource.setrlimit(
+                resource.RLIMIT_AS, (memory_limit, memory_limit))
+        if cpu_time_limit is not None:
+            cpu_seconds = int(math.ceil(cpu_time_limit))
+            resource.setrlimit(
+                resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    return set_rlimits
+
+
+def get_java_cmd(memory_limit=None):
+    """java command line with the heap capped at memory_limit bytes."""
+    java_cmd = ['java']
+    if memory_limit:
+        java_cmd.append('-Xmx{0}k'.format(max(memory_limit // 1024, 1024)))
+    return java_cmd
+
+
+def run_sugar(sugar_args, sugarjar_path, timeout=None, memory_limit=None):
+    """Runs java -jar sugar.jar and returns its output, the process is
+    killed and LimitReached raised if a limit is hit."""
+    sugar_cmd = get_java_cmd(memory_limit) + \
+        ['-jar', sugarjar_path] + list(sugar_args)
+    process = subprocess.Popen(
+        sugar_cmd, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE if memory_limit else None,
+        universal_newlines=True)
+    try:
+        output, error_output = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        raise LimitReached('timeout')
+    if process.returncode:
+        if memory_limit and 'java.lang.OutOfMemoryError' in \
+                output + error_output:
+            raise LimitReached('memory')
+        if error_output:
+            sys.stderr.write(error_output)
+        raise subprocess.CalledProcessError(
+            process.returncode, sugar_cmd, output=output)
+    return output
+
+
+def get_reached_limit(deadline, memory_limit, returncode,
+                      output='', error_output=''):
+    """Which limit made a SAT solver exit with returncode, None if it
+    failed for another reason (a parse error, a crash, a bad binary).
+
+    RLIMIT_CPU is set to the remaining time, it sends SIGXCPU (and
+    SIGKILL one second later), so a solver that was signalled that way
+    or ran until the deadline timed out. Out of RLIMIT_AS minisat prints
+    INDETERMINATE, dies of an uncaught std::bad_alloc (SIGABRT) or is
+    killed."""
+    if deadline is not None and (
+            returncode == -signal.SIGXCPU or time.time() >= deadline - 1):
+        return 'timeout'
+    if memory_limit and (
+            returncode in (-signal.SIGABRT, -signal.SIGKILL) or
+            'bad_alloc' in output + error_output or
+            # the loader can not map minisat into the address space
+            'Cannot allocate memory' in error_output or
+            output.startswith('INDETERMINATE')):
+        return 'memory'
+    if deadline is not None and output.startswith('INDETERMINATE'):
+        # interrupted by minisat's SIGXCPU handler
+        return 'timeout'
+    return None
+
+
+def check_minisat_exit(returncode, output, error_output,
+                       deadline=None, memory_limit=None):
+    """Raises LimitReached if minisat gave up because of deadline or
+    memory_limit and an exception if it failed otherwise."""
+    if returncode in [0, 10, 20] and \
+            not output.startswith('INDETERMINATE'):
+        return
+    limit = get_reached_limit(
+        deadline, memory_limit, returncode, output, error_output)
+    if limit is not None:
+        raise LimitReached(limit)
+    if returncode not in [0, 10, 20]:
+        print("Minisat returned {0}".format(returncode))
+        print(error_output)
+        print(output)
+        raise Exception("Error executing minisat!")
+
+
+def get_sat_answer(returncode, solver_output):
+    """'SATISFIABLE', 'UNSATISFIABLE' or None (no answer) from the exit
+    code (10 and 20 by SAT competition convention) or the first line
+    minisat prints."""
+    if returncode == 10:
+        return 'SATISFIABLE'
+    if returncode == 20:
+        return 'UNSATISFIABLE'
+    first_line = (solver_output.splitlines() or [''])[0]
+    if returncode == 0 and first_line in ('SATISFIABLE', 'UNSATISFIABLE'):
+        return first_line
+    return None
+
+
+def start_sat_solver(solver_cmd, deadline=None, memory_limit=None):
+    return subprocess.Popen(
+        solver_cmd,
+        stdout=subprocess.PIPE,stderr=subprocess.PIPE,
+        universal_newlines=True,
+        preexec_fn=get_rlimit_preexec_fn(
+            memory_limit, get_remaining_time(deadline))
+    )
+
+
+def wait_for_minisat(process, deadline=None, memory_limit=None):
+    """Returns (returncode, stdout, stderr) of a minisat process started
+    by start_sat_solver, LimitReached if it ran out of time or memory."""
+    try:
+        minisat_resp, minisat_resp_stderr = process.communicate(
+            timeout=get_remaining_time(deadline))
+    except subprocess.TimeoutExpired:
+        raise LimitReached('timeout')
+    returncode = process.returncode
+    check_minisat_exit(returncode, minisat_resp, minisat_resp_stderr,
+                       deadline, memory_limit)
+    return returncode, minisat_resp, minisat_resp_stderr
+
+
+def get_minisat_cpu_time(minisat_stderr):
+    third_last_line = minisat_stderr.splitlines()[-2:-1][0]
+    return float(third_last_line.split()[-2:-1][0])
+
+
+# minisat 2.2 options for get_minisat_portfolio, restarts, phase saving
+# and random decisions change the runtime on hard instances the most
+MINISAT_PORTFOLIO_FLAGS = [
+    [],
+    ['-no-luby', '-rinc=1.5'],
+    ['-phase-saving=0'],
+    ['-ccmin-mode=1', '-rnd-freq=0.01', '-rnd-seed=7'],
+]
+
+
+def get_minisat_portfolio(minisat_path, size):
+    """size minisat command lines for solve_csp's portfolio, the ones
+    beyond MINISAT_PORTFOLIO_FLAGS differ in their random seed."""
+    portfolio = []
+    for i in range(size):
+        if i < len(MINISAT_PORTFOLIO_FLAGS):
+            flags = MINISAT_PORTFOLIO_FLAGS[i]
+        else:
+            flags = ['-rnd-freq=0.02', '-rnd-seed={0}'.format(i)]
+        portfolio.append([minisat_path] + flags)
+    return portfolio
+
+
+def get_valid_portfolio(portfolio):
+    """Turns portfolio entries (command lines as strings or lists) into
+    argument lists with an existing solver binary."""
+    import shlex
+    valid_portfolio = []
+    for solver_cmd in portfolio:
+        if isinstance(solver_cmd, str):
+            solver_cmd = shlex.split(solver_cmd)
+        solver_cmd = list(solver_cmd)
+        if not solver_cmd:
+            raise ConfigurationException("Empty portfolio command")
+        if not os.path.exists(solver_cmd[0]):
+            try:
+                solver_cmd[0] = which.which(solver_cmd[0])
+            except which.WhichError:
+                raise ConfigurationException(
+                    "Portfolio solver not found: {0}".format(
+                        solver_cmd[0]))
+        valid_portfolio.append(solver_cmd)
+    return valid_portfolio
+
+
+def raise_portfolio_failure(portfolio, failures, deadline=None,
+                            memory_limit=None):
+    """Raises LimitReached if one of the failures, (index, returncode,
+    stdout, stderr) of every solver of portfolio, reached a limit (each
+    solver had memory_limit), an exception otherwise."""
+    for i, returncode, solver_output, solver_error_output in failures:
+        limit = get_reached_limit(
+            deadline, memory_limit, returncode,
+            solver_output, solver_error_output)
+        if limit is not None:
+            raise LimitReached(limit)
+    for i, returncode, _, solver_error_output in failures:
+        print("{0} returned {1}".format(
+            ' '.join(portfolio[i]), returncode))
+        print(solver_error_output)
+    raise Exception("No portfolio solver answered!")
+
+
+def race_sat_solvers(portfolio, cnf_file, out_file,
+                     deadline=None, memory_limit=None):
+    """Runs all solver commands of portfolio at once as
+    <command> cnf_file <model file>, like minisat. The first that
+    answers SATISFIABLE or UNSATISFIABLE wins: its model is moved to
+    out_file and the others are killed. memory_limit is for all of them
+    together, every solver gets memory_limit // len(portfolio) bytes.
+    Returns (winner index, returncode, stdout, stderr)."""
+    try:
+        import queue
+    except ImportError:
+        import Queue as queue
+
+    answers = queue.Queue()
+
+    def wait_for_answer(i, process):
+        solver_output, solver_error_output = process.communicate()
+        answers.put((i, process.returncode,
+                     solver_output, solver_error_output))
+
+    out_files = ['{0}.{1}'.format(out_file, i)
+                 for i in range(len(portfolio))]
+    if memory_limit:
+        memory_limit = max(memory_limit // len(portfolio), 1)
+    processes = []
+    try:
+        for i, solver_cmd in enumerate(portfolio):
+            process = start_sat_solver(
+                solver_cmd + [cnf_file, out_files[i]],
+                deadline, memory_limit)
+            processes.append(process)
+            waiter = threading.Thread(
+                target=wait_for_answer, args=(i, process))
+            waiter.daemon = True
+            waiter.start()
+
+        failures = []
+        for _ in processes:
+            try:
+                i, returncode, solver_output, solver_error_output = \
+                    answers.get(timeout=get_remaining_time(deadline))
+            except queue.Empty:
+                raise LimitReached('timeout')
+            if get_sat_answer(returncode, solver_output):
+                if os.path.exists(out_files[i]):
+                    os.rename(out_files[i], out_file)
+                return i, returncode, solver_output, solver_error_output
+            failures.append(
+                (i, returncode, solver_output, solver_error_output))
+        raise_portfolio_failure(portfolio, failures, deadline, memory_limit)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        for solver_out_file in out_files:
+            if os.path.exists(solver_out_file):
+                os.remove(solver_out_file)
+
+
+# Line based driver around SugarMain.encode/decode. Lives in sugar's package
+# to be able to switch on the package private 'competition' flag for decode.
+# Every request is answered with "<ok|error> <byte count>\n" followed by
+# what sugar printed to stdout while handling it.
+# encode_stream repeats the steps of SugarMain.encode (default options) but
+# sends the CNF to a FIFO while it is generated: Encoder.encode rewrites the
+# header with a seek once all clauses are written, so all writes go through
+# the overridden Encoder.write and the header rewrite hits a tiny file.
+SUGAR_WORKER_SOURCE = """package jp.ac.kobe_u.cs.sugar;
+
+import java.io.BufferedOutputStream;
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.FileInputStream;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.util.List;
+import java.util.zip.GZIPInputStream;
+
+import jp.ac.kobe_u.cs.sugar.converter.Converter;
+import jp.ac.kobe_u.cs.sugar.csp.CSP;
+import jp.ac.kobe_u.cs.sugar.encoder.Encoder;
+import jp.ac.kobe_u.cs.sugar.expression.Expression;
+import jp.ac.kobe_u.cs.sugar.expression.Parser;
+
+public class SugarWorker {
+    static class StreamingEncoder extends Encoder {
+        private final OutputStream cnfStream;
+        long cnfStreamSize = 0;
+
+        StreamingEncoder(CSP csp, OutputStream cnfStream) {
+            super(csp);
+            this.cnfStream = cnfStream;
+        }
+
+        public void write(String s) throws IOException {
+            byte[] bytes = s.getBytes("US-ASCII");
+            cnfStream.write(bytes);
+            cnfStreamSize += bytes.length;
+        }
+    }
+
+    static void encodeStream(String cspFileName, String satFileName,
+            String cnfStreamName, String mapFileName) throws Exception {
+        InputStream in = new FileInputStream(cspFileName);
+        if (cspFileName.endsWith(".gz")) {
+            in = new GZIPInputStream(in);
+        }
+        BufferedReader reader = new BufferedReader(
+            new InputStreamReader(in, "UTF-8"));
+        List expressions;
+        try {
+            expressions = new Parser(reader).parse();
+        } finally {
+            reader.close();
+        }
+        CSP csp = new CSP();
+        Converter.INCREMENTAL_PROPAGATE = true;
+        new Converter(csp).convert(expressions);
+        csp.propagate();
+        if (! csp.isUnsatisfiable()) {
+            if (Encoder.OPT_COMPACT) {
+                csp.compact();
+            }
+            csp.simplify();
+            Expression.clear();
+        }
+        if (csp.isUnsatisfiable()) {
+            Logger.println("s UNSATISFIABLE");
+            return;
+        }
+        OutputStream cnfStream = new BufferedOutputStream(
+            new FileOutputStream(cnfStreamName), 1 << 16);
+        StreamingEncoder encoder = new StreamingEncoder(csp, cnfStream);
+        try {
+            encoder.encode(satFileName, false);
+        } finally {
+            cnfStream.close();
+        }
+        encoder.outputMap(mapFileName);
+        System.out.println("c cnf_stream_size " + encoder.cnfStreamSize);
+    }
+
+    public static void main(String[] args) throws Exception {
+        BufferedReader in = new BufferedReader(
+            new InputStreamReader(System.in, "UTF-8"));
+        PrintStream out = System.out;
+        String line;
+        while ((line = in.readLine()) != null) {
+            String[] request = line.split("\\t");
+            if (request[0].equals("quit")) {
+                break;
+            }
+            ByteArrayOutputStream buffer = new ByteArrayOutputStream();
+            String status = "ok";
+            System.setOut(new PrintStream(buffer, true, "UTF-8"));
+            try {
+                SugarMain sugarMain = new SugarMain();
+                if (request[0].equals("encode") && request.length == 4) {
+                    sugarMain.encode(request[1], request[2], request[3]);
+                } else if (request[0].equals("encode_stream")
+                           && request.length == 5) {
+                    encodeStream(request[1], request[2], request[3],
+                                 request[4]);
+                } else if (request[0].equals("decode") && request.length == 3) {
+                    sugarMain.competition = true;
+                    sugarMain.decode(request[1], request[2]);
+                } else if (!request[0].equals("ping")) {
+                    status = "error";
+                    System.out.println("Invalid request: " + line);
+                }
+            } catch (Throwable e) {
+                status = "error";
+                e.printStackTrace(System.out);
+            } finally {
+                System.out.flush();
+                System.setOut(out);
+            }
+            byte[] payload = buffer.toByteArray();
+            out.print(status + " " + payload.length + "\\n");
+            out.write(payload, 0, payload.length);
+            out.flush();
+        }
+    }
+}
+"""
+
+# smallest problem that makes the JVM load and JIT the encoder classes
+SUGAR_WORKER_WARMUP_CSP = (
+    "(domain D1 (1 2 3))\n(int V1 D1)\n(int V2 D1)\n"
+    "(weightedsum ( ( 1 V1 ) ( 1 V2 ) ) eq 4)\n"
+)
+
+
+class SugarWorkerException(Exception):
+    pass
+
+
+def compile_sugar_worker(sugarjar_path, tmp_folder):
+    """Compiles SUGAR_WORKER_SOURCE once per source version and
+    returns the class folder to put on the classpath."""
+    class_folder = os.path.join(
+        tmp_folder,
+        'sugar_worker_{0}'.format(unique_hash(SUGAR_WORKER_SOURCE.encode('utf-8'))[:12])
+    )
+    if os.path.exists(class_folder):
+        return class_folder
+
+    import shutil
+    import tempfile
+    build_folder = tempfile.mkdtemp(dir=tmp_folder)
+    try:
+        source_file = os.path.join(build_folder, 'SugarWorker.java')
+        with open(source_file, 'w') as source_fp:
+            source_fp.write(SUGAR_WORKER_SOURCE)
+        subprocess.check_call([
+            'javac', '-nowarn', '-cp', sugarjar_path,
+            '-d', build_folder, source_file])
+        os.remove(source_file)
+        try:
+            # another process might have been faster
+            os.rename(build_folder, class_folder)
+        except OSError:
+            if not os.path.exists(class_folder):
+                raise
+    finally:
+        if os.path.exists(build_folder):
+            shutil.rmtree(build_folder)
+    return class_folder
+
+
+class SugarWorker(object):
+    """One long-lived sugar JVM that answers encode and decode requests
+    over a pipe. JVM startup and JIT warm-up are paid once in start()
+    instead of on every java -jar sugar.jar call."""
+
+    def __init__(self, sugarjar_path, tmp_folder=None, memory_limit=None):
+        if tmp_folder is None:
+            import tempfile
+            tmp_folder = tempfile.gettempdir()
+        self.sugarjar_path = os.path.abspath(sugarjar_path)
+        self.tmp_folder = os.path.abspath(tmp_folder)
+        self.memory_limit = memory_limit
+        self.process = None
+        self.warmup_time = None
+        self._lock = threading.RLock()
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """Starts and warms up the JVM if necessary.
+        Returns the warm-up time spent by this call."""
+        with self._lock:
+            if self.is_running():
+                return 0.0
+            b = time.time()
+            class_folder = compile_sugar_worker(
+                self.sugarjar_path, self.tmp_folder)
+            self.process = subprocess.Popen(
+                get_java_cmd(self.memory_limit) + [
+                    '-cp',
+                    os.pathsep.join([class_folder, self.sugarjar_path]),
+                    'jp.ac.kobe_u.cs.sugar.SugarWorker'],
+                # binary, the payload size is in bytes
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE
+            )
+            self._request('ping')
+            self._warm_up()
+            self.warmup_time = time.time() - b
+            return self.warmup_time
+
+    def _warm_up(self):
+        warmup_repr = os.path.join(
+            self.tmp_folder, 'sugar_worker_warmup_{0}_{1}'.format(
+                os.getpid(), id(self)))
+        csp_file, cnf_file, map_file = [
+            '{0}.{1}'.format(warmup_repr, ext)
+            for ext in ('csp', 'cnf', 'map')]
+        with open(csp_file, 'w') as csp_fp:
+            csp_fp.write(SUGAR_WORKER_WARMUP_CSP)
+        try:
+            self._request('encode', csp_file, cnf_file, map_file)
+        finally:
+            for file_name in (csp_file, cnf_file, map_file):
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+
+    def _request(self, *request, **kwargs):
+        """Sends one request and returns what sugar printed. With a
+        timeout keyword the JVM is killed if it does not answer in time
+        and LimitReached is raised, the next request starts a new one.
+        A JVM that ran out of heap is replaced the same way.
+
+        With a reader keyword, the process reading the FIFO the request
+        writes to, the JVM is killed as well if the reader fails before
+        the answer: the JVM would block opening the FIFO forever or fail
+        writing to it. SugarWorkerException is raised then."""
+        timeout = kwargs.pop('timeout', None)
+        reader = kwargs.pop('reader', None)
+        with self._lock:
+            if not self.is_running():
+                raise SugarWorkerException("sugar worker is not running")
+            process = self.process
+            timed_out = threading.Event()
+            reader_failed = threading.Event()
+            answered = threading.Event()
+
+            def kill():
+                timed_out.set()
+                process.kill()
+
+            def watch_reader():
+                while not answered.wait(0.05):
+                    # minisat only exits successfully after reading the
+                    # whole CNF
+                    if reader.poll() not in (None, 0, 10, 20):
+                        reader_failed.set()
+                        process.kill()
+                        return
+
+            timer = None
+            if timeout is not None:
+                timer = threading.Timer(timeout, kill)
+                timer.daemon = True
+                timer.start()
+            if reader is not None:
+                watcher = threading.Thread(target=watch_reader)
+                watcher.daemon = True
+                watcher.start()
+            try:
+                process.stdin.write(
+                    ('\t'.join(request) + '\n').encode('utf-8'))
+                process.stdin.flush()
+                header = process.stdout.readline().decode('ascii')
+                if header:
+                    status, payload_size = header.split()
+                    payload = process.stdout.read(
+                        int(payload_size)).decode('utf-8')
+            except (IOError, OSError, ValueError):
+                if not (timed_out.is_set() or reader_failed.is_set()):
+                    raise
+            finally:
+                answered.set()
+                if timer is not None:
+                    timer.cancel()
+            if timed_out.is_set():
+                self._kill()
+                raise LimitReached('timeout')
+            if reader_failed.is_set():
+                self._kill()
+                raise SugarWorkerException(
+                    "CNF reader exited with {0}".format(reader.poll()))
+            if not header:
+                raise SugarWorkerException(
+                    "sugar worker exited with {0}".format(
+                        self.process.wait()))
+            if status != 'ok':
+                if 'java.lang.OutOfMemoryError' in payload:
+                    self._kill()
+                    raise LimitReached('memory')
+                raise SugarWorkerException(payload)
+            return payload
+
+    def _kill(self):
+        with self._lock:
+            if self.process is not None:
+                if self.process.poll() is None:
+                    self.process.kill()
+                self.process.wait()
+            self.process = None
+
+    def encode(self, csp_file, cnf_file, map_file, timeout=None):
+        self.start()
+        return self._request('encode', *[os.path.abspath(file_name)
+            for file_name in (csp_file, cnf_file, map_file)],
+            timeout=timeout)
+
+    def encode_stream(self, csp_file, cnf_fifo, map_file, timeout=None,
+                      reader=None):
+        """Like encode but writes the CNF to cnf_fifo while it is generated.
+        Returns sugar's output and the number of CNF bytes written
+        (None if sugar found the problem unsatisfiable). reader is the
+        process reading cnf_fifo, see _request."""
+        self.start()
+        header_file = '{0}.header'.format(cnf_fifo)
+        try:
+            encode_result = self._request('encode_stream', *[
+                os.path.abspath(file_name) for file_name in
+                (csp_file, header_file, cnf_fifo, map_file)],
+                timeout=timeout, reader=reader)
+        finally:
+            if os.path.exists(header_file):
+                os.remove(header_file)
+        sugar_output, cnf_stream_size = [], None
+        for line in encode_result.splitlines(True):
+            if line.startswith('c cnf_stream_size '):
+                cnf_stream_size = int(line.split()[-1])
+            else:
+                sugar_output.append(line)
+        return ''.join(sugar_output), cnf_stream_size
+
+    def decode(self, out_file, map_file, timeout=None):
+        self.start()
+        return self._request('decode', *[os.path.abspath(file_name)
+            for file_name in (out_file, map_file)], timeout=timeout)
+
+    def close(self):
+        with self._lock:
+            if self.is_running():
+                self.process.stdin.write(b'quit\n')
+                self.process.stdin.close()
+                self.process.wait()
+            self.process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_sugar_workers = {}
+_sugar_workers_lock = threading.Lock()
+
+
+def get_sugar_worker(sugarjar_path, tmp_folder=None):
+    """Returns the process wide worker for sugarjar_path.
+    It is started lazily and shut down at interpreter exit."""
+    key = os.path.abspath(sugarjar_path)
+    with _sugar_workers_lock:
+        if key not in _sugar_workers:
+            worker = SugarWorker(sugarjar_path, tmp_folder=tmp_folder)
+            atexit.register(worker.close)
+            _sugar_workers[key] = worker
+        return _sugar_workers[key]
+
+
+class DecodeException(Exception):
+    pass
+
+
+DECODERS = ('python', 'sugar', 'both')
+
+ENCODERS = ('sugar', 'python')
+
+SAT_BACKENDS = ('subprocess', 'library')
+
+BACKENDS = ('sugar', 'dp', 'auto')
+
+
+def read_minisat_model(out_file, chunk_size=1 << 16):
+    """Reads the model minisat wrote to out_file into a bitset
+    (bit v is set if SAT variable v is true). Returns None for UNSAT.
+    The model line is read in chunks, memory is one bit per variable."""
+    model = bytearray()
+    with open(out_file) as out_fp:
+        status = out_fp.readline().strip()
+        if status != 'SAT':
+            return None
+        rest = ''
+        while True:
+            chunk = out_fp.read(chunk_size)
+            literals = (rest + chunk).split()
+            if chunk and not chunk[-1].isspace() and literals:
+                rest = literals.pop()
+            else:
+                rest = ''
+            for literal in literals:
+                literal = int(literal)
+                if literal > 0:
+                    byte = literal >> 3
+                    if byte >= len(model):
+                        model.extend(bytearray(
+                            max(byte + 1 - len(model), len(model))))
+                    model[byte] |= 1 << (literal & 7)
+            if not chunk:
+                return model
+
+
+def write_minisat_model(out_file, model, variable_count):
+    """Writes the model bitset to out_file the way minisat does."""
+    with open(out_file, 'w') as out_fp:
+        out_fp.write('SAT\n')
+        for variable in range(1, variable_count + 1):
+            if model[variable >> 3] & (1 << (variable & 7)):
+                out_fp.write('{0} '.format(variable))
+            else:
+                out_fp.write('-{0} '.format(variable))
+        out_fp.write('0\n')
+
+
+def iter_sugar_map(map_file):
+    """Yields (variable_name, code, domain_ranges) for every integer
+    variable in a sugar .map file, in file order. A domain is written
+    either as 'lb..ub' or as a list of values and is returned as
+    sorted (lb, ub) pairs."""
+    with open(map_file) as map_fp:
+        for line in map_fp:
+            fields = line.split()
+            if not fields or fields[0] != 'int':
+                continue
+            domain_ranges = []
+            for value in fields[3:]:
+                if '..' in value:
+                    lb, ub = value.split('..')
+                    domain_ranges.append((int(lb), int(ub)))
+                else:
+                    domain_ranges.append((int(value), int(value)))
+            domain_ranges.sort()
+            yield fields[1], int(fields[2]), domain_ranges
+
+
+def decode_order_encoding(model, code, domain_ranges):
+    """Value of an order encoded integer variable. SAT variable
+    code+i means 'x <= i-th domain value' for all but the largest
+    value, the first one set to true gives the value."""
+    max_value = domain_ranges[-1][1]
+    for lb, ub in domain_ranges:
+        for value in range(lb, ub + 1):
+            if value == max_value:
+                return value
+            byte = code >> 3
+            if byte < len(model) and model[byte] & (1 << (code & 7)):
+                return value
+            code += 1
+    return max_value
+
+
+def get_order_encoding_units(code, domain_ranges, value):
+    """Literals of the unit clauses that fix an order encoded integer
+    variable to value (see decode_order_encoding), None if value is not
+    in its domain."""
+    index = 0
+    for lb, ub in domain_ranges:
+        if lb <= value <= ub:
+            index += value - lb
+            break
+        index += ub - lb + 1
+    else:
+        return None
+    domain_size = sum(ub - lb + 1 for lb, ub in domain_ranges)
+    units = []
+    if index < domain_size - 1:
+        # x <= value
+        units.append(code + index)
+    if index > 0:
+        # not x <= previous value
+        units.append(-(code + index - 1))
+    return units
+
+
+def get_order_encoding_bound_units(code, domain_ranges, bound, upper=True):
+    """Literals of the unit clauses for x <= bound (upper) or x >= bound
+    of an order encoded integer variable, [] if every value of its
+    domain satisfies the bound, None if none does."""
+    if not upper:
+        # x >= bound is not x <= bound - 1
+        bound -= 1
+    index = -1  # of the largest value <= bound
+    domain_size = 0
+    for lb, ub in domain_ranges:
+        if bound >= lb:
+            index = domain_size + min(bound, ub) - lb
+        domain_size += ub - lb + 1
+    if index >= domain_size - 1:
+        # x <= bound holds for every value
+        return [] if upper else None
+    if index < 0:
+        return None if upper else []
+    return [code + index] if upper else [-(code + index)]
+
+
+def write_cnf_with_clauses(cnf_file, clauses, target_file):
+    """Copies cnf_file to target_file with clauses (lists of literals)
+    added, the header is updated accordingly."""
+    import shutil
+    with open(cnf_file) as cnf_fp:
+        with open(target_file, 'w') as target_fp:
+            # readline, python 2 can't mix file iteration and read
+            line = cnf_fp.readline()
+            while line and not line.startswith('p'):
+                target_fp.write(line)
+                line = cnf_fp.readline()
+            _, _, variable_count, clause_count = line.split()
+            target_fp.write('p cnf {0} {1}\n'.format(
+                variable_count, int(clause_count) + len(clauses)))
+            for clause in clauses:
+                target_fp.write(' '.join(
+                    str(literal) for literal in clause) + ' 0\n')
+            shutil.copyfileobj(cnf_fp, target_fp, 1 << 20)
+
+
+def solve_cnf_with_clauses(minisat_path, cnf_file, out_file, clauses=(),
+                           target_cnf_file=None, deadline=None,
+                           memory_limit=None):
+    """Runs minisat on cnf_file plus clauses, which are added to a copy
+    in target_cnf_file. Returns True if minisat wrote a model to
+    out_file, False for UNSATISFIABLE."""
+    if clauses:
+        write_cnf_with_clauses(cnf_file, clauses, target_cnf_file)
+        cnf_file = target_cnf_file
+    process = None
+    try:
+        process = start_sat_solver(
+            [minisat_path, cnf_file, out_file], deadline, memory_limit)
+        returncode, minisat_resp, _ = wait_for_minisat(
+            process, deadline, memory_limit)
+    except:
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+        raise
+    return get_sat_answer(returncode, minisat_resp) == 'SATISFIABLE'
+
+
+def iter_decoded_solution(out_file, map_file):
+    """Pure python replacement for sugar -decode, yields
+    (variable_name, value) in the order of the map file."""
+    model = read_minisat_model(out_file)
+    if model is None:
+        raise DecodeException(
+            "{0} does not contain a model".format(out_file))
+    return iter_decoded_model(model, map_file)
+
+
+def iter_decoded_model(model, map_file):
+    """iter_decoded_solution for a model bitset (see read_minisat_model)."""
+    for variable_name, code, domain_ranges in iter_sugar_map(map_file):
+        yield variable_name, decode_order_encoding(
+            model, code, domain_ranges)
+
+
+def sugar_encode(csp_file, cnf_file, map_file, sugarjar_path,
+                 sugar_worker=None, timeout=None, memory_limit=None,
+                 encoder='sugar'):
+    """Returns sugar's output, which is empty unless sugar found the
+    problem UNSATISFIABLE while encoding.
+
+    encoder is one of ENCODERS, 'python' compiles the CSP with
+    csp_encoder in this process instead of running sugar, timeout and
+    memory_limit do not apply to it."""
+    if encoder not in ENCODERS:
+        raise ValueError("encoder must be one of {0}".format(ENCODERS))
+    if encoder == 'python':
+        import csp_encoder
+        return csp_encoder.encode_csp(csp_file, cnf_file, map_file)
+    if sugar_worker:
+        return sugar_worker.encode(
+            csp_file, cnf_file, map_file, timeout=timeout)
+    return run_sugar(
+        ['-encode', csp_file, cnf_file, map_file], sugarjar_path,
+        timeout=timeout, memory_limit=memory_limit)
+
+
+def sugar_decode(out_file, map_file, sugarjar_path,
+                 sugar_worker=None, quiet=True,
+                 timeout=None, memory_limit=None):
+    if sugar_worker:
+        decode_result = sugar_worker.decode(
+            out_file, map_file, timeout=timeout)
+    else:
+        decode_result = run_sugar(
+            ['-competition', '-decode', out_file, map_file],
+            sugarjar_path, timeout=timeout, memory_limit=memory_limit)
+    if not quiet:
+        print(decode_result)
+    return parse_sugar_decode_result(decode_result)
+
+
+def parse_sugar_decode_result(decode_result):
+    assert decode_result, "Decode should return text"
+
+    # second way to check if satisfiable
+    #last_word_of_first_line = stdout.split('\n')[0].split()[1]
+    #if last_word_of_first_line == 'SATISFIABLE':
+
+    last_line_without_first_letter = decode_result.\
+        splitlines()[1].split()[1:]
+    return [int(r) for r in last_line_without_first_letter]
+
+
+def iter_weighted_sum_csp(variables, reference_value, sum_variable=None):
+    """Yields the text of weighted_sum_to_csp piece by piece in one
+    linear pass over variables, so huge problems can be streamed to a
+    file without building the CSP in memory.
+
+    With sum_variable=(name, lb, ub) the sum is not compared to
+    reference_value but declared as that integer variable."""
     # (domain D1 (1 2 3))
     domain_tmpl = "(domain {domain_name} ({domain_values}))"
 
-    # (int V1 D1)
-    variable_tmpl = "(int {variable_name} {domain_name})"
+    # (int V1 D1), %-formatting is noticeably faster for 1M variables
+    variable_tmpl = "(int %s %s)"
 
     # (weightedsum ( ( 1 V1 ) ( 1 V2 ) ( 1 V3 ) ( 1 V4 )) eq 1)
-    constraint_tmpl = "(weightedsum ( {variables_str} ) eq {the_sum})"
+    constraint_tmpl = "( 1 %s )"
 
     result_domains = {} # frozenset([1,2,3]): 'R1'
     result_variables = {}
 
     for variable in variables:
         cleaned_variable = frozenset(variable)
-        if cleaned_variable in set(result_domains.keys()):
-            domain_name = result_domains[cleaned_variable]
-        else:
+        domain_name = result_domains.get(cleaned_variable)
+        if domain_name is None:
             domain_name = 'D{0}'.format(len(result_domains)+1)
             result_domains[cleaned_variable] = domain_name
 
-        variable_name = 'V{0}'.format(len(result_variables)+1)
-        result_variables[variable_name] = domain_name
+        result_variables['V%d' % (len(result_variables)+1)] = domain_name
 
-    return "\n".join(
-        domain_tmpl.format(
+    separator = ""
+    for domain_values, domain_name in result_domains.items():
+        yield separator + domain_tmpl.format(
             domain_name=domain_name,
             domain_values=" ".join(str(v) for v in domain_values)
-        ) for domain_values, domain_name in result_domains.items()
-    ) + \
-    '\n' + "\n".join(
-        variable_tmpl.format(
-            variable_name=variable_name,
-            domain_name=domain_name
-        ) for variable_name, domain_name in result_variables.items()
-    ) + \
-    "\n" + constraint_tmpl.format(
-        variables_str=' '.join(['( 1 %s )' % var_name
-            for var_name in result_variables.keys()]),
-        the_sum=reference_value
-    )
+        )
+        separator = "\n"
+
+    yield "\n"
+    separator = ""
+    for variable_name, domain_name in result_variables.items():
+        yield separator + variable_tmpl % (variable_name, domain_name)
+        separator = "\n"
+
+    if sum_variable is not None:
+        yield "\n(int %s %d %d)" % tuple(sum_variable)
+
+    yield "\n(weightedsum ( "
+    separator = ""
+    for variable_name in result_variables.keys():
+        yield separator + constraint_tmpl % variable_name
+        separator = " "
+    if sum_variable is None:
+        yield " ) eq {0})".format(reference_value)
+    else:
+        yield " ( -1 %s ) ) eq 0)" % sum_variable[0]
+
+
+def write_weighted_sum_csp(variables, reference_value, csp_fp):
+    """Streams the CSP for variables to the file object csp_fp."""
+    for csp_piece in iter_weighted_sum_csp(variables, reference_value):
+        csp_fp.write(csp_piece)
+
+
+def weighted_sum_to_csp(variables, reference_value):
+    return "".join(iter_weighted_sum_csp(variables, reference_value))
+
+
+def run_sat_solver(solver_cmd, deadline=None, memory_limit=None):
+    """start_sat_solver and wait_for_minisat in one, the solver is killed
+    if it did not finish."""
+    process = start_sat_solver(solver_cmd, deadline, memory_limit)
+    try:
+        return wait_for_minisat(process, deadline, memory_limit)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def run_solve_steps(steps):
+    """Runs a generator of steps like iter_solve_csp_steps in this
+    thread and returns its result.
+
+    The generator yields what it needs done as a tuple and is sent the
+    outcome, or has the exception thrown into it:
+    ('sugar', sugar_args, sugarjar_path, deadline, memory_limit) runs
+    java -jar sugar.jar (see run_sugar), ('minisat', solver_cmd,
+    deadline, memory_limit) runs a SAT solver for (returncode, stdout,
+    stderr) (see run_sat_solver), ('portfolio', portfolio, cnf_file,
+    out_file, deadline, memory_limit) races SAT solvers (see
+    race_sat_solvers), ('call', func) calls func and ('steps',
+    generator) runs another generator of steps. The last step is
+    ('result', result). csp_async runs the same generators on an event
+    loop."""
+    value, exc_info = None, None
+    while True:
+        if exc_info is None:
+            step = steps.send(value)
+        else:
+            step = steps.throw(*exc_info)
+        value, exc_info = None, None
+        if step[0] == 'result':
+            steps.close()
+            return step[1]
+        try:
+            if step[0] == 'sugar':
+                sugar_args, sugarjar_path, deadline, memory_limit = step[1:]
+                value = run_sugar(
+                    sugar_args, sugarjar_path,
+                    timeout=get_remaining_time(deadline),
+                    memory_limit=memory_limit)
+            elif step[0] == 'minisat':
+                value = run_sat_solver(*step[1:])
+            elif step[0] == 'portfolio':
+                value = race_sat_solvers(*step[1:])
+            elif step[0] == 'call':
+                value = step[1]()
+            elif step[0] == 'steps':
+                value = run_solve_steps(step[1])
+            else:
+                raise ValueError("unknown step {0!r}".format(step[0]))
+        except:
+            exc_info = sys.exc_info()
 
 
 @time_diff
-def solve_csp(
+def solve_csp(*args, **kwargs):
+    """Solves a csp file, returns the time it took and the result dict.
+    See iter_solve_csp_steps for the arguments."""
+    return run_solve_steps(iter_solve_csp_steps(*args, **kwargs))
+
+
+def iter_solve_csp_steps(
         csp_file,
         remove_tmp_files,
 
@@ -87,167 +1102,607 @@ def solve_csp(
 
         unique_repr=None,
         quiet=True,
+        sugar_worker=None,
+        decoder='python',
+        cache=None,
+        cnf_stream=False,
+        timeout=None,
+        memory_limit=None,
+        portfolio=None,
+        encoder='sugar',
+        tracer=None,
+        sat_backend='subprocess',
         ):
-
-    csp_solver_config = get_valid_csp_solver_config(**csp_solver_config)
+    """The phases of solve_csp as steps for run_solve_steps, the result
+    is the result dict of solve_csp.
+
+    Pass sugar_worker=True to use the process wide SugarWorker
+    or pass a SugarWorker instance to reuse a running JVM.
+
+    With cnf_stream=True the CNF is not stored: sugar (always through
+    a SugarWorker) writes it to a FIFO that minisat is already reading,
+    cnf_file_size then is the number of bytes streamed.
+
+    decoder is one of DECODERS: 'python' reads the minisat model with
+    the .map file, 'sugar' runs sugar -decode and 'both' runs both and
+    raises DecodeException if they disagree.
+
+    cache is an optional csp_cache.ResultCache, results for the same
+    csp content and solver binaries are returned from there.
+
+    timeout is a wall clock deadline in seconds for encoding, solving and
+    decoding together, memory_limit caps minisat's address space (with
+    RLIMIT_AS) and the java heap of sugar subprocesses in bytes. A run
+    that reaches a limit returns satisfiable_bool None with status
+    'UNKNOWN' and limit_reached 'timeout' or 'memory'. A SugarWorker
+    keeps the heap size it was started with.
+
+    portfolio is a list of SAT solver command lines (see
+    get_minisat_portfolio) that are raced on the CNF instead of running
+    minisat_path, portfolio_winner tells which one answered first.
+    Every solver is called like minisat: <command> <cnf> <model file>.
+    They share memory_limit, each gets an equal part of it.
+
+    encoder is one of ENCODERS, 'python' compiles the CSP with
+    csp_encoder instead of sugar (see sugar_encode), together with the
+    python decoder no JVM is started.
+
+    tracer is a csp_trace.Tracer that gets a span for each phase,
+    default is the process wide csp_trace.tracer.
+
+    sat_backend is one of SAT_BACKENDS, 'library' solves in this process
+    with the IPASIR library sat_library_path of csp_solver_config (see
+    csp_sat) instead of running minisat_path. The python encoder then
+    adds the clauses to it without writing a CNF file (no cnf_file_size
+    but cnf_clause_count), minisat_cpu_time is the CPU time of this
+    process while solving and memory_limit only applies to sugar."""
+
+    if decoder not in DECODERS:
+        raise ValueError("decoder must be one of {0}".format(DECODERS))
+    if encoder not in ENCODERS:
+        raise ValueError("encoder must be one of {0}".format(ENCODERS))
+    if sat_backend not in SAT_BACKENDS:
+        raise ValueError(
+            "sat_backend must be one of {0}".format(SAT_BACKENDS))
+
+    csp_solver_config = ensure_valid_csp_solver_config(csp_solver_config)
 
     if unique_repr is None:
-        config_hash = unique_hash(csp_file)
-        unique_repr = '{1}_2'.format(config_hash, time.time())
+        unique_repr = get_unique_repr(unique_hash(csp_file.encode('utf-8')))
+
+    if tracer is None:
+        import csp_trace
+        tracer = csp_trace.tracer
 
     tmp_folder = csp_solver_config['tmp_folder']
     sugarjar_path = csp_solver_config['sugarjar_path']
     minisat_path = csp_solver_config['minisat_path']
 
-    # 2. .csp -> CNF
-    cnf_file = os.path.join(tmp_folder, '{0}.cnf'.format(unique_repr))
-    map_file = os.path.join(tmp_folder, '{0}.map'.format(unique_repr))
+    if cache is not None:
+        import csp_cache
+        with open(csp_file) as csp_fp:
+            cache_key = csp_cache.get_cache_key(
+                csp_fp.read(), csp_solver_config)
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            cached_result['cache_hit'] = True
+            yield 'result', cached_result
+            return
+
+    if cnf_stream and not hasattr(os, 'mkfifo'):
+        raise ConfigurationException("cnf_stream needs os.mkfifo")
+    if cnf_stream and encoder != 'sugar':
+        raise ConfigurationException(
+            "the python encoder rewrites the CNF header, "
+            "it does not work with cnf_stream")
 
-    # ram://1048576 -> 512MB --> 600 Actors range_size 15
-    # CNF needs more than 512 MB!
+    if sat_backend == 'library' and (cnf_stream or portfolio):
+        raise ConfigurationException(
+            "cnf_stream and portfolio run SAT solver processes, "
+            "they need sat_backend 'subprocess'")
 
-    sugar_encode_cmd = [
-        'java', '-jar', sugarjar_path,
-        '-encode', csp_file, cnf_file, map_file]
-    b = time.time()
-    sugar_encode_resp_std_out = subprocess.check_output(sugar_encode_cmd)
-    csp_to_cnf_time = time.time() - b
+    if portfolio:
+        if cnf_stream:
+            raise ConfigurationException(
+                "a FIFO can only be read by one solver, "
+                "portfolio does not work with cnf_stream")
+        portfolio = get_valid_portfolio(portfolio)
 
-    result = {
-        'csp_to_cnf_time':csp_to_cnf_time
-    }
+    if sugar_worker is True or (cnf_stream and not sugar_worker):
+        sugar_worker = get_sugar_worker(sugarjar_path, tmp_folder)
 
-    if sugar_encode_resp_std_out:
-        if not quiet:
-            print("sugar reported UNSATISFIABLE")
+    deadline = None if timeout is None else time.time() + timeout
 
-        assert sugar_encode_resp_std_out == 's UNSATISFIABLE\n', \
-                sugar_encode_resp_std_out
-        result['satisfiable_bool'] = False
-        result['solution_list'] = None
-
-    else:
-        result['cnf_file_size'] = get_file_size(cnf_file)
-        result['map_file_size'] = get_file_size(map_file)
-        if not quiet:
-            print("cnf file size:", result['cnf_file_size'])
-            print("map file size:", result['map_file_size'])
+    result = {}
+    if sugar_worker:
+        with tracer.start_span('warmup', unique_repr=unique_repr):
+            result['sugar_warmup_time'] = yield 'call', sugar_worker.start
 
-        out_file = os.path.join(tmp_folder,
-            '{0}.out'.format(unique_repr))
+    # 2. .csp -> CNF
+    cnf_file = os.path.join(tmp_folder, '{0}.cnf'.format(unique_repr))
+    map_file = os.path.join(tmp_folder, '{0}.map'.format(unique_repr))
+    out_file = os.path.join(tmp_folder, '{0}.out'.format(unique_repr))
 
-        # 3. execute minisat2/solve.
-        # 800 Actors range_size 15 needs more than 2GB memory!
-        minisat_cmd = [minisat_path, cnf_file, out_file]
-        b = time.time()
+    # ram://1048576 -> 512MB --> 600 Actors range_size 15
+    # CNF needs more than 512 MB!
 
-        process = subprocess.Popen(
-            minisat_cmd,
-            stdout=subprocess.PIPE,stderr=subprocess.PIPE
-        )
-        minisat_resp, minisat_resp_stderr = process.communicate()
-        if process.returncode not in [0, 10]:
-            print("Minisat returned {0}".format(process.returncode))
-            print(minisat_resp_stderr)
-            print(minisat_resp)
-            raise Exception("Error executing minisat!")
+    # 3. execute minisat2/solve.
+    # 800 Actors range_size 15 needs more than 2GB memory!
+    minisat_cmd = [minisat_path, cnf_file, out_file]
+    # the minisat process reading the cnf_stream FIFO
+    stream_readers = []
+    sat_solver = None
+
+    def open_library_solver():
+        import csp_sat
+        return csp_sat.LibrarySatSolver(
+            csp_sat.load_sat_library(csp_solver_config['sat_library_path']),
+            deadline=deadline)
+
+    def encode_stream():
+        os.mkfifo(cnf_file)
+        try:
+            # minisat blocks reading the FIFO until sugar writes to it
+            process = start_sat_solver(minisat_cmd, deadline, memory_limit)
+            stream_readers.append(process)
+            try:
+                return sugar_worker.encode_stream(
+                    csp_file, cnf_file, map_file,
+                    timeout=get_remaining_time(deadline), reader=process)
+            except SugarWorkerException:
+                if process.poll() is not None:
+                    # minisat failed first, e.g. out of memory_limit,
+                    # so that is what went wrong
+                    wait_for_minisat(process, deadline, memory_limit)
+                raise
+        finally:
+            os.remove(cnf_file)
 
-        result['minisat_time'] = time.time() - b
+    def kill_stream_readers():
+        for process in stream_readers:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
 
-        solvable_bool = minisat_resp.splitlines()[0]
-        if solvable_bool == 'SATISFIABLE':
-            if not quiet:
-                print("minisat reported SATISFIABLE")
-
-            result['satisfiable_bool'] = True
-
-            def get_cpu_time(resp):
-                third_last_line = resp.splitlines()[-2:-1][0]
-                return float(third_last_line.split()[-2:-1][0])
-            result['minisat_cpu_time'] = get_cpu_time(minisat_resp_stderr)
-            #TODO: convert to timedelta?
-
-            # calculate and show result
-            sugar_decode_cmd = [
-                'java', '-jar',
-                sugarjar_path, '-competition', '-decode',
-                out_file, map_file]
-            decode_result = subprocess.check_output(sugar_decode_cmd)
-            assert decode_result, "Decode should return text"
+    phase = 'csp_to_cnf'
+    b = time.time()
+    span = tracer.start_span('encode', unique_repr=unique_repr,
+                             encoder=encoder)
+    try:
+        if cnf_stream:
+            sugar_encode_resp_std_out, cnf_stream_size = \
+                yield 'call', encode_stream
+        elif sat_backend == 'library' and encoder == 'python':
+            import csp_encoder
+            sat_solver = yield 'call', open_library_solver
+            sugar_encode_resp_std_out = yield 'call', functools.partial(
+                csp_encoder.encode_csp, csp_file, None, map_file,
+                sat_solver=sat_solver)
+        elif encoder == 'sugar' and not sugar_worker:
+            sugar_encode_resp_std_out = yield (
+                'sugar', ['-encode', csp_file, cnf_file, map_file],
+                sugarjar_path, deadline, memory_limit)
+        else:
+            sugar_encode_resp_std_out = yield 'call', functools.partial(
+                sugar_encode, csp_file, cnf_file, map_file, sugarjar_path,
+                sugar_worker=sugar_worker,
+                timeout=get_remaining_time(deadline),
+                memory_limit=memory_limit,
+                encoder=encoder)
+        result['csp_to_cnf_time'] = time.time() - b
+        span.finish()
+
+        if sugar_encode_resp_std_out:
             if not quiet:
-                print(decode_result)
+                print("sugar reported UNSATISFIABLE")
+
+            kill_stream_readers()
 
-            # second way to check if satisfiable
-            #last_word_of_first_line = stdout.split('\n')[0].split()[1]
-            #if last_word_of_first_line == 'SATISFIABLE':
+            assert sugar_encode_resp_std_out == 's UNSATISFIABLE\n', \
+                    sugar_encode_resp_std_out
+            result['satisfiable_bool'] = False
+            result['solution_list'] = None
 
-            last_line_without_first_letter = decode_result.\
-                splitlines()[1].split()[1:]
-            result['solution_list'] = [int(r)
-                for r in last_line_without_first_letter]
+        else:
+            if cnf_stream:
+                result['cnf_file_size'] = cnf_stream_size
+            elif sat_solver is not None:
+                result['cnf_clause_count'] = sat_solver.clause_count
+            else:
+                result['cnf_file_size'] = get_file_size(cnf_file)
+            result['map_file_size'] = get_file_size(map_file)
+            if not quiet:
+                print("cnf file size:", result['cnf_file_size'])
+                print("map file size:", result['map_file_size'])
+
+            phase = 'minisat'
+            b = time.time()
+            span = tracer.start_span('solve', unique_repr=unique_repr)
+            if sat_backend == 'library':
+                if sat_solver is None:
+                    sat_solver = yield 'call', open_library_solver
+                    yield 'call', functools.partial(
+                        sat_solver.add_clauses_from_file, cnf_file)
+                cpu_time_before = get_process_cpu_time()
+                satisfiable_bool = yield 'call', sat_solver.solve
+                minisat_cpu_time = get_process_cpu_time() - cpu_time_before
+            elif portfolio:
+                winner, returncode, minisat_resp, minisat_resp_stderr = \
+                    yield ('portfolio', portfolio, cnf_file, out_file,
+                           deadline, memory_limit)
+                result['portfolio_winner'] = ' '.join(portfolio[winner])
+                if not quiet:
+                    print("portfolio winner:", result['portfolio_winner'])
+            elif stream_readers:
+                returncode, minisat_resp, minisat_resp_stderr = \
+                    yield 'call', functools.partial(
+                        wait_for_minisat, stream_readers[0],
+                        deadline, memory_limit)
+            else:
+                returncode, minisat_resp, minisat_resp_stderr = \
+                    yield 'minisat', minisat_cmd, deadline, memory_limit
+
+            # with cnf_stream minisat has already parsed the CNF by now
+            result['minisat_time'] = time.time() - b
+            span.finish()
+
+            if sat_backend != 'library':
+                satisfiable_bool = get_sat_answer(
+                    returncode, minisat_resp) == 'SATISFIABLE'
+
+            if satisfiable_bool:
+                if not quiet:
+                    print("minisat reported SATISFIABLE")
+
+                result['satisfiable_bool'] = True
+
+                if sat_backend == 'library':
+                    result['minisat_cpu_time'] = minisat_cpu_time
+                else:
+                    try:
+                        result['minisat_cpu_time'] = get_minisat_cpu_time(
+                            minisat_resp_stderr)
+                    except (IndexError, ValueError):
+                        # other solvers of a portfolio print other statistics
+                        if not portfolio:
+                            raise
+                #TODO: convert to timedelta?
+
+                # calculate and show result
+                phase = 'decode'
+                b = time.time()
+                span = tracer.start_span('decode', unique_repr=unique_repr,
+                                         decoder=decoder)
+                model = None
+                if sat_solver is not None:
+                    model = sat_solver.get_model()
+                    if decoder != 'python':
+                        yield 'call', functools.partial(
+                            write_minisat_model,
+                            out_file, model, sat_solver.variable_count)
+                if decoder in ('sugar', 'both'):
+                    if sugar_worker:
+                        solution_list = yield 'call', functools.partial(
+                            sugar_decode, out_file, map_file, sugarjar_path,
+                            sugar_worker=sugar_worker, quiet=quiet,
+                            timeout=get_remaining_time(deadline))
+                    else:
+                        decode_result = yield (
+                            'sugar',
+                            ['-competition', '-decode', out_file, map_file],
+                            sugarjar_path, deadline, memory_limit)
+                        if not quiet:
+                            print(decode_result)
+                        solution_list = parse_sugar_decode_result(
+                            decode_result)
+                if decoder in ('python', 'both'):
+                    get_remaining_time(deadline)
+                    if model is None:
+                        decoded = iter_decoded_solution(out_file, map_file)
+                    else:
+                        decoded = iter_decoded_model(model, map_file)
+                    python_solution_list = yield 'call', functools.partial(
+                        list, (value for _, value in decoded))
+                    if decoder == 'both' and \
+                            python_solution_list != solution_list:
+                        raise DecodeException(
+                            "python decoder returned {0}, sugar {1}".format(
+                                python_solution_list, solution_list))
+                    solution_list = python_solution_list
+                result['decode_time'] = time.time() - b
+                span.finish()
+                result['solution_list'] = solution_list
+
+            else:
+                print("minisat reported UNSATISFIABLE")
+
+                result['satisfiable_bool'] = False
+                result['solution_list'] = []
 
             if remove_tmp_files:
-                os.remove(out_file)
+                with tracer.start_span('cleanup', unique_repr=unique_repr):
+                    for file_name in (cnf_file, map_file, out_file):
+                        if os.path.exists(file_name):
+                            os.remove(file_name)
+
+    except LimitReached as exc:
+        kill_stream_readers()
+        # time spent in the phase that was cut short
+        result['{0}_time'.format(phase)] = time.time() - b
+        span.finish(exc.limit)
+        if not quiet:
+            print("{0} reached, result UNKNOWN".format(exc.limit))
+        if remove_tmp_files:
+            with tracer.start_span('cleanup', unique_repr=unique_repr):
+                for file_name in (cnf_file, map_file, out_file):
+                    if os.path.exists(file_name):
+                        os.remove(file_name)
+        # not cached, a rerun with other limits can succeed
+        result['satisfiable_bool'] = None
+        result['solution_list'] = None
+        result['status'] = 'UNKNOWN'
+        result['limit_reached'] = exc.limit
+        yield 'result', result
+        return
+
+    except:
+        # also a cancelled csp_async task
+        kill_stream_readers()
+        span.finish(sys.exc_info()[0].__name__)
+        if remove_tmp_files:
+            for file_name in (cnf_file, map_file, out_file):
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+        raise
 
-        else:
-            print("minisat reported UNSATISFIABLE")
+    finally:
+        if sat_solver is not None:
+            sat_solver.close()
 
-            result['satisfiable_bool'] = False
-            result['solution_list'] = []
+    result['status'] = 'SATISFIABLE' if result['satisfiable_bool'] \
+        else 'UNSATISFIABLE'
+    if cache is not None:
+        cache.put(cache_key, result)
+        result['cache_hit'] = False
+    yield 'result', result
 
-        if remove_tmp_files:
-            os.remove(cnf_file)
-            os.remove(map_file)
-    return result
+
+def do_solve(*args, **kwargs):
+    """Solves a weighted sum problem and returns the result dict.
+    See iter_do_solve_steps for the arguments."""
+    return run_solve_steps(iter_do_solve_steps(*args, **kwargs))
 
 
-def do_solve(
+def iter_do_solve_steps(
         variables,
          reference_value,
          csp_solver_config,
          remove_tmp_files=True,
          quiet=True,
+         sugar_worker=None,
+         decoder='python',
+         backend='sugar',
+         dp_memory_limit=None,
+         cache=None,
+         cnf_stream=False,
+         timeout=None,
+         memory_limit=None,
+         portfolio=None,
+         encoder='sugar',
+         tracer=None,
+         presolve=False,
+         value_counts=False,
+         sat_backend='subprocess',
          ):
+    """do_solve as steps for run_solve_steps.
+
+    backend is one of BACKENDS. 'dp' solves the weighted sum with
+    csp_dp without starting java or minisat and only falls back to
+    sugar if the DP table would need more than dp_memory_limit bytes
+    (default csp_dp.DP_MEMORY_LIMIT). 'auto' estimates the CNF and the
+    memory minisat needs with csp_plan before anything is encoded and
+    uses dp if its table fits, otherwise sugar. If minisat would not
+    fit memory_limit (default the memory available on the host) or the
+    files the tmp folder, csp_plan.PlanRefused is raised with the
+    estimate. The estimated_* values are added to the sugar result and
+    the file sizes it reports calibrate csp_plan.cnf_size_models.
+
+    cache is an optional csp_cache.ResultCache for sugar results.
+
+    timeout and memory_limit are passed to solve_csp, the timeout
+    includes writing the csp file. They do not apply to the dp backend
+    which has dp_memory_limit. So do portfolio, encoder and sat_backend.
+
+    tracer gets a 'generate' span for writing the csp file and is passed
+    to solve_csp, see csp_trace.
+
+    presolve=True first drops values that the sum bounds rule out with
+    csp_presolve. Problems that turn out UNSATISFIABLE or trivially
+    SATISFIABLE are answered right away with backend 'presolve',
+    otherwise only the free variables are solved.
+
+    value_counts=True hands sugar the value count model of csp_symmetry
+    instead of one integer per variable: variables sharing a domain are
+    interchangeable, so only how many of them take each value is solved
+    for. The solution_list is expanded back to the original variables,
+    domain_class_count tells how many domain classes there were."""
+
+    if backend not in BACKENDS:
+        raise ValueError("backend must be one of {0}".format(BACKENDS))
+
+    if presolve:
+        import csp_presolve
+        presolved = csp_presolve.presolve_weighted_sum(
+            variables, reference_value)
+        presolve_info = dict(
+            (key, presolved[key]) for key in
+            ('presolve_time', 'removed_value_count', 'fixed_count'))
+        if not quiet:
+            print("presolve: {0}".format(presolved['status']))
+        if presolved['status'] != 'REDUCED':
+            presolve_info.update(
+                backend='presolve',
+                status=presolved['status'],
+                satisfiable_bool=presolved['status'] == 'SATISFIABLE',
+                solution_list=presolved.get('solution_list')
+            )
+            yield 'result', presolve_info
+            return
+        do_solve_result = yield 'steps', iter_do_solve_steps(
+            variables=presolved['variables'],
+            reference_value=presolved['reference_value'],
+            csp_solver_config=csp_solver_config,
+            remove_tmp_files=remove_tmp_files,
+            quiet=quiet,
+            sugar_worker=sugar_worker,
+            decoder=decoder,
+            backend=backend,
+            dp_memory_limit=dp_memory_limit,
+            cache=cache,
+            cnf_stream=cnf_stream,
+            timeout=None if timeout is None
+                else timeout - presolved['presolve_time'],
+            memory_limit=memory_limit,
+            portfolio=portfolio,
+            encoder=encoder,
+            tracer=tracer,
+            value_counts=value_counts,
+            sat_backend=sat_backend
+        )
+        do_solve_result['solution_list'] = csp_presolve.expand_solution(
+            presolved, do_solve_result['solution_list'])
+        do_solve_result.update(presolve_info)
+        yield 'result', do_solve_result
+        return
+
+    plan = None
+    if backend == 'auto':
+        import csp_plan
+        csp_solver_config = ensure_valid_csp_solver_config(csp_solver_config)
+        plan = csp_plan.plan_weighted_sum(
+            variables, reference_value,
+            tmp_folder=csp_solver_config['tmp_folder'],
+            encoder=encoder,
+            sat_backend=sat_backend,
+            memory_limit=memory_limit,
+            dp_memory_limit=dp_memory_limit)
+        backend = plan.pop('backend')
+        if not quiet:
+            print("planned backend: {0}".format(backend))
+
+    if backend == 'dp':
+        import csp_dp
+        dp_result = yield 'call', functools.partial(
+            csp_dp.solve_weighted_sum, variables, reference_value,
+            memory_limit=dp_memory_limit or csp_dp.DP_MEMORY_LIMIT)
+        if dp_result is not None:
+            dp_result['backend'] = 'dp'
+            # the keys of a sugar result
+            if dp_result['satisfiable_bool']:
+                dp_result['status'] = 'SATISFIABLE'
+            else:
+                dp_result['status'] = 'UNSATISFIABLE'
+                dp_result['solution_list'] = []
+            if not quiet:
+                print("dp_time: {0}".format(dp_result['dp_time']))
+            yield 'result', dp_result
+            return
+        if not quiet:
+            print("DP table exceeds memory limit, using sugar")
 
-    csp_solver_config = get_valid_csp_solver_config(**csp_solver_config)
+    csp_solver_config = ensure_valid_csp_solver_config(csp_solver_config)
     tmp_folder = csp_solver_config['tmp_folder']
 
     if not quiet:
         print("Using tmp folder", tmp_folder)
 
+    if tracer is None:
+        import csp_trace
+        tracer = csp_trace.tracer
+
+    cache_options = ()
+    if value_counts:
+        import csp_symmetry
+        iter_csp = csp_symmetry.iter_value_count_csp
+        classes, variable_classes = \
+            csp_symmetry.get_domain_classes(variables)
+        # the cached solution is expanded for this order of variables
+        cache_options = (' '.join(map(str, variable_classes)),)
+    else:
+        iter_csp = iter_weighted_sum_csp
+
     b = time.time()
-    csp_content = weighted_sum_to_csp(
-        variables=variables,
-        reference_value=reference_value
-    )
+    if cache is not None:
+        import csp_cache
+        cache_key = csp_cache.get_cache_key(
+            iter_csp(variables, reference_value),
+            csp_solver_config, cache_options)
+        cached_result = cache.get(cache_key)
+        if cached_result is not None:
+            cached_result['cache_hit'] = True
+            yield 'result', cached_result
+            return
 
     # one step after another
-    config_hash = unique_hash(csp_content)
-    unique_repr = '{1}_2'.format(config_hash, time.time())
+    unique_repr = get_unique_repr('weighted_sum')
 
     csp_file = os.path.join(tmp_folder, '{0}.csp'.format(unique_repr))
     assert not os.path.exists(csp_file)
 
-    with open(csp_file, 'wb') as csp_fp:
-        csp_fp.write(csp_content)
-    create_csp_time = time.time() - b
+    try:
+        with tracer.start_span('generate', unique_repr=unique_repr,
+                               variable_count=len(variables)):
+            with open(csp_file, 'w') as csp_fp:
+                for csp_piece in iter_csp(variables, reference_value):
+                    csp_fp.write(csp_piece)
+        create_csp_time = time.time() - b
 
-    do_solve_result = {
-        'create_csp_time':create_csp_time,
-        'csp_file_size':get_file_size(csp_file)
-    }
+        do_solve_result = {
+            'backend': 'sugar',
+            'create_csp_time':create_csp_time,
+            'csp_file_size':get_file_size(csp_file)
+        }
 
-    solve_csp_time, solve_csp_result = solve_csp(
-        csp_file=csp_file,
-        unique_repr=unique_repr,
-        remove_tmp_files=remove_tmp_files,
-        quiet=quiet,
+        b = time.time()
+        solve_csp_result = yield 'steps', iter_solve_csp_steps(
+            csp_file=csp_file,
+            unique_repr=unique_repr,
+            remove_tmp_files=remove_tmp_files,
+            quiet=quiet,
+            sugar_worker=sugar_worker,
+            decoder=decoder,
+            cnf_stream=cnf_stream,
+            timeout=None if timeout is None else timeout - create_csp_time,
+            memory_limit=memory_limit,
+            portfolio=portfolio,
+            encoder=encoder,
+            tracer=tracer,
+            sat_backend=sat_backend,
 
-        csp_solver_config=csp_solver_config
-    )
+            csp_solver_config=csp_solver_config
+        )
+        solve_csp_time = time.time() - b
+    except:
+        # also a half written csp_file
+        if remove_tmp_files and os.path.exists(csp_file):
+            os.remove(csp_file)
+        raise
 
     do_solve_result.update(solve_csp_result)
     do_solve_result['overall_solve_csp_time'] = solve_csp_time
+    if plan is not None:
+        do_solve_result.update(plan)
+        if not value_counts:
+            # the estimate is not for the value count model
+            yield 'call', functools.partial(
+                csp_plan.cnf_size_models[encoder].calibrate,
+                [(variables, reference_value, solve_csp_result)])
+    if value_counts:
+        do_solve_result['domain_class_count'] = len(classes)
+        if do_solve_result['satisfiable_bool']:
+            do_solve_result['solution_list'] = \
+                csp_symmetry.expand_value_counts(
+                    variables, do_solve_result['solution_list'])
 
     if not quiet:
         print("overall_solve_csp_time: {0}".format(
@@ -260,19 +1715,551 @@ def do_solve(
             ))
 
     if remove_tmp_files:
-        os.remove(csp_file)
+        with tracer.start_span('cleanup', unique_repr=unique_repr):
+            os.remove(csp_file)
+
+    if cache is not None and do_solve_result['status'] != 'UNKNOWN':
+        cache.put(cache_key, do_solve_result)
+        do_solve_result['cache_hit'] = False
+    yield 'result', do_solve_result
+
+
+# name of the sum in the CSP of do_solve_sweep, variables are V1, V2, ...
+SWEEP_SUM_VARIABLE = 'S'
+
 
-    return do_solve_result
+def do_solve_sweep(
+        variables,
+        reference_values,
+        csp_solver_config,
+        remove_tmp_files=True,
+        quiet=True,
+        sugar_worker=None,
+        timeout=None,
+        memory_limit=None,
+        encoder='sugar',
+        sat_backend='subprocess',
+        ):
+    """Answers do_solve for every value of reference_values with a
+    single sugar encode.
+
+    The CSP declares the sum as the variable SWEEP_SUM_VARIABLE, so the
+    CNF does not depend on the reference value. For each value minisat
+    solves that CNF plus the two unit clauses that fix the order encoded
+    sum to it. Values outside the domain sugar computed for the sum are
+    unsatisfiable without running minisat.
+
+    Returns a dict with the shared timings and 'results', a list with a
+    result dict (reference_value, satisfiable_bool, solution_list,
+    status, ...) per reference value. timeout is for the whole sweep,
+    values not reached in time are UNKNOWN. With sat_backend 'library'
+    one incremental solver (see csp_sat) answers all values, the unit
+    clauses become assumptions."""
+
+    csp_solver_config = ensure_valid_csp_solver_config(csp_solver_config)
+    tmp_folder = csp_solver_config['tmp_folder']
+    sugarjar_path = csp_solver_config['sugarjar_path']
+
+    if sugar_worker is True:
+        sugar_worker = get_sugar_worker(sugarjar_path, tmp_folder)
+
+    b = time.time()
+    deadline = None if timeout is None else b + timeout
+    sum_variable = (
+        SWEEP_SUM_VARIABLE,
+        sum(min(variable) for variable in variables),
+        sum(max(variable) for variable in variables)
+    )
+
+    unique_repr = get_unique_repr('weighted_sum_sweep')
+    csp_file, cnf_file, map_file, target_cnf_file, out_file = [
+        os.path.join(tmp_folder, '{0}.{1}'.format(unique_repr, ext))
+        for ext in ('csp', 'cnf', 'map', 'target.cnf', 'out')]
+
+    with open(csp_file, 'w') as csp_fp:
+        for csp_piece in iter_weighted_sum_csp(
+                variables, 0, sum_variable=sum_variable):
+            csp_fp.write(csp_piece)
+    sweep_result = {
+        'create_csp_time': time.time() - b,
+        'csp_file_size': get_file_size(csp_file),
+        'results': []
+    }
+
+    def add_result(reference_value, **result):
+        result['reference_value'] = reference_value
+        if 'status' not in result:
+            result['status'] = 'SATISFIABLE' if result['satisfiable_bool'] \
+                else 'UNSATISFIABLE'
+        sweep_result['results'].append(result)
+        if not quiet:
+            print(reference_value, result['status'])
+
+    sum_domain = None
+    sat_solver = None
+    limit = None
+    try:
+        b = time.time()
+        try:
+            if sugar_worker:
+                sweep_result['sugar_warmup_time'] = sugar_worker.start()
+            sugar_encode_resp_std_out = sugar_encode(
+                csp_file, cnf_file, map_file, sugarjar_path,
+                sugar_worker=sugar_worker,
+                timeout=get_remaining_time(deadline),
+                memory_limit=memory_limit,
+                encoder=encoder)
+        except LimitReached as exc:
+            limit = exc.limit
+        sweep_result['csp_to_cnf_time'] = time.time() - b
+
+        # sugar reports UNSATISFIABLE if no value of the sum is possible
+        if limit is None and not sugar_encode_resp_std_out:
+            sweep_result['cnf_file_size'] = get_file_size(cnf_file)
+            for variable_name, code, domain_ranges in \
+                    iter_sugar_map(map_file):
+                if variable_name == SWEEP_SUM_VARIABLE:
+                    sum_domain = code, domain_ranges
+            if sum_domain is None:
+                raise DecodeException(
+                    "{0} is missing in {1}".format(
+                        SWEEP_SUM_VARIABLE, map_file))
+            import csp_sat
+            sat_solver = csp_sat.open_sat_solver(
+                sat_backend, csp_solver_config, cnf_file, out_file,
+                target_cnf_file, deadline=deadline,
+                memory_limit=memory_limit)
+
+        for reference_value in reference_values:
+            if limit is not None:
+                add_result(reference_value, satisfiable_bool=None,
+                           solution_list=None, status='UNKNOWN',
+                           limit_reached=limit)
+                continue
+            units = None
+            if sum_domain is not None:
+                units = get_order_encoding_units(
+                    sum_domain[0], sum_domain[1], reference_value)
+            if units is None:
+                add_result(reference_value, satisfiable_bool=False,
+                           solution_list=None)
+                continue
+
+            b = time.time()
+            try:
+                satisfiable_bool = sat_solver.solve(units)
+            except LimitReached as exc:
+                limit = exc.limit
+                add_result(reference_value, satisfiable_bool=None,
+                           solution_list=None, status='UNKNOWN',
+                           limit_reached=limit, minisat_time=time.time() - b)
+                continue
+            minisat_time = time.time() - b
+
+            if satisfiable_bool:
+                b = time.time()
+                solution_list = [
+                    value for variable_name, value
+                    in iter_decoded_model(sat_solver.get_model(), map_file)
+                    if variable_name != SWEEP_SUM_VARIABLE]
+                add_result(reference_value, satisfiable_bool=True,
+                           solution_list=solution_list,
+                           minisat_time=minisat_time,
+                           decode_time=time.time() - b)
+            else:
+                add_result(reference_value, satisfiable_bool=False,
+                           solution_list=[], minisat_time=minisat_time)
+
+    finally:
+        if sat_solver is not None:
+            sat_solver.close()
+        if remove_tmp_files:
+            for file_name in (csp_file, cnf_file, map_file,
+                              target_cnf_file, out_file):
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+
+    return sweep_result
+
+
+def iter_csp_solutions(
+        csp_file,
+        csp_solver_config,
+        max_solutions=None,
+        remove_tmp_files=True,
+        quiet=True,
+        sugar_worker=None,
+        timeout=None,
+        memory_limit=None,
+        encoder='sugar',
+        sat_backend='subprocess',
+        ):
+    """Lazily yields distinct solutions of csp_file, at most
+    max_solutions.
+
+    sugar encodes the problem once. After every solution a clause that
+    excludes its values is added to the CNF and minisat solves again,
+    the enumeration ends when minisat reports UNSATISFIABLE. Every
+    solution is a dict with solution_index, solution_list (in map file
+    order), minisat_time, decode_time and latency, the time it took to
+    produce this solution after the previous one was consumed (the
+    first includes the encode). Raises LimitReached if the timeout or
+    memory_limit ends the enumeration early. With sat_backend 'library'
+    the blocking clauses are added to one incremental solver (see
+    csp_sat) that keeps what it learned between solutions."""
+
+    csp_solver_config = ensure_valid_csp_solver_config(csp_solver_config)
+    tmp_folder = csp_solver_config['tmp_folder']
+    sugarjar_path = csp_solver_config['sugarjar_path']
+
+    if sugar_worker is True:
+        sugar_worker = get_sugar_worker(sugarjar_path, tmp_folder)
+
+    b = time.time()
+    deadline = None if timeout is None else b + timeout
+
+    unique_repr = get_unique_repr('enumerate')
+    cnf_file, map_file, target_cnf_file, out_file = [
+        os.path.join(tmp_folder, '{0}.{1}'.format(unique_repr, ext))
+        for ext in ('cnf', 'map', 'target.cnf', 'out')]
+
+    sat_solver = None
+    try:
+        sugar_encode_resp_std_out = sugar_encode(
+            csp_file, cnf_file, map_file, sugarjar_path,
+            sugar_worker=sugar_worker,
+            timeout=get_remaining_time(deadline),
+            memory_limit=memory_limit,
+            encoder=encoder)
+        if sugar_encode_resp_std_out:
+            if not quiet:
+                print("sugar reported UNSATISFIABLE")
+            return
+
+        variable_domains = [
+            (code, domain_ranges) for _, code, domain_ranges
+            in iter_sugar_map(map_file)]
+        import csp_sat
+        sat_solver = csp_sat.open_sat_solver(
+            sat_backend, csp_solver_config, cnf_file, out_file,
+            target_cnf_file, deadline=deadline, memory_limit=memory_limit)
+        blocking_clauses = []
+        while max_solutions is None or len(blocking_clauses) < max_solutions:
+            minisat_start = time.time()
+            satisfiable_bool = sat_solver.solve()
+            minisat_time = time.time() - minisat_start
+            if not satisfiable_bool:
+                if not quiet:
+                    print("minisat reported UNSATISFIABLE after {0} "
+                          "solutions".format(len(blocking_clauses)))
+                return
+
+            decode_start = time.time()
+            model = sat_solver.get_model()
+            solution_list = []
+            blocking_clause = []
+            for code, domain_ranges in variable_domains:
+                value = decode_order_encoding(model, code, domain_ranges)
+                solution_list.append(value)
+                blocking_clause.extend(
+                    -literal for literal in
+                    get_order_encoding_units(code, domain_ranges, value))
+            if not blocking_clause:
+                # every variable has a single value, nothing else to find
+                max_solutions = len(blocking_clauses) + 1
+            blocking_clauses.append(blocking_clause)
+            sat_solver.add_clause(blocking_clause)
+
+            yield {
+                'solution_index': len(blocking_clauses) - 1,
+                'solution_list': solution_list,
+                'minisat_time': minisat_time,
+                'decode_time': time.time() - decode_start,
+                'latency': time.time() - b,
+            }
+            b = time.time()
+
+    finally:
+        # also runs when the consumer closes the generator early
+        if sat_solver is not None:
+            sat_solver.close()
+        if remove_tmp_files:
+            for file_name in (cnf_file, map_file, target_cnf_file, out_file):
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+
+
+def iter_weighted_sum_solutions(
+        variables,
+        reference_value,
+        csp_solver_config,
+        max_solutions=None,
+        remove_tmp_files=True,
+        **kwargs
+        ):
+    """iter_csp_solutions for the problem of do_solve. The keyword
+    arguments are those of iter_csp_solutions."""
+    csp_solver_config = ensure_valid_csp_solver_config(csp_solver_config)
+    csp_file = os.path.join(
+        csp_solver_config['tmp_folder'],
+        '{0}.csp'.format(get_unique_repr('weighted_sum')))
+    try:
+        with open(csp_file, 'w') as csp_fp:
+            write_weighted_sum_csp(variables, reference_value, csp_fp)
+        for solution in iter_csp_solutions(
+                csp_file, csp_solver_config,
+                max_solutions=max_solutions,
+                remove_tmp_files=remove_tmp_files,
+                **kwargs):
+            yield solution
+    finally:
+        if remove_tmp_files and os.path.exists(csp_file):
+            os.remove(csp_file)
+
+
+# name of the objective in the CSP of do_optimize
+OBJECTIVE_VARIABLE = 'O'
+
+OPTIMIZE_SEARCHES = ('binary', 'linear')
+
+
+def iter_optimization_csp(variables, objective, reference_value=None):
+    """CSP text of do_optimize: the weighted sum (free if reference_value
+    is None) and OBJECTIVE_VARIABLE = sum(objective[i] * Vi+1)."""
+    if reference_value is None:
+        sum_variable = (
+            SWEEP_SUM_VARIABLE,
+            sum(min(variable) for variable in variables),
+            sum(max(variable) for variable in variables)
+        )
+        csp_pieces = iter_weighted_sum_csp(
+            variables, 0, sum_variable=sum_variable)
+    else:
+        csp_pieces = iter_weighted_sum_csp(variables, reference_value)
+    for csp_piece in csp_pieces:
+        yield csp_piece
+
+    terms = [
+        sorted(coefficient * value for value in variable)
+        for coefficient, variable in zip(objective, variables)]
+    yield "\n(int %s %d %d)" % (
+        OBJECTIVE_VARIABLE,
+        sum(values[0] for values in terms),
+        sum(values[-1] for values in terms))
+    yield "\n(weightedsum ( "
+    for i, coefficient in enumerate(objective):
+        if coefficient:
+            yield "( %d V%d ) " % (coefficient, i + 1)
+    yield "( -1 %s ) ) eq 0)" % OBJECTIVE_VARIABLE
+
+
+def do_optimize(
+        variables,
+        objective,
+        csp_solver_config,
+        reference_value=None,
+        maximize=False,
+        search='binary',
+        remove_tmp_files=True,
+        quiet=True,
+        sugar_worker=None,
+        timeout=None,
+        memory_limit=None,
+        encoder='sugar',
+        sat_backend='subprocess',
+        ):
+    """Finds values for variables that minimize (or with maximize=True
+    maximize) sum(objective[i] * value_i), subject to the values summing
+    up to reference_value unless it is None.
+
+    The objective is declared as the variable OBJECTIVE_VARIABLE and
+    sugar encodes the problem once. Every further minisat run solves
+    that CNF plus a unit clause bounding the order encoded objective.
+    search 'binary' halves the interval between the proven bound and the
+    best value found, 'linear' asks for anything better than the best
+    value found. With sat_backend 'library' one incremental solver (see
+    csp_sat) gets the bounding unit clauses as assumptions.
+
+    Returns a dict with satisfiable_bool, solution_list and
+    objective_value of the best solution, optimal_bool and proven_bound
+    (no solution is better than it, optimal_bool once it equals
+    objective_value), status ('OPTIMAL', 'SATISFIABLE' if a limit ended
+    the search early, 'UNSATISFIABLE' or 'UNKNOWN'), iterations and
+    trace, one dict per bound tried."""
+
+    if search not in OPTIMIZE_SEARCHES:
+        raise ValueError(
+            "search must be one of {0}".format(OPTIMIZE_SEARCHES))
+    if len(objective) != len(variables):
+        raise ValueError("objective needs a coefficient per variable")
+
+    csp_solver_config = ensure_valid_csp_solver_config(csp_solver_config)
+    tmp_folder = csp_solver_config['tmp_folder']
+    sugarjar_path = csp_solver_config['sugarjar_path']
+
+    if sugar_worker is True:
+        sugar_worker = get_sugar_worker(sugarjar_path, tmp_folder)
+
+    b = time.time()
+    deadline = None if timeout is None else b + timeout
+
+    unique_repr = get_unique_repr('optimize')
+    csp_file, cnf_file, map_file, target_cnf_file, out_file = [
+        os.path.join(tmp_folder, '{0}.{1}'.format(unique_repr, ext))
+        for ext in ('csp', 'cnf', 'map', 'target.cnf', 'out')]
+
+    with open(csp_file, 'w') as csp_fp:
+        for csp_piece in iter_optimization_csp(
+                variables, objective, reference_value):
+            csp_fp.write(csp_piece)
+    result = {
+        'create_csp_time': time.time() - b,
+        'satisfiable_bool': None,
+        'solution_list': None,
+        'objective_value': None,
+        'optimal_bool': False,
+        'proven_bound': None,
+        'trace': [],
+    }
+
+    sat_solver = None
+    try:
+        b = time.time()
+        sugar_encode_resp_std_out = sugar_encode(
+            csp_file, cnf_file, map_file, sugarjar_path,
+            sugar_worker=sugar_worker,
+            timeout=get_remaining_time(deadline),
+            memory_limit=memory_limit,
+            encoder=encoder)
+        result['csp_to_cnf_time'] = time.time() - b
+
+        if sugar_encode_resp_std_out:
+            result['satisfiable_bool'] = False
+        else:
+            objective_domain = None
+            for variable_name, code, domain_ranges in \
+                    iter_sugar_map(map_file):
+                if variable_name == OBJECTIVE_VARIABLE:
+                    objective_domain = code, domain_ranges
+            if objective_domain is None:
+                raise DecodeException("{0} is missing in {1}".format(
+                    OBJECTIVE_VARIABLE, map_file))
+            code, domain_ranges = objective_domain
+            import csp_sat
+            sat_solver = csp_sat.open_sat_solver(
+                sat_backend, csp_solver_config, cnf_file, out_file,
+                target_cnf_file, deadline=deadline,
+                memory_limit=memory_limit)
+            # every value beyond it is proven to be impossible
+            if maximize:
+                proven_bound = domain_ranges[-1][1]
+            else:
+                proven_bound = domain_ranges[0][0]
+
+            bound = None
+            while True:
+                units = []
+                if bound is not None:
+                    units = get_order_encoding_bound_units(
+                        code, domain_ranges, bound, upper=not maximize)
+                step = {'bound': bound}
+                result['trace'].append(step)
+                b = time.time()
+                satisfiable_bool = units is not None and \
+                    sat_solver.solve(units)
+                step['minisat_time'] = time.time() - b
+                step['satisfiable_bool'] = satisfiable_bool
+
+                if satisfiable_bool:
+                    solution_list = []
+                    for variable_name, value in iter_decoded_model(
+                            sat_solver.get_model(), map_file):
+                        if variable_name == OBJECTIVE_VARIABLE:
+                            objective_value = value
+                        elif variable_name != SWEEP_SUM_VARIABLE:
+                            solution_list.append(value)
+                    step['objective_value'] = objective_value
+                    result['satisfiable_bool'] = True
+                    result['solution_list'] = solution_list
+                    result['objective_value'] = objective_value
+                    if not quiet:
+                        print("found objective value", objective_value)
+                elif bound is None:
+                    result['satisfiable_bool'] = False
+                    break
+                elif maximize:
+                    proven_bound = bound - 1
+                else:
+                    proven_bound = bound + 1
+
+                best = result['objective_value']
+                if maximize:
+                    proven_bound = max(proven_bound, best)
+                    if search == 'linear':
+                        bound = best + 1
+                    else:
+                        # ceil of the middle of best + 1 .. proven_bound
+                        bound = -((-(best + 1 + proven_bound)) // 2)
+                else:
+                    proven_bound = min(proven_bound, best)
+                    if search == 'linear':
+                        bound = best - 1
+                    else:
+                        bound = (proven_bound + best - 1) // 2
+                if proven_bound == best:
+                    result['optimal_bool'] = True
+                    break
+                result['proven_bound'] = proven_bound
+
+    except LimitReached as exc:
+        result['limit_reached'] = exc.limit
+        if result['trace'] and 'minisat_time' not in result['trace'][-1]:
+            result['trace'][-1]['minisat_time'] = time.time() - b
+
+    finally:
+        if sat_solver is not None:
+            sat_solver.close()
+        if remove_tmp_files:
+            for file_name in (csp_file, cnf_file, map_file,
+                              target_cnf_file, out_file):
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+
+    if result['optimal_bool']:
+        result['proven_bound'] = result['objective_value']
+        result['status'] = 'OPTIMAL'
+    elif result['satisfiable_bool']:
+        result['status'] = 'SATISFIABLE'
+    elif result['satisfiable_bool'] is None:
+        result['status'] = 'UNKNOWN'
+    else:
+        result['status'] = 'UNSATISFIABLE'
+    result['iterations'] = len(result['trace'])
+    return result
 
 
 class ConfigurationException(Exception):
     pass
 
 
+class ValidCspSolverConfig(dict):
+    """A csp_solver_config get_valid_csp_solver_config has checked."""
+
+
+def ensure_valid_csp_solver_config(csp_solver_config):
+    """Validates csp_solver_config unless get_valid_csp_solver_config
+    returned it, which saves the file system lookups for every solve
+    of a batch."""
+    if isinstance(csp_solver_config, ValidCspSolverConfig):
+        return csp_solver_config
+    return get_valid_csp_solver_config(**csp_solver_config)
+
+
 def get_valid_csp_solver_config(
         sugarjar_path,
         minisat_path=None,
-        tmp_folder=None
+        tmp_folder=None,
+        sat_library_path=None
         ):
 
     if (not sugarjar_path or
@@ -312,10 +2299,19 @@ def get_valid_csp_solver_config(
             "does not exist" % folder
         )
 
-    return dict(
+    if sat_library_path is not None:
+        if not os.path.exists(sat_library_path):
+            raise ConfigurationException(
+                "Please pass an existing SAT solver library, '%s' "
+                "does not exist" % sat_library_path
+            )
+        sat_library_path = os.path.abspath(sat_library_path)
+
+    return ValidCspSolverConfig(
         minisat_path=minisat_path,
         sugarjar_path=sugarjar_path,
-        tmp_folder=folder
+        tmp_folder=folder,
+        sat_library_path=sat_library_path
     )
 
 
@@ -335,6 +2331,11 @@ def add_csp_config_params_to_argparse_parser(parser):
         help="sugar.jar to use",
         required=True
     )
+    parser.add_argument('--sat-library', action="store",
+        type=str,
+        help=("IPASIR SAT solver library for --sat-backend library, "
+              "default: 'ipasir' in the library search path")
+    )
     return parser
 
 
@@ -351,45 +2352,376 @@ def get_parser():
             raise argparse.ArgumentTypeError(msg)
         return os.path.abspath(file_name)
 
+    def positive_int(value):
+        value = int(value)
+        if value < 1:
+            raise argparse.ArgumentTypeError(
+                "Needs to be at least 1: {0}".format(value))
+        return value
+
+    def positive_float(value):
+        value = float(value)
+        if value <= 0:
+            raise argparse.ArgumentTypeError(
+                "Needs to be positive: {0}".format(value))
+        return value
+
     parser.add_argument('-c', '--csp-file',
         action="append",
-        type=existing_file, help="CSP file with the problem definition",
-        required=True
+        type=existing_file, help="CSP file with the problem definition"
+    )
+    parser.add_argument('--stream',
+        action="store_true",
+        help=("Read problems from stdin, one JSON object per line with "
+              "'variables' and 'reference_value' or 'csp' (CSP text) and "
+              "an optional 'id', and write one JSON result per line to "
+              "stdout as soon as it is solved")
     )
     parser.add_argument('-k','--keep-tmpfiles',
         action="store_true",
         help="Store result after program execution"
     )
+    parser.add_argument('--sugar-worker',
+        action="store_true",
+        help=("Start sugar once and reuse the JVM for all csp files "
+              "(needs javac)")
+    )
+    parser.add_argument('--decoder',
+        choices=DECODERS, default='python',
+        help=("How to turn the minisat model into values: 'python' "
+              "reads the .map file, 'sugar' runs sugar -decode, "
+              "'both' cross-checks them")
+    )
+    parser.add_argument('--encoder',
+        choices=ENCODERS, default='sugar',
+        help=("How to turn the csp file into CNF: 'sugar' runs sugar "
+              "-encode, 'python' compiles it without a JVM (only domain, "
+              "int and weightedsum)")
+    )
+    parser.add_argument('--sat-backend',
+        choices=SAT_BACKENDS, default='subprocess',
+        help=("How to run the SAT solver: 'subprocess' runs minisat on "
+              "the CNF file, 'library' solves in this process with an "
+              "IPASIR library (see --sat-library)")
+    )
+    parser.add_argument('-j', '--jobs',
+        type=positive_int, default=1,
+        help="Number of csp files to solve in parallel"
+    )
+    parser.add_argument('--cache-folder', action="store",
+        type=str,
+        help="Reuse results of identical csp files stored in this folder"
+    )
+    parser.add_argument('--cnf-stream',
+        action="store_true",
+        help=("Pipe the CNF from sugar to minisat through a FIFO instead "
+              "of writing it to the tmp folder (uses a sugar worker)")
+    )
+    parser.add_argument('--timeout',
+        type=positive_float,
+        help=("Seconds per csp file, files that take longer are "
+              "reported as UNKNOWN")
+    )
+    parser.add_argument('--memory-limit',
+        type=positive_int,
+        help=("Megabytes minisat and sugar may use per csp file, files "
+              "that need more are reported as UNKNOWN")
+    )
+    parser.add_argument('--portfolio',
+        action="append", metavar='COMMAND',
+        help=("SAT solver command line to race against the others on "
+              "every CNF, e.g. 'minisat -rnd-seed=3'. Can be repeated, "
+              "the solver is called like minisat with <cnf> <model file>")
+    )
+    parser.add_argument('--portfolio-size',
+        type=positive_int,
+        help="Race that many differently configured minisat runs"
+    )
+    parser.add_argument('--trace-file', action="store",
+        type=str,
+        help=("Append a JSON line with timings, CPU time and child peak "
+              "RSS for every solve phase to this file")
+    )
 
     return add_csp_config_params_to_argparse_parser(parser)
 
 
+def solve_csp_file(
+        csp_file,
+        keep_tmpfiles,
+        csp_solver_config,
+        sugar_worker=None,
+        decoder='python',
+        cache=None,
+        cnf_stream=False,
+        timeout=None,
+        memory_limit=None,
+        portfolio=None,
+        encoder='sugar',
+        sat_backend='subprocess',
+        ):
+    cpu_time_before = get_process_cpu_time()
+    solve_csp_time, result = solve_csp(
+        csp_file=csp_file,
+        unique_repr=get_unique_repr(
+            os.path.basename(csp_file)), #split path
+        remove_tmp_files=not keep_tmpfiles,
+        quiet=True,
+        sugar_worker=sugar_worker,
+        decoder=decoder,
+        cache=cache,
+        cnf_stream=cnf_stream,
+        timeout=timeout,
+        memory_limit=memory_limit,
+        portfolio=portfolio,
+        encoder=encoder,
+        sat_backend=sat_backend,
+        csp_solver_config=csp_solver_config
+    )
+    return (csp_file, solve_csp_time, result,
+            get_process_cpu_time() - cpu_time_before)
+
+
+def _solve_csp_file_kwargs(kwargs):
+    # multiprocessing needs a picklable module level function
+    return solve_csp_file(**kwargs)
+
+
+def check_weighted_sum(variables, reference_value):
+    """Raises ValueError unless variables is a list of lists of
+    integers and reference_value an integer, what do_solve expects."""
+    import numbers
+
+    def is_integer(value):
+        return isinstance(value, numbers.Integral) and \
+            not isinstance(value, bool)
+
+    if not is_integer(reference_value):
+        raise ValueError("reference_value must be an integer: {0!r}".format(
+            reference_value))
+    if not isinstance(variables, (list, tuple)):
+        raise ValueError("variables must be a list of domains")
+    for variable in variables:
+        if not isinstance(variable, (list, tuple)) or \
+                not all(is_integer(value) for value in variable):
+            raise ValueError(
+                "a domain must be a list of integers: {0!r}".format(
+                    variable))
+
+
+def solve_stream_record(line, line_number, csp_solver_config,
+                        remove_tmp_files=True, **solve_kwargs):
+    """Result dict for one line of --stream input, a JSON object with
+    variables and reference_value (solved by do_solve) or csp, the text
+    of a CSP (solved by solve_csp). Its id, by default line_number, is
+    copied to the result. Problems that can not be solved get status
+    'ERROR' and the message as error instead of raising."""
+    record_id = line_number
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError("expected a JSON object")
+        record_id = record.get('id', line_number)
+        if 'csp' in record:
+            unique_repr = get_unique_repr('stream')
+            csp_file = os.path.join(
+                csp_solver_config['tmp_folder'],
+                '{0}.csp'.format(unique_repr))
+            with open(csp_file, 'w') as csp_fp:
+                csp_fp.write(record['csp'])
+            try:
+                solve_csp_time, result = solve_csp(
+                    csp_file=csp_file,
+                    unique_repr=unique_repr,
+                    remove_tmp_files=remove_tmp_files,
+                    csp_solver_config=csp_solver_config,
+                    **solve_kwargs)
+            finally:
+                if remove_tmp_files:
+                    os.remove(csp_file)
+            result['overall_solve_csp_time'] = solve_csp_time
+        elif 'variables' in record and 'reference_value' in record:
+            check_weighted_sum(record['variables'], record['reference_value'])
+            result = do_solve(
+                variables=record['variables'],
+                reference_value=record['reference_value'],
+                remove_tmp_files=remove_tmp_files,
+                csp_solver_config=csp_solver_config,
+                **solve_kwargs)
+        else:
+            raise ValueError(
+                "expected 'csp' or 'variables' and 'reference_value'")
+    except Exception as exc:
+        result = {
+            'status': 'ERROR',
+            'error': '{0}: {1}'.format(type(exc).__name__, exc),
+        }
+    result['id'] = record_id
+    return result
+
+
+def _solve_stream_record_kwargs(kwargs):
+    # multiprocessing needs a picklable module level function
+    return solve_stream_record(**kwargs)
+
+
+def iter_stream_results(input_fp, csp_solver_config, jobs=1,
+                        **solve_kwargs):
+    """Yields the result of every non-empty line of input_fp (see
+    solve_stream_record) as soon as it is solved, with jobs > 1 not
+    in input order. Lines are read as they arrive, so input_fp can be
+    a pipe that stays open."""
+    csp_solver_config = ensure_valid_csp_solver_config(csp_solver_config)
+    # readline, iterating a python 2 file reads ahead and blocks
+    records = (
+        dict(solve_kwargs, line=line, line_number=line_number,
+             csp_solver_config=csp_solver_config)
+        for line_number, line in enumerate(iter(input_fp.readline, ''), 1)
+        if line.strip())
+
+    pool = None
+    try:
+        if jobs > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(jobs)
+            solved = pool.imap_unordered(_solve_stream_record_kwargs, records)
+        else:
+            solved = (_solve_stream_record_kwargs(record)
+                      for record in records)
+        for result in solved:
+            yield result
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+
 def main(args=sys.argv[1:]):
+    if args[:1] == ['serve']:
+        import csp_serve
+        return csp_serve.main(args[1:])
+    if args[:1] == ['worker']:
+        import csp_spool
+        return csp_spool.main(args[1:])
+
     parser = get_parser()
     parsed_args = parser.parse_args(args)
+    if bool(parsed_args.csp_file) == parsed_args.stream:
+        parser.error("pass either -c/--csp-file or --stream")
 
     csp_solver_config = get_valid_csp_solver_config(
         minisat_path=parsed_args.minisat,
         sugarjar_path=parsed_args.sugar_jar,
-        tmp_folder=parsed_args.tmp_folder
+        tmp_folder=parsed_args.tmp_folder,
+        sat_library_path=parsed_args.sat_library
     )
 
-    for csp_file in parsed_args.csp_file:
-        print(">>> Processing",csp_file)
-        unique_repr = u'{0}_{1}'.format(
-            os.path.basename(csp_file), #split path
-            time.time())
-        solve_csp_time, result = solve_csp(
+    memory_limit = None
+    if parsed_args.memory_limit:
+        memory_limit = parsed_args.memory_limit * 1024 * 1024
+
+    portfolio = list(parsed_args.portfolio or [])
+    if parsed_args.portfolio_size:
+        portfolio.extend(get_minisat_portfolio(
+            csp_solver_config['minisat_path'], parsed_args.portfolio_size))
+
+    sugar_worker = None
+    if parsed_args.sugar_worker:
+        if parsed_args.jobs > 1:
+            # every pool process starts its own worker
+            sugar_worker = True
+        else:
+            sugar_worker = SugarWorker(
+                csp_solver_config['sugarjar_path'],
+                tmp_folder=csp_solver_config['tmp_folder'],
+                memory_limit=memory_limit)
+
+    cache = None
+    if parsed_args.cache_folder:
+        import csp_cache
+        cache = csp_cache.ResultCache(parsed_args.cache_folder)
+
+    if parsed_args.trace_file:
+        import csp_trace
+        # pool processes inherit the callback
+        csp_trace.tracer.add_callback(
+            csp_trace.JsonLinesExporter(parsed_args.trace_file))
+
+    solve_kwargs = dict(
+        csp_solver_config=csp_solver_config,
+        sugar_worker=sugar_worker,
+        decoder=parsed_args.decoder,
+        cache=cache,
+        cnf_stream=parsed_args.cnf_stream,
+        timeout=parsed_args.timeout,
+        memory_limit=memory_limit,
+        portfolio=portfolio or None,
+        encoder=parsed_args.encoder,
+        sat_backend=parsed_args.sat_backend
+    )
+
+    if parsed_args.stream:
+        output_fp = sys.stdout
+        # what the solvers print must not end up between the results
+        sys.stdout = sys.stderr
+        try:
+            for result in iter_stream_results(
+                    sys.stdin, jobs=parsed_args.jobs,
+                    remove_tmp_files=not parsed_args.keep_tmpfiles,
+                    **solve_kwargs):
+                output_fp.write(json.dumps(result, sort_keys=True) + '\n')
+                output_fp.flush()
+        finally:
+            sys.stdout = output_fp
+            if isinstance(sugar_worker, SugarWorker):
+                sugar_worker.close()
+        return
+
+    jobs = [
+        dict(
+            solve_kwargs,
             csp_file=csp_file,
-            unique_repr=unique_repr,
-            remove_tmp_files=not parsed_args.keep_tmpfiles,
-            quiet=True,
-            csp_solver_config=csp_solver_config
-        )
-        print(
-            "SATISFIABLE" if result.pop('satisfiable_bool')\
-            else "UNSATISFIABLE!", 'Took', solve_csp_time
+            keep_tmpfiles=parsed_args.keep_tmpfiles
         )
+        for csp_file in parsed_args.csp_file
+    ]
+
+    pool = None
+    if parsed_args.jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(parsed_args.jobs, len(jobs)))
+        solved = pool.imap_unordered(_solve_csp_file_kwargs, jobs)
+    else:
+        solved = (_solve_csp_file_kwargs(job) for job in jobs)
 
-        import pprint
-        pprint.pprint(result)
+    b = time.time()
+    summed_cpu_time = 0.0
+    cache_hits = 0
+    try:
+        for csp_file, solve_csp_time, result, cpu_time in solved:
+            summed_cpu_time += cpu_time
+            cache_hits += result.get('cache_hit', False)
+            print(">>> Processed", csp_file)
+            satisfiable_bool = result.pop('satisfiable_bool')
+            print(
+                "UNKNOWN" if satisfiable_bool is None
+                else "SATISFIABLE" if satisfiable_bool
+                else "UNSATISFIABLE!", 'Took', solve_csp_time
+            )
+
+            import pprint
+            pprint.pprint(result)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if isinstance(sugar_worker, SugarWorker):
+            sugar_worker.close()
+
+    print(
+        "Solved {0} csp files with {1} jobs: wall clock {2:.3f}s, "
+        "summed CPU {3:.3f}s".format(
+            len(jobs), parsed_args.jobs, time.time() - b, summed_cpu_time)
+    )
+    if cache is not None:
+        print("Cache hits: {0} of {1}".format(cache_hits, len(jobs)))
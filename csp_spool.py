@@ -0,0 +1,313 @@
+"""A work queue on a directory, so solver hosts that share a mount
+share the solving.
+
+    csp_solver worker /shared/spool --sugar-jar sugar.jar
+
+A job is a JSON object like a line of --stream input: variables and
+reference_value, or csp, the text of a CSP, and optionally options,
+do_solve keyword arguments from csp_serve.REQUEST_OPTIONS (for csp
+only the solve_csp ones, CSP_JOB_OPTIONS). Spool.submit checks them and
+writes it to tmp/ and renames it into pending/, so workers never see
+half written jobs. A worker claims a job by renaming it from pending/
+to claimed/, rename is atomic so only one worker gets it. While it
+solves, the worker touches the claimed file every third of the lease
+timeout. The result is written (again through tmp/) to
+done/<job_id>.result.json and the job moved next to it.
+
+A claimed file that was not touched for longer than the lease timeout
+belongs to a crashed or cut off worker, any worker renames it back to
+pending/. The clocks of the hosts have to agree to within the lease
+timeout. A job that outlives its lease and is solved twice gets the
+same result written twice.
+"""
+from __future__ import print_function
+
+import argparse
+import errno
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+from csp_solver import (
+    add_csp_config_params_to_argparse_parser,
+    ensure_valid_csp_solver_config,
+    get_valid_csp_solver_config,
+    solve_stream_record
+)
+
+
+PENDING = 'pending'
+CLAIMED = 'claimed'
+DONE = 'done'
+TMP = 'tmp'
+
+DEFAULT_LEASE_TIMEOUT = 300.0
+DEFAULT_POLL_INTERVAL = 1.0
+
+RESULT_SUFFIX = '.result.json'
+
+# csp_serve.REQUEST_OPTIONS that solve_csp takes, the rest only apply
+# to weighted sum jobs solved by do_solve
+CSP_JOB_OPTIONS = (
+    'decoder', 'timeout', 'memory_limit', 'portfolio', 'encoder',
+    'sat_backend'
+)
+
+
+def check_job_options(options, csp_job=False):
+    """Raises ValueError if options are not do_solve keyword arguments
+    from csp_serve.REQUEST_OPTIONS, or for a csp_job not from
+    CSP_JOB_OPTIONS."""
+    from csp_serve import REQUEST_OPTIONS
+    supported = CSP_JOB_OPTIONS if csp_job else REQUEST_OPTIONS
+    unknown = set(options) - set(supported)
+    if unknown:
+        raise ValueError("unsupported options{0}: {1}".format(
+            ' for csp jobs' if csp_job else '',
+            ', '.join(sorted(unknown))))
+
+
+def get_job_id():
+    # sorts by submission time, workers claim the oldest jobs first
+    return '{0:015d}-{1}'.format(int(time.time() * 1000), uuid.uuid4().hex)
+
+
+class Spool(object):
+    """The directories of a spool, created if missing."""
+
+    def __init__(self, spool_dir):
+        self.spool_dir = spool_dir
+        for name in (PENDING, CLAIMED, DONE, TMP):
+            try:
+                os.makedirs(os.path.join(spool_dir, name))
+            except OSError as exc:
+                if exc.errno != errno.EEXIST:
+                    raise
+
+    def get_path(self, state, file_name):
+        return os.path.join(self.spool_dir, state, file_name)
+
+    def _publish(self, state, file_name, data):
+        # another host must never read a partially written file
+        tmp_path = self.get_path(
+            TMP, '{0}.{1}'.format(uuid.uuid4().hex, file_name))
+        with open(tmp_path, 'w') as fp:
+            json.dump(data, fp, sort_keys=True)
+        os.rename(tmp_path, self.get_path(state, file_name))
+
+    def submit(self, variables=None, reference_value=None, csp=None,
+               job_id=None, **options):
+        """Queues a weighted sum problem or the text of a CSP and
+        returns its job_id. options are checked with check_job_options,
+        ValueError is raised for unsupported ones."""
+        check_job_options(options, csp_job=csp is not None)
+        if csp is None:
+            record = dict(variables=variables,
+                          reference_value=reference_value)
+        else:
+            record = dict(csp=csp)
+        record['id'] = job_id = job_id or get_job_id()
+        if options:
+            record['options'] = options
+        self._publish(PENDING, job_id + '.json', record)
+        return job_id
+
+    def get_result(self, job_id):
+        """The result dict of job_id, None if it is not solved yet."""
+        try:
+            with open(self.get_path(DONE, job_id + RESULT_SUFFIX)) as fp:
+                return json.load(fp)
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            return None
+
+    def wait(self, job_ids, timeout=None, poll_interval=0.2):
+        """Dict of job_id to result dict, once all job_ids are solved.
+        Raises csp_solver.LimitReached after timeout seconds."""
+        from csp_solver import LimitReached
+        deadline = time.time() + timeout if timeout is not None else None
+        results = {}
+        while True:
+            for job_id in job_ids:
+                if job_id not in results:
+                    result = self.get_result(job_id)
+                    if result is not None:
+                        results[job_id] = result
+            if len(results) == len(job_ids):
+                return results
+            if deadline is not None and time.time() > deadline:
+                raise LimitReached('timeout')
+            time.sleep(poll_interval)
+
+    def claim(self):
+        """Claims the oldest pending job, returns its job_id or None."""
+        for file_name in sorted(os.listdir(self.get_path(PENDING, ''))):
+            if not file_name.endswith('.json'):
+                continue
+            try:
+                os.rename(self.get_path(PENDING, file_name),
+                          self.get_path(CLAIMED, file_name))
+            except OSError:
+                # another worker was faster
+                continue
+            # the lease starts now, not when the job was submitted
+            self.renew(file_name[:-len('.json')])
+            return file_name[:-len('.json')]
+        return None
+
+    def renew(self, job_id):
+        try:
+            os.utime(self.get_path(CLAIMED, job_id + '.json'), None)
+        except OSError:
+            # requeued after all, the result is still written
+            pass
+
+    def requeue_expired(self, lease_timeout=DEFAULT_LEASE_TIMEOUT):
+        """Moves claimed jobs whose lease ran out back to pending/,
+        returns their job_ids."""
+        requeued = []
+        now = time.time()
+        for file_name in os.listdir(self.get_path(CLAIMED, '')):
+            path = self.get_path(CLAIMED, file_name)
+            try:
+                stat = os.stat(path)
+                # rename sets ctime, which covers a claim before its
+                # renew
+                if now - max(stat.st_mtime, stat.st_ctime) <= lease_timeout:
+                    continue
+                os.rename(path, self.get_path(PENDING, file_name))
+            except OSError:
+                continue
+            requeued.append(file_name[:-len('.json')])
+        return requeued
+
+    def complete(self, job_id, result):
+        self._publish(DONE, job_id + RESULT_SUFFIX, result)
+        try:
+            os.rename(self.get_path(CLAIMED, job_id + '.json'),
+                      self.get_path(DONE, job_id + '.json'))
+        except OSError:
+            pass
+
+    def stats(self):
+        """Number of jobs in every state."""
+        counts = {}
+        for state in (PENDING, CLAIMED):
+            counts[state] = len(os.listdir(self.get_path(state, '')))
+        counts[DONE] = len([
+            file_name for file_name in os.listdir(self.get_path(DONE, ''))
+            if file_name.endswith(RESULT_SUFFIX)])
+        return counts
+
+
+def solve_job(spool, job_id, csp_solver_config, **solve_kwargs):
+    """Result dict of the claimed job_id, see
+    csp_solver.solve_stream_record."""
+    with open(spool.get_path(CLAIMED, job_id + '.json')) as fp:
+        line = fp.read()
+    try:
+        # jobs written without Spool.submit
+        record = json.loads(line)
+        options = record.get('options') or {}
+        check_job_options(options, csp_job='csp' in record)
+    except Exception as exc:
+        return {
+            'id': job_id,
+            'status': 'ERROR',
+            'error': '{0}: {1}'.format(type(exc).__name__, exc),
+        }
+    solve_kwargs = dict(solve_kwargs, **options)
+    return solve_stream_record(line, job_id, csp_solver_config,
+                               **solve_kwargs)
+
+
+def _renew_lease(spool, job_id, interval, solved_event):
+    while not solved_event.wait(interval):
+        spool.renew(job_id)
+
+
+def run_worker(spool, csp_solver_config,
+               lease_timeout=DEFAULT_LEASE_TIMEOUT,
+               poll_interval=DEFAULT_POLL_INTERVAL, exit_when_empty=False,
+               max_jobs=None, **solve_kwargs):
+    """Solves jobs of spool until it is empty (with exit_when_empty) or
+    max_jobs are solved, returns the number of solved jobs. solve_kwargs
+    are passed to do_solve or solve_csp, job options override them."""
+    csp_solver_config = ensure_valid_csp_solver_config(csp_solver_config)
+    solved = 0
+    while max_jobs is None or solved < max_jobs:
+        spool.requeue_expired(lease_timeout)
+        job_id = spool.claim()
+        if job_id is None:
+            if exit_when_empty and not os.listdir(
+                    spool.get_path(CLAIMED, '')):
+                return solved
+            time.sleep(poll_interval)
+            continue
+
+        solved_event = threading.Event()
+        heartbeat_thread = threading.Thread(
+            target=_renew_lease,
+            args=(spool, job_id, lease_timeout / 3.0, solved_event))
+        heartbeat_thread.daemon = True
+        heartbeat_thread.start()
+        try:
+            result = solve_job(spool, job_id, csp_solver_config,
+                               **solve_kwargs)
+        finally:
+            solved_event.set()
+            heartbeat_thread.join()
+        spool.complete(job_id, result)
+        solved += 1
+    return solved
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='csp_solver worker')
+
+    def positive_float(value):
+        value = float(value)
+        if value <= 0:
+            raise argparse.ArgumentTypeError(
+                "Needs to be positive: {0}".format(value))
+        return value
+
+    parser.add_argument('spool_dir',
+        help="Spool directory, shared by the workers of all hosts")
+    parser.add_argument('--lease-timeout', type=positive_float,
+        default=DEFAULT_LEASE_TIMEOUT,
+        help=("Seconds after which the job of a worker that stopped "
+              "renewing its lease is given to another worker"))
+    parser.add_argument('--poll-interval', type=positive_float,
+        default=DEFAULT_POLL_INTERVAL,
+        help="Seconds to wait when no job is pending")
+    parser.add_argument('--exit-when-empty', action="store_true",
+        help="Exit when no job is pending or claimed")
+    parser.add_argument('--timeout', type=positive_float,
+        help="Seconds a job may take, unless its options say otherwise")
+    return add_csp_config_params_to_argparse_parser(parser)
+
+
+def main(args=sys.argv[1:]):
+    parsed_args = get_parser().parse_args(args)
+    csp_solver_config = get_valid_csp_solver_config(
+        minisat_path=parsed_args.minisat,
+        sugarjar_path=parsed_args.sugar_jar,
+        tmp_folder=parsed_args.tmp_folder,
+        sat_library_path=parsed_args.sat_library
+    )
+    try:
+        solved = run_worker(
+            Spool(parsed_args.spool_dir),
+            csp_solver_config,
+            lease_timeout=parsed_args.lease_timeout,
+            poll_interval=parsed_args.poll_interval,
+            exit_when_empty=parsed_args.exit_when_empty,
+            timeout=parsed_args.timeout)
+    except KeyboardInterrupt:
+        return
+    print("Solved {0} jobs".format(solved))
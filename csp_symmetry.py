@@ -0,0 +1,80 @@
+"""Value count model of weighted sums over interchangeable variables.
+
+Variables with the same domain can swap their values without changing
+the sum, so a SAT solver searching the individual variables wastes time
+on permutations. The value count model has an integer N<c>_<i> for every
+domain class c and domain value i, how many variables of the class take
+that value:
+
+    sum(N<c>_i for all i) == size of class c
+    sum(value_i * N<c>_i for all c and i) == reference_value
+
+A solution of the counts is expanded back to one value per variable in
+the original order.
+"""
+from __future__ import print_function
+
+
+def get_domain_classes(variables):
+    """Sorted domain values and size of every domain class, in order of
+    first appearance, and the class index of every variable."""
+    classes = []
+    class_indexes = {}
+    variable_classes = []
+    for variable in variables:
+        domain = frozenset(variable)
+        if domain not in class_indexes:
+            class_indexes[domain] = len(classes)
+            classes.append([sorted(domain), 0])
+        class_index = class_indexes[domain]
+        classes[class_index][1] += 1
+        variable_classes.append(class_index)
+    return classes, variable_classes
+
+
+def get_count_variable_name(class_index, value_index):
+    return 'N{0}_{1}'.format(class_index + 1, value_index + 1)
+
+
+def iter_value_count_csp(variables, reference_value):
+    """Yields the CSP of the value count model piece by piece, the count
+    variables are declared class by class in domain value order."""
+    classes, _ = get_domain_classes(variables)
+    for class_index, (values, size) in enumerate(classes):
+        for value_index in range(len(values)):
+            yield "(int %s 0 %d)\n" % (
+                get_count_variable_name(class_index, value_index), size)
+
+    for class_index, (values, size) in enumerate(classes):
+        yield "(weightedsum ( "
+        for value_index in range(len(values)):
+            yield "( 1 %s ) " % get_count_variable_name(
+                class_index, value_index)
+        yield ") eq %d)\n" % size
+
+    yield "(weightedsum ( "
+    for class_index, (values, _) in enumerate(classes):
+        for value_index, value in enumerate(values):
+            if value:
+                yield "( %d %s ) " % (value, get_count_variable_name(
+                    class_index, value_index))
+    yield ") eq {0})".format(reference_value)
+
+
+def expand_value_counts(variables, counts):
+    """solution_list for variables from the solved counts, which are in
+    the declaration order of iter_value_count_csp. The values of a class
+    are handed out in ascending order."""
+    classes, variable_classes = get_domain_classes(variables)
+    class_values = []
+    counts = iter(counts)
+    for values, size in classes:
+        expanded = []
+        for value in values:
+            expanded.extend([value] * next(counts))
+        assert len(expanded) == size, (expanded, size)
+        # handed out from the end
+        expanded.reverse()
+        class_values.append(expanded)
+    return [class_values[class_index].pop()
+            for class_index in variable_classes]
@@ -0,0 +1,202 @@
+"""Spans for the phases of a solve and exporters for them.
+
+solve_csp and do_solve report a span for each phase: 'generate' (writing
+the csp file), 'warmup', 'encode', 'solve', 'decode' and 'cleanup'. All
+spans of one solve carry its unique_repr. A span records start and end,
+wall_time, the cpu_time of this process and the child_cpu_time of the
+child processes waited for during the span. The peak RSS of a single
+child is not available once subprocess has reaped it, only the high
+water mark of all children the process waited for (RUSAGE_CHILDREN).
+children_rss_high_water is that mark when the span finished, it only
+tells about the child of a phase if that child set a new high. A long
+running SugarWorker JVM is not waited for and does not show up there.
+With several solves running in threads of one process the cpu and
+child figures of concurrent spans overlap.
+
+Callbacks get every finished Span. Register them on the process wide
+tracer to instrument all solves without passing a tracer around:
+
+    csp_trace.tracer.add_callback(csp_trace.JsonLinesExporter('spans.jsonl'))
+"""
+from __future__ import print_function
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def get_child_max_rss():
+    """Peak RSS of the biggest child process waited for so far in bytes
+    (the RUSAGE_CHILDREN high water mark) or None."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # kilobytes on Linux, bytes on Mac OS X
+    return max_rss if os.uname()[0] == 'Darwin' else max_rss * 1024
+
+
+class Span(object):
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.status = None
+        self.end = None
+        self._times = os.times()
+        self.start = time.time()
+
+    @property
+    def finished(self):
+        return self.end is not None
+
+    def finish(self, status='ok', **attributes):
+        """Ends the span and passes it to the callbacks, only the first
+        call counts."""
+        if self.finished:
+            return
+        self.end = time.time()
+        times = os.times()
+        self.status = status
+        self.attributes.update(attributes)
+        self.wall_time = self.end - self.start
+        self.cpu_time = sum(times[:2]) - sum(self._times[:2])
+        self.child_cpu_time = sum(times[2:4]) - sum(self._times[2:4])
+        self.children_rss_high_water = get_child_max_rss()
+        self.tracer.emit(self)
+
+    def to_dict(self):
+        span_dict = dict(self.attributes)
+        span_dict.update(
+            name=self.name,
+            status=self.status,
+            start=self.start,
+            end=self.end,
+            wall_time=self.wall_time,
+            cpu_time=self.cpu_time,
+            child_cpu_time=self.child_cpu_time,
+            children_rss_high_water=self.children_rss_high_water
+        )
+        return span_dict
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish('ok' if exc_type is None else exc_type.__name__)
+
+
+class Tracer(object):
+    def __init__(self, callbacks=()):
+        self.callbacks = list(callbacks)
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def start_span(self, name, **attributes):
+        """A running Span, finish() it or use it as context manager
+        which sets the status to the name of an escaping exception."""
+        return Span(self, name, attributes)
+
+    def emit(self, span):
+        for callback in list(self.callbacks):
+            callback(span)
+
+
+# process wide default of solve_csp and do_solve
+tracer = Tracer()
+
+
+class JsonLinesExporter(object):
+    """Appends every span as a line of JSON to file_name."""
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span.to_dict(), sort_keys=True) + '\n'
+        with self._lock:
+            with open(self.file_name, 'a') as trace_fp:
+                trace_fp.write(line)
+
+
+class PrometheusTextfileExporter(object):
+    """Sums spans up per name and rewrites file_name in the Prometheus
+    text format after every span, for node_exporter's textfile
+    collector. The file is replaced atomically. Totals are per process,
+    give every process its own file."""
+
+    COUNTERS = (
+        ('wall_seconds_total', 'wall_time', "Wall clock time of spans"),
+        ('cpu_seconds_total', 'cpu_time', "CPU time of this process"),
+        ('child_cpu_seconds_total', 'child_cpu_time',
+         "CPU time of child processes"),
+    )
+
+    def __init__(self, file_name, prefix='csp_solver_span'):
+        self.file_name = os.path.abspath(file_name)
+        self.prefix = prefix
+        self._counts = {}
+        self._totals = {}
+        self._children_rss_high_water = None
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        with self._lock:
+            count_key = (span.name, span.status)
+            self._counts[count_key] = self._counts.get(count_key, 0) + 1
+            for _, attribute, _ in self.COUNTERS:
+                total_key = (span.name, attribute)
+                self._totals[total_key] = self._totals.get(total_key, 0.0) \
+                    + getattr(span, attribute)
+            if span.children_rss_high_water is not None:
+                self._children_rss_high_water = max(
+                    self._children_rss_high_water or 0,
+                    span.children_rss_high_water)
+            self.write()
+
+    def iter_lines(self):
+        prefix = self.prefix
+        yield '# HELP {0}_count_total Finished spans'.format(prefix)
+        yield '# TYPE {0}_count_total counter'.format(prefix)
+        for (name, status), count in sorted(self._counts.items()):
+            yield '{0}_count_total{{span="{1}",status="{2}"}} {3}'.format(
+                prefix, name, status, count)
+        for metric, attribute, help_text in self.COUNTERS:
+            yield '# HELP {0}_{1} {2}'.format(prefix, metric, help_text)
+            yield '# TYPE {0}_{1} counter'.format(prefix, metric)
+            for (name, total_attribute), total in \
+                    sorted(self._totals.items()):
+                if total_attribute == attribute:
+                    yield '{0}_{1}{{span="{2}"}} {3!r}'.format(
+                        prefix, metric, name, total)
+        if self._children_rss_high_water is not None:
+            yield ('# HELP {0}_children_rss_high_water_bytes Peak RSS of '
+                   'the biggest child process'.format(prefix))
+            yield '# TYPE {0}_children_rss_high_water_bytes gauge'.format(
+                prefix)
+            yield '{0}_children_rss_high_water_bytes {1}'.format(
+                prefix, self._children_rss_high_water)
+
+    def write(self):
+        tmp_fd, tmp_file = tempfile.mkstemp(
+            dir=os.path.dirname(self.file_name), suffix='.tmp')
+        try:
+            with os.fdopen(tmp_fd, 'w') as tmp_fp:
+                for line in self.iter_lines():
+                    tmp_fp.write(line + '\n')
+            getattr(os, 'replace', os.rename)(tmp_file, self.file_name)
+        except:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
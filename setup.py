@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import sys
+
 from setuptools import setup
 
+# async def does not compile on python 2
+py3_modules = ['csp_async'] if sys.version_info >= (3, 5) else []
+
 setup(
     name='Csp-Solver',
     version='0.4',
@@ -15,7 +20,11 @@ setup(
         '(http://bach.istc.kobe-u.ac.jp/sugar/) and minisat2 '
         '(http://minisat.se/MiniSat.html)'),
     long_description=open('README.md').read(),
-    py_modules= ['csp_solver'],
+    py_modules= ['csp_solver', 'csp_dp', 'csp_cache',
+                 'csp_encoder', 'csp_trace', 'csp_presolve',
+                 'csp_symmetry', 'csp_batch', 'csp_sat',
+                 'csp_count', 'csp_serve', 'csp_spool',
+                 'csp_plan'] + py3_modules,
 
     entry_points={
         'console_scripts': [
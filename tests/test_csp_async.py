@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    import asyncio
+    import csp_async
+except (ImportError, SyntaxError):
+    # python 2
+    csp_async = None
+
+from csp_solver import (
+    ConfigurationException,
+    LimitReached,
+    do_solve
+)
+from csp_trace import Tracer
+from tests.test_csp_solver import (
+    csp_solver_config,
+    sample_csp_file_solvable
+)
+
+
+@unittest.skipIf(csp_async is None, "needs python 3.5+")
+class TestRunProcess(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_semaphore_bounds_running_processes(self):
+        semaphore = asyncio.Semaphore(2)
+        b = time.time()
+        results = self.loop.run_until_complete(asyncio.gather(*[
+            csp_async.run_process(['sleep', '0.3'], semaphore)
+            for _ in range(4)
+        ]))
+        assert time.time() - b >= 0.6
+        self.failUnlessEqual([result[0] for result in results], [0] * 4)
+
+    def test_deadline_kills_process(self):
+        b = time.time()
+        self.failUnlessRaises(
+            LimitReached,
+            self.loop.run_until_complete,
+            csp_async.run_process(
+                ['sleep', '30'], asyncio.Semaphore(1),
+                deadline=time.time() + 0.2)
+        )
+        assert time.time() - b < 10
+
+    def test_cancel_kills_process(self):
+        b = time.time()
+        task = self.loop.create_task(
+            csp_async.run_process(['sleep', '30'], asyncio.Semaphore(1)))
+        self.loop.call_later(0.2, task.cancel)
+        self.failUnlessRaises(
+            asyncio.CancelledError, self.loop.run_until_complete, task)
+        assert time.time() - b < 10
+
+
+@unittest.skipIf(csp_async is None, "needs python 3.5+")
+class TestSolveAsync(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_do_solve_async_equals_do_solve(self):
+        problems = [
+            ([[1,2], [1,2]], 4),
+            ([[1,2], [1,2]], 5),
+            ([[-1, 0, 1], [-1,-2,-3], [-1, 0, 1], [-1,-2,-3]], 0),
+        ]
+        results = self.loop.run_until_complete(asyncio.gather(*[
+            csp_async.do_solve_async(
+                variables=variables,
+                reference_value=reference_value,
+                csp_solver_config=csp_solver_config
+            )
+            for variables, reference_value in problems
+        ]))
+        for (variables, reference_value), result in zip(problems, results):
+            expected = do_solve(
+                variables=variables,
+                reference_value=reference_value,
+                csp_solver_config=csp_solver_config
+            )
+            self.failUnlessEqual(
+                result['satisfiable_bool'], expected['satisfiable_bool'])
+            self.failUnlessEqual(
+                result['solution_list'], expected['solution_list'])
+
+    def test_options_of_do_solve(self):
+        spans = []
+        result = self.loop.run_until_complete(csp_async.do_solve_async(
+            variables=[[1, 2, 3]] * 4,
+            reference_value=7,
+            csp_solver_config=csp_solver_config,
+            encoder='python',
+            tracer=Tracer([spans.append])
+        ))
+        self.failUnlessEqual(
+            (result['satisfiable_bool'], sum(result['solution_list'])),
+            (True, 7))
+        self.failUnlessEqual(
+            [span.name for span in spans],
+            ['generate', 'encode', 'solve', 'decode', 'cleanup', 'cleanup'])
+        self.failUnlessEqual(spans[1].attributes['encoder'], 'python')
+
+        result = self.loop.run_until_complete(csp_async.do_solve_async(
+            variables=[[1, 2, 3]] * 4,
+            reference_value=7,
+            csp_solver_config=csp_solver_config,
+            timeout=0
+        ))
+        self.failUnlessEqual(
+            (result['status'], result['limit_reached']),
+            ('UNKNOWN', 'timeout'))
+
+    def test_portfolio(self):
+        result = self.loop.run_until_complete(csp_async.do_solve_async(
+            [[1, 2, 3]] * 4, 7, csp_solver_config, encoder='python',
+            portfolio=[['/bin/sh', '-c', 'exec sleep 30'],
+                       [csp_solver_config['minisat_path']]],
+            semaphore=asyncio.Semaphore(2)
+        ))
+        self.failUnlessEqual(
+            (result['satisfiable_bool'], sum(result['solution_list'])),
+            (True, 7))
+        self.failUnlessEqual(result['portfolio_winner'],
+                             csp_solver_config['minisat_path'])
+
+    def test_cancel_kills_portfolio(self):
+        tmp_folder = tempfile.mkdtemp()
+        try:
+            # every solver writes its pid next to its model file
+            solver_cmd = ['/bin/sh', '-c',
+                          'echo $$ > "$1.pid"; exec sleep 30']
+            task = self.loop.create_task(csp_async.do_solve_async(
+                [[1, 2, 3]] * 4, 7,
+                dict(csp_solver_config, tmp_folder=tmp_folder),
+                encoder='python', portfolio=[solver_cmd] * 3,
+                semaphore=asyncio.Semaphore(3)
+            ))
+            pid_files = []
+            b = time.time()
+            while len(pid_files) < 3 and time.time() - b < 10:
+                self.loop.run_until_complete(asyncio.sleep(0.05))
+                pid_files = [os.path.join(tmp_folder, file_name)
+                             for file_name in os.listdir(tmp_folder)
+                             if file_name.endswith('.pid')]
+            self.failUnlessEqual(len(pid_files), 3)
+            self.loop.run_until_complete(asyncio.sleep(0.1))
+            task.cancel()
+            self.failUnlessRaises(
+                asyncio.CancelledError, self.loop.run_until_complete, task)
+            for pid_file in pid_files:
+                with open(pid_file) as pid_fp:
+                    pid = int(pid_fp.read())
+                self.failUnlessRaises(OSError, os.kill, pid, 0)
+        finally:
+            shutil.rmtree(tmp_folder)
+
+    def test_sugar_worker_is_refused(self):
+        for option in ('sugar_worker', 'cnf_stream'):
+            self.failUnlessRaises(
+                ConfigurationException, self.loop.run_until_complete,
+                csp_async.do_solve_async(
+                    [[1, 2]], 1, csp_solver_config, **{option: True}))
+
+    def test_cancel_removes_tmp_files(self):
+        tmp_folder = tempfile.mkdtemp()
+        try:
+            task = self.loop.create_task(csp_async.solve_csp_async(
+                csp_file=sample_csp_file_solvable,
+                remove_tmp_files=True,
+                csp_solver_config=dict(csp_solver_config,
+                                       tmp_folder=tmp_folder)
+            ))
+            self.loop.call_later(0.1, task.cancel)
+            try:
+                self.loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                pass
+            self.failUnlessEqual(os.listdir(tmp_folder), [])
+        finally:
+            shutil.rmtree(tmp_folder)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from csp_batch import (
+    BatchStats,
+    do_solve_many
+)
+from csp_solver import (
+    ConfigurationException,
+    SugarWorker,
+    do_solve
+)
+from tests.test_csp_solver import csp_solver_config
+
+
+problems = [
+    ('a', [[1, 2], [1, 2]], 4),
+    ('b', [[1, 2], [1, 2]], 5),
+    ('c', [[-1, 0, 1], [-1, -2, -3], [-1, 0, 1]], -2),
+    ('d', [[1, 2, 3], [1, 2, 3]], 3),
+]
+
+
+class TestDoSolveMany(unittest.TestCase):
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+        self.config = dict(csp_solver_config, tmp_folder=self.tmp_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def check_results(self, workers):
+        stats = BatchStats()
+        results = dict(do_solve_many(
+            iter(problems), self.config, workers=workers, stats=stats))
+        self.failUnlessEqual(sorted(results), ['a', 'b', 'c', 'd'])
+        for problem_id, variables, reference_value in problems:
+            expected = do_solve(
+                variables=variables,
+                reference_value=reference_value,
+                csp_solver_config=csp_solver_config
+            )
+            self.failUnlessEqual(results[problem_id]['satisfiable_bool'],
+                                 expected['satisfiable_bool'])
+        counters = stats.as_dict()
+        self.failUnlessEqual(
+            (counters['submitted'], counters['completed'],
+             counters['queue_depth']), (4, 4, 0))
+        assert counters['jobs_per_second'] > 0, counters
+        # the scratch folder is gone
+        self.failUnlessEqual(os.listdir(self.tmp_folder), [])
+
+    def test_serial(self):
+        self.check_results(workers=1)
+
+    def test_pool(self):
+        self.check_results(workers=2)
+
+    def test_closing_early_removes_workspace(self):
+        solved = do_solve_many(iter(problems), self.config)
+        next(solved)
+        solved.close()
+        self.failUnlessEqual(os.listdir(self.tmp_folder), [])
+
+    def test_sugar_worker_instance_needs_one_process(self):
+        solved = do_solve_many(
+            iter(problems), self.config, workers=2,
+            sugar_worker=SugarWorker(csp_solver_config['sugarjar_path']))
+        self.failUnlessRaises(ConfigurationException, next, solved)
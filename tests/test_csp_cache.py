@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from csp_cache import (
+    ResultCache,
+    get_cache_key
+)
+from csp_solver import (
+    do_solve,
+    weighted_sum_to_csp
+)
+from tests.test_csp_solver import csp_solver_config
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_folder)
+
+    def test_stores_and_counts(self):
+        cache = ResultCache(self.cache_folder)
+        result = {'satisfiable_bool': True, 'solution_list': [1, 2]}
+        assert cache.get('ab' * 20) is None
+        cache.put('ab' * 20, result)
+        self.failUnlessEqual(cache.get('ab' * 20), result)
+        self.failUnlessEqual(
+            ResultCache(self.cache_folder).get('ab' * 20), result)
+        stats = cache.stats()
+        self.failUnlessEqual(
+            (stats['hits'], stats['misses'], stats['stores']), (1, 1, 1))
+
+    def test_key_ignores_whitespace_but_not_content(self):
+        csp_content = weighted_sum_to_csp([[1, 2], [1, 2]], 4)
+        key = get_cache_key(csp_content, csp_solver_config)
+        self.failUnlessEqual(
+            key,
+            get_cache_key(csp_content.replace(' ', '  ') + '\n',
+                          csp_solver_config)
+        )
+        self.failIfEqual(
+            key,
+            get_cache_key(weighted_sum_to_csp([[1, 2], [1, 2]], 3),
+                          csp_solver_config)
+        )
+
+    def test_evicts_least_recently_used(self):
+        cache = ResultCache(self.cache_folder, max_size=200)
+        keys = ['{0:040x}'.format(i) for i in range(5)]
+        for i, key in enumerate(keys):
+            cache.put(key, {'solution_list': list(range(10))})
+            entry_file = cache._get_entry_file(key)
+            os.utime(entry_file, (i, i))
+        # the newest entries survive
+        assert cache.evictions > 0
+        assert cache.get(keys[-1]) is not None
+        assert cache.get(keys[0]) is None
+
+    def test_do_solve_returns_cached_result(self):
+        cache = ResultCache(self.cache_folder)
+        variables, reference_value = [[1, 2], [1, 2]], 4
+        cache_key = get_cache_key(
+            weighted_sum_to_csp(variables, reference_value),
+            csp_solver_config)
+        cache.put(cache_key, {'satisfiable_bool': True,
+                              'solution_list': [2, 2]})
+        result = do_solve(
+            variables=variables,
+            reference_value=reference_value,
+            csp_solver_config=csp_solver_config,
+            cache=cache
+        )
+        assert result['cache_hit'] == True, result
+        assert result['solution_list'] == [2, 2], result
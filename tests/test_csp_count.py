@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import collections
+import itertools
+import random
+import unittest
+
+import csp_count
+from csp_count import (
+    count_solutions,
+    multiply_polynomials,
+    sample_solutions
+)
+
+
+def binomial(n, k):
+    result = 1
+    for i in range(k):
+        result = result * (n - i) // (i + 1)
+    return result
+
+
+class TestCountSolutions(unittest.TestCase):
+    def test_matches_brute_force(self):
+        variables = [[1, 2, 5], [-1, -3], [1, 2, 5], [0, 4, 7, 8], [-1, -3]]
+        sums = collections.Counter(
+            sum(assignment) for assignment in itertools.product(*variables))
+        for reference_value in range(min(sums) - 1, max(sums) + 2):
+            self.failUnlessEqual(count_solutions(variables, reference_value),
+                                 sums[reference_value], reference_value)
+
+    def test_no_variables(self):
+        self.failUnlessEqual(count_solutions([], 0), 1)
+        self.failUnlessEqual(count_solutions([], 1), 0)
+
+    def test_counts_are_exact(self):
+        variables = [[0, 1]] * 300
+        self.failUnlessEqual(count_solutions(variables, 140),
+                             binomial(300, 140))
+        # mirrored
+        self.failUnlessEqual(count_solutions(variables, 290),
+                             binomial(300, 10))
+
+    def test_karatsuba_fallback(self):
+        a = [1, 3, 0, 7]
+        b = [2, 5]
+        expected = [2, 11, 15, 14, 35]
+        self.failUnlessEqual(multiply_polynomials(a, b, 35, 10), expected)
+        self.failUnlessEqual(multiply_polynomials(a, b, 35, 2), expected[:3])
+        decimal_module = csp_count._decimal
+        csp_count._decimal = None
+        try:
+            self.failUnlessEqual(
+                multiply_polynomials(a, b, 35, 10), expected)
+            self.failUnlessEqual(
+                count_solutions([[0, 1]] * 40, 20), binomial(40, 20))
+        finally:
+            csp_count._decimal = decimal_module
+
+
+class TestSampleSolutions(unittest.TestCase):
+    def test_samples_are_solutions(self):
+        variables = [[1, 2, 5], [7], [-1, -3], [1, 2, 5], [0, 9]]
+        rng = random.Random(0)
+        for reference_value in range(0, 25):
+            samples = sample_solutions(variables, reference_value, 5, rng)
+            if not count_solutions(variables, reference_value):
+                self.failUnlessEqual(samples, [])
+                continue
+            self.failUnlessEqual(len(samples), 5)
+            for solution_list in samples:
+                self.failUnlessEqual(sum(solution_list), reference_value)
+                for value, variable in zip(solution_list, variables):
+                    assert value in variable, (value, variable)
+
+    def test_every_solution_is_drawn_about_equally_often(self):
+        variables = [[0, 1, 2], [0, 1, 2], [0, 3], [0, 1, 2]]
+        solutions = set(
+            assignment for assignment in itertools.product(*variables)
+            if sum(assignment) == 4)
+        draws = collections.Counter(
+            tuple(solution_list) for solution_list in sample_solutions(
+                variables, 4, 300 * len(solutions), random.Random(1)))
+        self.failUnlessEqual(set(draws), solutions)
+        assert min(draws.values()) > 200, draws
+
+    def test_seeded_rng_is_reproducible(self):
+        variables = [list(range(10))] * 50
+        self.failUnlessEqual(
+            sample_solutions(variables, 200, 3, random.Random(7)),
+            sample_solutions(variables, 200, 3, random.Random(7)))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import itertools
+import unittest
+
+from csp_dp import (
+    get_dp_table_size,
+    solve_weighted_sum
+)
+from csp_solver import do_solve
+from tests.test_csp_solver import csp_solver_config
+
+
+class TestSolveWeightedSum(unittest.TestCase):
+    def test_not_satisfiable(self):
+        result = solve_weighted_sum([[1,2], [1,2]], 5)
+        assert result['satisfiable_bool'] == False, result
+        assert result['solution_list'] == None, result
+
+    def test_target_inside_range_but_not_reachable(self):
+        result = solve_weighted_sum([[0, 2], [0, 2]], 3)
+        assert result['satisfiable_bool'] == False, result
+
+    def test_is_satisfiable(self):
+        result = solve_weighted_sum([[1,2], [1,2]], 4)
+        assert result['satisfiable_bool'] == True, result
+        assert result['solution_list'] == [2, 2], result
+
+    def test_solutions_are_valid(self):
+        variables = [
+            [1,2], [-1,-2,-3], [1,2,3], [-1,-2,-3], [1,2,3],
+            [-1,-3,-2], [1,2,3], [-1,-2,-3],
+        ]
+        for reference_value in range(-15, 17):
+            expected = any(
+                sum(assignment) == reference_value
+                for assignment in itertools.product(*variables))
+            result = solve_weighted_sum(variables, reference_value)
+            self.failUnlessEqual(result['satisfiable_bool'], expected)
+            if expected:
+                solution_list = result['solution_list']
+                self.failUnlessEqual(sum(solution_list), reference_value)
+                for value, variable in zip(solution_list, variables):
+                    assert value in variable, (value, variable)
+
+    def test_big_problem(self):
+        actors_400 = [[1,2] for i in range(200)]
+        actors_400.extend([[-1,-2,-3] for i in range(200)])
+        result = solve_weighted_sum(actors_400, 0)
+        assert result['satisfiable_bool'] == True
+        assert sum(result['solution_list']) == 0
+
+    def test_returns_none_over_memory_limit(self):
+        variables = [[0, 1000]] * 100
+        assert get_dp_table_size(variables, 50000) > 1024
+        assert solve_weighted_sum(variables, 50000, memory_limit=1024) \
+            is None
+
+
+def test_do_solve_uses_dp_backend():
+    result = do_solve(
+        variables=[[-1, 0, 1], [-1,-2,-3], [-1, 0, 1], [-1,-2,-3]],
+        reference_value=0,
+        csp_solver_config={},
+        backend='dp'
+    )
+    assert result['backend'] == 'dp', result
+    assert result['satisfiable_bool'] == True, result
+    assert sum(result['solution_list']) == 0, result
+
+
+def test_dp_and_sugar_results_have_the_same_keys():
+    for variables, reference_value in (
+            ([[1, 2], [1, 2]], 4),
+            ([[0, 2], [0, 2]], 3)):
+        results = [do_solve(
+            variables=variables,
+            reference_value=reference_value,
+            csp_solver_config=csp_solver_config,
+            backend=backend,
+            encoder='python'
+        ) for backend in ('dp', 'sugar')]
+        assert [result['backend'] for result in results] == \
+            ['dp', 'sugar'], results
+        for key in ('status', 'satisfiable_bool'):
+            assert results[0][key] == results[1][key], (key, results)
+        # dp answers like minisat, UNSATISFIABLE from sugar has None
+        assert results[0]['solution_list'] == \
+            (results[1]['solution_list'] or []), results
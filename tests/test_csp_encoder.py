@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import io
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+from csp_encoder import (
+    encode_csp,
+    iter_csp_expressions,
+    iter_csp_tokens
+)
+from csp_solver import (
+    do_solve,
+    iter_sugar_map,
+    solve_csp,
+    weighted_sum_to_csp
+)
+from tests.test_csp_solver import csp_solver_config
+
+
+class TestParser(unittest.TestCase):
+    def test_tokens_across_chunks_and_comments(self):
+        csp_content = u'; comment (int X 1 2)\n(int LONGNAME 10 200) ; x\n(a)'
+        for chunk_size in (1, 2, 3, 7, 1 << 16):
+            tokens = list(iter_csp_tokens(
+                io.StringIO(csp_content), chunk_size=chunk_size))
+            self.failUnlessEqual(tokens, [
+                '(', 'int', 'LONGNAME', '10', '200', ')', '(', 'a', ')'])
+
+    def test_expressions(self):
+        expressions = list(iter_csp_expressions(io.StringIO(
+            u'(domain D (1 (3 5)))\n(weightedsum ((1 V1) (-2 V2)) le 3)')))
+        self.failUnlessEqual(expressions, [
+            ['domain', 'D', ['1', ['3', '5']]],
+            ['weightedsum', [['1', 'V1'], ['-2', 'V2']], 'le', '3'],
+        ])
+
+
+class TestEncodeCsp(unittest.TestCase):
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def write_csp(self, csp_content):
+        csp_file = os.path.join(self.tmp_folder, 'problem.csp')
+        with open(csp_file, 'w') as csp_fp:
+            csp_fp.write(csp_content)
+        return csp_file
+
+    def solve(self, csp_content):
+        _, result = solve_csp(
+            csp_file=self.write_csp(csp_content),
+            unique_repr='problem',
+            remove_tmp_files=True,
+            encoder='python',
+            csp_solver_config=csp_solver_config
+        )
+        return result
+
+    def test_map_file_is_sugar_format(self):
+        cnf_file = os.path.join(self.tmp_folder, 'problem.cnf')
+        map_file = os.path.join(self.tmp_folder, 'problem.map')
+        sugar_output = encode_csp(
+            self.write_csp('(domain D (1 2 3 7))\n(int V1 D)\n(int V2 0 2)'
+                           '\n(weightedsum ((1 V1) (1 V2)) ge 0)'),
+            cnf_file, map_file)
+        self.failUnlessEqual(sugar_output, '')
+        self.failUnlessEqual(list(iter_sugar_map(map_file)), [
+            ('V1', 1, [(1, 3), (7, 7)]),
+            ('V2', 4, [(0, 2)]),
+        ])
+        with open(cnf_file) as cnf_fp:
+            header = cnf_fp.readline().split()
+        self.failUnlessEqual(header[:2], ['p', 'cnf'])
+
+    def test_unsatisfiable_while_encoding(self):
+        cnf_file = os.path.join(self.tmp_folder, 'problem.cnf')
+        sugar_output = encode_csp(
+            self.write_csp(weighted_sum_to_csp([[1, 2], [1, 2]], 5)),
+            cnf_file, os.path.join(self.tmp_folder, 'problem.map'))
+        self.failUnlessEqual(sugar_output, 's UNSATISFIABLE\n')
+        assert not os.path.exists(cnf_file)
+
+    def test_do_solve_matches_brute_force(self):
+        variables = [[1, 2], [-1, -2, -3], [0, 2, 5], [-1, 3]]
+        for reference_value in range(-8, 13):
+            expected = any(
+                sum(assignment) == reference_value
+                for assignment in itertools.product(*variables))
+            result = do_solve(
+                variables=variables,
+                reference_value=reference_value,
+                encoder='python',
+                csp_solver_config=csp_solver_config
+            )
+            self.failUnlessEqual(result['satisfiable_bool'], expected)
+            if expected:
+                solution_list = result['solution_list']
+                self.failUnlessEqual(sum(solution_list), reference_value)
+                for value, variable in zip(solution_list, variables):
+                    assert value in variable, (value, variable)
+
+    def test_coefficients_and_relations(self):
+        declarations = '(int X 0 4)\n(int Y (-2 1 3))\n'
+        for relation, bound in itertools.product(
+                ('eq', 'le', 'ge', 'lt', 'gt'), range(-12, 16, 3)):
+            holds = {
+                'eq': lambda total: total == bound,
+                'le': lambda total: total <= bound,
+                'ge': lambda total: total >= bound,
+                'lt': lambda total: total < bound,
+                'gt': lambda total: total > bound,
+            }[relation]
+            expected = any(
+                holds(3 * x - 2 * y)
+                for x, y in itertools.product(range(5), (-2, 1, 3)))
+            result = self.solve(
+                declarations + '(weightedsum ((3 X) (-2 Y)) {0} {1})'.format(
+                    relation, bound))
+            self.failUnlessEqual(result['satisfiable_bool'], expected,
+                                 (relation, bound))
+            if expected:
+                x, y = result['solution_list']
+                assert holds(3 * x - 2 * y), (relation, bound, x, y)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import csp_encoder
+from csp_plan import (
+    CnfSizeModel,
+    PlanRefused,
+    cnf_size_models,
+    count_pairs_up_to,
+    plan_weighted_sum
+)
+from csp_solver import do_solve, iter_weighted_sum_csp
+from tests.test_csp_solver import csp_solver_config
+
+
+class TestCnfSizeModel(unittest.TestCase):
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def encode(self, variables, reference_value):
+        csp_file, cnf_file, map_file = [
+            os.path.join(self.tmp_folder, 'a' + suffix)
+            for suffix in ('.csp', '.cnf', '.map')]
+        with open(csp_file, 'w') as csp_fp:
+            for csp_piece in iter_weighted_sum_csp(variables,
+                                                   reference_value):
+                csp_fp.write(csp_piece)
+        self.failUnlessEqual(
+            csp_encoder.encode_csp(csp_file, cnf_file, map_file), '')
+        with open(cnf_file) as cnf_fp:
+            _, _, variable_count, clause_count = cnf_fp.readline().split()
+        return dict(
+            cnf_variable_count=int(variable_count),
+            cnf_clause_count=int(clause_count),
+            cnf_file_size=os.path.getsize(cnf_file),
+            map_file_size=os.path.getsize(map_file))
+
+    def test_count_pairs(self):
+        for t in range(-2, 12):
+            self.failUnlessEqual(
+                count_pairs_up_to(t, 3, 5),
+                len([(i, j) for i in range(4) for j in range(6)
+                     if i + j <= t]))
+
+    def test_estimate_is_close_to_the_encoder(self):
+        for variables, reference_value in (
+                ([list(range(15))] * 20, 140),
+                ([[0, 1, 2]] * 100, 100),
+                ([[1, 5, 6], [-3, 2, 8, 9], [0, 4]] * 10, 100)):
+            encoded = self.encode(variables, reference_value)
+            estimate = CnfSizeModel().get_raw_estimate(
+                variables, reference_value)
+            for key, value in encoded.items():
+                assert 0.6 * value <= estimate[key] <= 1.5 * value, \
+                    (key, value, estimate[key])
+
+    def test_calibrate(self):
+        variables, reference_value = [list(range(15))] * 20, 140
+        encoded = self.encode(variables, reference_value)
+        result = dict(
+            satisfiable_bool=True,
+            cnf_file_size=2 * encoded['cnf_file_size'],
+            map_file_size=encoded['map_file_size'])
+        model = CnfSizeModel().calibrate([
+            (variables, reference_value, result),
+            (variables, reference_value, {'satisfiable_bool': False})])
+        assert 1.8 < model.cnf_factor < 2.2, model.cnf_factor
+        assert 0.9 < model.map_factor < 1.1, model.map_factor
+        self.failUnless(
+            model.estimate(variables, reference_value)
+            ['estimated_minisat_memory'] >
+            CnfSizeModel().estimate(variables, reference_value)
+            ['estimated_minisat_memory'])
+
+    def test_calibrate_adds_up(self):
+        observations = [
+            ([list(range(15))] * 20, 140, dict(
+                cnf_file_size=3000000, map_file_size=1000)),
+            ([[0, 1, 2]] * 100, 100, dict(
+                cnf_file_size=10000, map_file_size=3000))]
+        model = CnfSizeModel()
+        for observation in observations:
+            model.calibrate([observation])
+        expected = CnfSizeModel().calibrate(observations)
+        self.failUnlessEqual(
+            (model.cnf_factor, model.map_factor),
+            (expected.cnf_factor, expected.map_factor))
+
+
+class TestPlan(unittest.TestCase):
+    variables = [list(range(15))] * 20
+    reference_value = 140
+
+    def test_small_problems_use_dp(self):
+        plan = plan_weighted_sum(self.variables, self.reference_value)
+        self.failUnlessEqual(plan['backend'], 'dp')
+
+    def test_sugar_if_dp_table_too_big(self):
+        plan = plan_weighted_sum(self.variables, self.reference_value,
+                                 tmp_folder=tempfile.gettempdir(),
+                                 dp_memory_limit=1)
+        self.failUnlessEqual(plan['backend'], 'sugar')
+        assert plan['estimated_cnf_file_size'] > 0, plan
+
+    def test_refuses_early(self):
+        try:
+            plan_weighted_sum(self.variables, self.reference_value,
+                              dp_memory_limit=1, memory_limit=1024)
+        except PlanRefused as exc:
+            self.failUnlessEqual(exc.limit, 'memory')
+            assert 'minisat needs about' in str(exc), str(exc)
+        else:
+            self.fail("expected PlanRefused")
+
+        try:
+            plan_weighted_sum(self.variables, self.reference_value,
+                              tmp_folder=tempfile.gettempdir(),
+                              dp_memory_limit=1, memory_limit=1 << 62,
+                              model=CnfSizeModel(map_factor=1e12))
+        except PlanRefused as exc:
+            self.failUnlessEqual(exc.limit, 'disk')
+        else:
+            self.fail("expected PlanRefused")
+
+    def test_do_solve_auto(self):
+        variables, reference_value = [[1, 2, 3]] * 4, 7
+        result = do_solve(variables, reference_value,
+                          csp_solver_config, backend='auto')
+        self.failUnlessEqual(
+            (result['backend'], result['satisfiable_bool']), ('dp', True))
+
+        result = do_solve(variables, reference_value,
+                          csp_solver_config, backend='auto',
+                          dp_memory_limit=1, encoder='python')
+        self.failUnlessEqual(
+            (result['backend'], result['satisfiable_bool']),
+            ('sugar', True))
+        assert 'estimated_minisat_memory' in result, result
+        self.failUnlessEqual(sum(result['solution_list']), reference_value)
+
+        self.failUnlessRaises(
+            PlanRefused, do_solve, variables, reference_value,
+            csp_solver_config, backend='auto', dp_memory_limit=1,
+            memory_limit=1024)
+
+    def test_do_solve_auto_calibrates(self):
+        variables, reference_value = [[1, 2, 3]] * 4, 7
+        python_model = cnf_size_models['python']
+        cnf_size_models['python'] = CnfSizeModel(cnf_factor=5.0)
+        try:
+            result = do_solve(variables, reference_value,
+                              csp_solver_config, backend='auto',
+                              dp_memory_limit=1, encoder='python')
+            model = cnf_size_models['python']
+        finally:
+            cnf_size_models['python'] = python_model
+        raw = model.get_raw_estimate(variables, reference_value)
+        self.failUnlessEqual(
+            model.cnf_factor,
+            result['cnf_file_size'] / float(raw['cnf_file_size']))
+        self.failUnlessEqual(
+            model.map_factor,
+            result['map_file_size'] / float(raw['map_file_size']))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import itertools
+import unittest
+
+from csp_presolve import (
+    expand_solution,
+    presolve_weighted_sum
+)
+from csp_solver import do_solve
+from tests.test_csp_solver import csp_solver_config
+
+
+class TestPresolveWeightedSum(unittest.TestCase):
+    def test_reference_value_out_of_bounds(self):
+        for reference_value in (1, 7):
+            presolved = presolve_weighted_sum([[1, 2], [1, 2]],
+                                              reference_value)
+            self.failUnlessEqual(presolved['status'], 'UNSATISFIABLE')
+
+    def test_bounds_fix_all_variables(self):
+        presolved = presolve_weighted_sum([[1, 2, 6], [0, 3], [1, 5]], 14)
+        self.failUnlessEqual(presolved['status'], 'SATISFIABLE')
+        self.failUnlessEqual(presolved['solution_list'], [6, 3, 5])
+        self.failUnlessEqual(presolved['fixed_count'], 3)
+
+    def test_ranges_are_solved_without_solver(self):
+        presolved = presolve_weighted_sum([[1, 2, 3], [-3, -2, -1], [5]], 6)
+        self.failUnlessEqual(presolved['status'], 'SATISFIABLE')
+        self.failUnlessEqual(sum(presolved['solution_list']), 6)
+
+    def test_reduced_problem(self):
+        presolved = presolve_weighted_sum(
+            [[0, 2, 4], [10], [0, 2, 4], [0, 20]], 14)
+        self.failUnlessEqual(presolved['status'], 'REDUCED')
+        self.failUnlessEqual(presolved['variables'], [[0, 2, 4], [0, 2, 4]])
+        self.failUnlessEqual(presolved['free_indexes'], [0, 2])
+        self.failUnlessEqual(presolved['reference_value'], 4)
+        self.failUnlessEqual(presolved['removed_value_count'], 1)
+        self.failUnlessEqual(presolved['fixed_count'], 2)
+        self.failUnlessEqual(expand_solution(presolved, [4, 0]),
+                             [4, 10, 0, 0])
+        self.failUnlessEqual(expand_solution(presolved, None), None)
+
+
+class TestDoSolvePresolve(unittest.TestCase):
+    def check_against_brute_force(self, variables, **kwargs):
+        sums = set(sum(assignment)
+                   for assignment in itertools.product(*variables))
+        for reference_value in range(min(sums) - 1, max(sums) + 2):
+            result = do_solve(
+                variables=variables,
+                reference_value=reference_value,
+                presolve=True,
+                csp_solver_config=csp_solver_config,
+                **kwargs
+            )
+            self.failUnlessEqual(result['satisfiable_bool'],
+                                 reference_value in sums, reference_value)
+            if result['satisfiable_bool']:
+                solution_list = result['solution_list']
+                self.failUnlessEqual(sum(solution_list), reference_value)
+                for value, variable in zip(solution_list, variables):
+                    assert value in variable, (value, variable)
+
+    def test_dp_backend(self):
+        self.check_against_brute_force(
+            [[0, 2, 9], [0, 4], [1, 10], [-3, -1, 5], [7]], backend='dp')
+
+    def test_sugar_backend(self):
+        self.check_against_brute_force([[0, 2, 9], [0, 4], [1, 10]])
+
+    def test_trivial_problems_skip_the_solver(self):
+        result = do_solve(
+            variables=[[1, 2], [1, 2]],
+            reference_value=5,
+            presolve=True,
+            csp_solver_config=csp_solver_config
+        )
+        self.failUnlessEqual(
+            (result['backend'], result['status']),
+            ('presolve', 'UNSATISFIABLE'))
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import ctypes.util
+import os
+import shutil
+import tempfile
+import unittest
+
+from csp_sat import (
+    LibrarySatSolver,
+    SubprocessSatSolver,
+    load_sat_library
+)
+from csp_solver import (
+    ConfigurationException,
+    do_optimize,
+    do_solve,
+    do_solve_sweep,
+    get_unique_repr,
+    get_valid_csp_solver_config,
+    iter_weighted_sum_solutions,
+    solve_csp
+)
+from tests.test_csp_solver import (
+    csp_solver_config,
+    sample_csp_file_not_solvable,
+    sample_csp_file_solvable,
+    sugarjar_path
+)
+
+
+sat_library_path = os.environ.get('CSP_SOLVER_SAT_LIBRARY') or \
+    ctypes.util.find_library('ipasir')
+
+skip_without_library = unittest.skipIf(
+    not sat_library_path,
+    "needs an IPASIR library in CSP_SOLVER_SAT_LIBRARY")
+
+
+def write_cnf(cnf_file, variable_count, clauses):
+    with open(cnf_file, 'w') as cnf_fp:
+        cnf_fp.write('p cnf {0} {1}\n'.format(variable_count, len(clauses)))
+        for clause in clauses:
+            cnf_fp.write(' '.join(map(str, clause + [0])) + '\n')
+
+
+# x1 or x2, not x1 or x3, not x2 or not x3
+clauses = [[1, 2], [-1, 3], [-2, -3]]
+
+
+class TestSubprocessSatSolver(unittest.TestCase):
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+        self.cnf_file, self.out_file, self.target_cnf_file = [
+            os.path.join(self.tmp_folder, name)
+            for name in ('a.cnf', 'a.out', 'a.target.cnf')]
+        write_cnf(self.cnf_file, 3, clauses)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def test_clauses_and_assumptions(self):
+        sat_solver = SubprocessSatSolver(
+            csp_solver_config['minisat_path'], self.cnf_file,
+            self.out_file, self.target_cnf_file)
+        self.failUnlessEqual(sat_solver.solve([1]), True)
+        model = sat_solver.get_model()
+        self.failUnlessEqual(
+            [bool(model[0] & (1 << variable)) for variable in (1, 2, 3)],
+            [True, False, True])
+        sat_solver.add_clause([-3])
+        self.failUnlessEqual(sat_solver.solve([1]), False)
+        self.failUnlessEqual(sat_solver.solve(), True)
+
+
+class TestLibraryConfiguration(unittest.TestCase):
+    def test_missing_library(self):
+        self.failUnlessRaises(
+            ConfigurationException, get_valid_csp_solver_config,
+            sugarjar_path=sugarjar_path,
+            sat_library_path='/does/not/exist/libipasir.so')
+
+    def test_not_an_ipasir_library(self):
+        libc = ctypes.util.find_library('c')
+        if libc is None:
+            self.skipTest("no C library found")
+        self.failUnlessRaises(ConfigurationException, load_sat_library, libc)
+
+
+@skip_without_library
+class TestLibrarySatSolver(unittest.TestCase):
+    def test_incremental_solving(self):
+        with LibrarySatSolver(load_sat_library(sat_library_path)) as solver:
+            for clause in clauses:
+                solver.add_clause(clause)
+            self.failUnlessEqual(solver.clause_count, 3)
+            self.failUnlessEqual(solver.solve([1]), True)
+            model = solver.get_model()
+            self.failUnlessEqual(
+                [bool(model[0] & (1 << variable)) for variable in (1, 2, 3)],
+                [True, False, True])
+            self.failUnlessEqual(solver.solve([1, 2]), False)
+            assert solver.failed(2) or solver.failed(1)
+            # assumptions only hold for one call
+            self.failUnlessEqual(solver.solve(), True)
+            solver.add_clause([-3])
+            self.failUnlessEqual(solver.solve(), True)
+            self.failUnlessEqual(solver.get_model()[0] & 0b1110, 0b0100)
+            solver.add_clause([-2])
+            self.failUnlessEqual(solver.solve(), False)
+
+
+@skip_without_library
+class TestLibraryBackend(unittest.TestCase):
+    def setUp(self):
+        self.config = get_valid_csp_solver_config(
+            sugarjar_path=sugarjar_path,
+            sat_library_path=sat_library_path)
+
+    def test_solve_csp(self):
+        for encoder in ('sugar', 'python'):
+            for csp_file, satisfiable_bool in (
+                    (sample_csp_file_solvable, True),
+                    (sample_csp_file_not_solvable, False)):
+                results = [solve_csp(
+                    csp_file=csp_file,
+                    unique_repr=get_unique_repr(sat_backend),
+                    remove_tmp_files=True,
+                    encoder=encoder,
+                    sat_backend=sat_backend,
+                    csp_solver_config=self.config
+                )[1] for sat_backend in ('subprocess', 'library')]
+                self.failUnlessEqual(
+                    [result['satisfiable_bool'] for result in results],
+                    [satisfiable_bool, satisfiable_bool])
+
+    def test_python_encoder_writes_no_cnf(self):
+        result = do_solve(
+            variables=[[1, 2, 3], [1, 2, 3], [-1, 5]],
+            reference_value=9,
+            encoder='python',
+            sat_backend='library',
+            csp_solver_config=self.config
+        )
+        self.failUnlessEqual(result['satisfiable_bool'], True)
+        self.failUnlessEqual(sum(result['solution_list']), 9)
+        assert 'cnf_file_size' not in result, result
+        assert result['cnf_clause_count'] > 0, result
+
+    def test_sweep(self):
+        variables = [[1, 2, 5], [0, 3], [2, 4]]
+        sweeps = [do_solve_sweep(
+            variables, list(range(2, 13)), self.config,
+            sat_backend=sat_backend
+        ) for sat_backend in ('subprocess', 'library')]
+        self.failUnlessEqual(
+            *[[result['satisfiable_bool'] for result in sweep['results']]
+              for sweep in sweeps])
+
+    def test_enumerate(self):
+        solutions = list(iter_weighted_sum_solutions(
+            [[1, 2, 3], [1, 2, 3]], 4, self.config, sat_backend='library'))
+        self.failUnlessEqual(
+            sorted(solution['solution_list'] for solution in solutions),
+            [[1, 3], [2, 2], [3, 1]])
+
+    def test_optimize(self):
+        results = [do_optimize(
+            [[1, 2, 3], [1, 2, 3], [0, 4]], [1, -2, 3], self.config,
+            reference_value=6, sat_backend=sat_backend
+        ) for sat_backend in ('subprocess', 'library')]
+        self.failUnlessEqual(
+            *[(result['status'], result['objective_value'])
+              for result in results])
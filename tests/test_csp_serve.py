@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from csp_serve import (
+    QueueFullException,
+    ServiceException,
+    SolveClient,
+    SolveServer,
+    SolveService,
+    get_percentile
+)
+from csp_solver import do_solve
+from tests.test_csp_solver import csp_solver_config
+
+
+class TestSolveService(unittest.TestCase):
+    def setUp(self):
+        self.service = SolveService(csp_solver_config, workers=1,
+                                    max_queue=3)
+
+    def tearDown(self):
+        self.service.close()
+
+    def test_higher_priority_first(self):
+        jobs = [self.service.submit(
+            dict(variables=[[1, 2], [1, 2]], reference_value=value),
+            priority=priority)
+            for value, priority in ((2, 0), (3, 5), (4, 1))]
+        self.service.start()
+        for job in jobs:
+            job.done.wait()
+        self.failUnlessEqual(
+            [job.kwargs['reference_value'] for job in
+             sorted(jobs, key=lambda job: job.finished)],
+            [3, 4, 2])
+        self.failUnlessEqual(
+            [job.result['satisfiable_bool'] for job in jobs],
+            [True, True, True])
+
+        stats = self.service.stats()
+        self.failUnlessEqual(
+            (stats['completed'], stats['queue_depth'], stats['in_flight']),
+            (3, 0, 0))
+        assert stats['latency_p50'] <= stats['latency_p99'], stats
+        assert stats['throughput'] > 0, stats
+
+    def test_full_queue_rejects(self):
+        kwargs = dict(variables=[[1, 2]], reference_value=1)
+        for _ in range(3):
+            self.service.submit(kwargs)
+        self.failUnlessRaises(
+            QueueFullException, self.service.submit, kwargs)
+        self.failUnlessEqual(self.service.stats()['rejected'], 1)
+
+    def test_unsupported_arguments(self):
+        self.failUnlessRaises(
+            ServiceException, self.service.submit,
+            dict(variables=[[1]], reference_value=1, tmp_folder='/'))
+
+    def test_percentile(self):
+        self.failUnlessEqual(get_percentile([], 50), None)
+        self.failUnlessEqual(
+            [get_percentile(list(range(11)), percentile)
+             for percentile in (0, 50, 90, 100)], [0, 5, 9, 10])
+
+
+class TestSolveServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_folder, 'csp.sock')
+        self.service = SolveService(csp_solver_config, workers=2)
+        self.service.start()
+        self.server = SolveServer(self.socket_path, self.service)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.service.close()
+        shutil.rmtree(self.tmp_folder)
+
+    def test_client_matches_do_solve(self):
+        with SolveClient(self.socket_path) as client:
+            for variables, reference_value in (
+                    ([[1, 2], [1, 2]], 4),
+                    ([[1, 2], [1, 2]], 5),
+                    ([[-1, 0, 1], [-1, -2, -3], [-1, 0, 1]], -2)):
+                result = client.do_solve(
+                    variables=variables,
+                    reference_value=reference_value,
+                    csp_solver_config=csp_solver_config,
+                    encoder='python')
+                expected = do_solve(
+                    variables=variables,
+                    reference_value=reference_value,
+                    csp_solver_config=csp_solver_config,
+                    encoder='python')
+                self.failUnlessEqual(
+                    (result['satisfiable_bool'], result['status']),
+                    (expected['satisfiable_bool'], expected['status']))
+            stats = client.stats()
+        self.failUnlessEqual(stats['completed'], 3)
+        self.failUnlessEqual(stats['workers'], 2)
+
+    def test_errors_are_raised_by_the_client(self):
+        with SolveClient(self.socket_path) as client:
+            self.failUnlessRaises(
+                ServiceException, client.do_solve, [[1]], 1, backend='x')
+            self.failUnlessRaises(
+                ServiceException, client.do_solve, [[1]], 1, quiet=False)
+            # the connection is still usable
+            self.failUnlessEqual(
+                client.do_solve([[1]], 1, backend='dp')['satisfiable_bool'],
+                True)
+
+    def test_running_server_is_not_replaced(self):
+        self.failUnlessRaises(
+            ServiceException, SolveServer, self.socket_path, self.service)
+        with SolveClient(self.socket_path) as client:
+            self.failUnlessEqual(client.stats()['workers'], 2)
+
+    def test_stale_socket_is_replaced(self):
+        socket_path = os.path.join(self.tmp_folder, 'stale.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(socket_path)
+        stale.close()
+        server = SolveServer(socket_path, self.service)
+        server.server_close()
+        self.failIf(os.path.exists(socket_path))
+
+    def test_other_files_are_not_removed(self):
+        file_name = os.path.join(self.tmp_folder, 'results.json')
+        with open(file_name, 'w') as fp:
+            fp.write('{}')
+        self.failUnlessRaises(
+            ServiceException, SolveServer, file_name, self.service)
+        with open(file_name) as fp:
+            self.failUnlessEqual(fp.read(), '{}')
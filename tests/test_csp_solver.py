@@ -9,6 +9,12 @@ def test_csp_solver_is_installed():
 
 import os
 import argparse
+import itertools
+import json
+import shutil
+import sys
+import tempfile
+import time
 
 from csp_solver import (
     do_solve,
@@ -16,7 +22,24 @@ from csp_solver import (
     weighted_sum_to_csp,
     get_valid_csp_solver_config,
     solve_csp,
-    main
+    main,
+    SugarWorker,
+    iter_decoded_solution,
+    read_minisat_model,
+    write_weighted_sum_csp,
+    get_minisat_portfolio,
+    race_sat_solvers,
+    decode_order_encoding,
+    get_order_encoding_units,
+    do_solve_sweep,
+    iter_weighted_sum_solutions,
+    write_cnf_with_clauses,
+    get_order_encoding_bound_units,
+    do_optimize,
+    iter_stream_results,
+    start_sat_solver,
+    wait_for_minisat,
+    LimitReached
 )
 
 
@@ -173,8 +196,22 @@ class TestCli(unittest.TestCase):
                 sample_csp_file_solvable
             ],
             keep_tmpfiles=True,
+            stream=False,
             minisat=None,
+            sugar_worker=False,
+            decoder='python',
+            encoder='sugar',
+            sat_backend='subprocess',
+            jobs=1,
+            cache_folder=None,
+            cnf_stream=False,
+            timeout=None,
+            memory_limit=None,
+            portfolio=None,
+            portfolio_size=None,
+            trace_file=None,
             sugar_jar='sugar-v1-15-0.jar',
+            sat_library=None,
             tmp_folder='r',
         )
         assert parsed_args == expected_result, parsed_args
@@ -195,6 +232,130 @@ class TestCli(unittest.TestCase):
             ).split()
         )
 
+    def test_parser_rejects_non_positive_jobs(self):
+        parser = get_parser()
+        self.failUnlessRaises(
+            SystemExit,
+            parser.parse_args,
+            '-c {0} --sugar-jar {1} --jobs 0'.format(
+                sample_csp_file_solvable,
+                sugarjar_path
+            ).split()
+        )
+
+    def test_cli_solves_files_in_parallel(self):
+        tmp_folder = tempfile.mkdtemp()
+        output_file = os.path.join(tmp_folder, 'output.txt')
+        stdout = sys.stdout
+        try:
+            with open(output_file, 'w') as sys.stdout:
+                main(
+                    '-c {0} -c {1} -c {0} --jobs 3 --sugar-jar {2}'.format(
+                        sample_csp_file_solvable,
+                        sample_csp_file_not_solvable,
+                        sugarjar_path
+                    ).split()
+                )
+            sys.stdout = stdout
+            with open(output_file) as output_fp:
+                lines = output_fp.read().splitlines()
+        finally:
+            sys.stdout = stdout
+            shutil.rmtree(tmp_folder)
+
+        # every '>>> Processed <file>' is followed by its answer
+        answers = sorted(
+            (lines[i].split()[-1], lines[i + 1].split()[0])
+            for i, line in enumerate(lines)
+            if line.startswith('>>> Processed'))
+        self.failUnlessEqual(answers, sorted([
+            (sample_csp_file_solvable, 'SATISFIABLE'),
+            (sample_csp_file_not_solvable, 'UNSATISFIABLE!'),
+            (sample_csp_file_solvable, 'SATISFIABLE'),
+        ]))
+        assert 'Solved 3 csp files with 3 jobs' in lines[-1], lines[-1]
+
+    def test_cli_needs_csp_files_or_stream(self):
+        self.failUnlessRaises(
+            SystemExit, main, '--sugar-jar {0}'.format(sugarjar_path).split())
+        self.failUnlessRaises(
+            SystemExit, main, '-c {0} --stream --sugar-jar {1}'.format(
+                sample_csp_file_solvable, sugarjar_path).split())
+
+
+class TestStream(unittest.TestCase):
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+        with open(sample_csp_file_solvable) as csp_fp:
+            csp = csp_fp.read()
+        self.input_file = os.path.join(self.tmp_folder, 'input.jsonl')
+        with open(self.input_file, 'w') as input_fp:
+            for record in [
+                    {'variables': [[1, 2], [1, 2]], 'reference_value': 4},
+                    {'id': 'b', 'variables': [[1, 2], [1, 2]],
+                     'reference_value': 5},
+                    {'id': 'csp', 'csp': csp},
+                    {'reference_value': 5}]:
+                input_fp.write(json.dumps(record) + '\n\n')
+            input_fp.write('not json\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def check_results(self, results):
+        results = dict((result.pop('id'), result) for result in results)
+        self.failUnlessEqual(sorted(results, key=str),
+                             [1, 7, 9, 'b', 'csp'])
+        self.failUnlessEqual(
+            [results[record_id]['status']
+             for record_id in (1, 'b', 'csp', 7, 9)],
+            ['SATISFIABLE', 'UNSATISFIABLE', 'SATISFIABLE', 'ERROR',
+             'ERROR'])
+        self.failUnlessEqual(results[1]['solution_list'], [2, 2])
+
+    def test_iter_stream_results(self):
+        for jobs in (1, 2):
+            with open(self.input_file) as input_fp:
+                self.check_results(list(iter_stream_results(
+                    input_fp, dict(csp_solver_config,
+                                   tmp_folder=self.tmp_folder),
+                    jobs=jobs)))
+        self.failUnlessEqual(os.listdir(self.tmp_folder), ['input.jsonl'])
+
+    def test_failed_records_leave_no_files(self):
+        config = dict(csp_solver_config, tmp_folder=self.tmp_folder)
+        input_file = os.path.join(self.tmp_folder, 'invalid.jsonl')
+        with open(input_file, 'w') as input_fp:
+            input_fp.write(
+                '{"variables": "abc", "reference_value": 3}\n'
+                '{"variables": [[1, 2]], "reference_value": 1.5}\n'
+                '{"variables": [[1, true]], "reference_value": 1}\n')
+        with open(input_file) as input_fp:
+            results = list(iter_stream_results(input_fp, config))
+        self.failUnlessEqual([result['status'] for result in results],
+                             ['ERROR'] * 3)
+        assert 'ValueError' in results[0]['error'], results[0]
+
+        # fails after the csp file is written
+        self.failUnlessRaises(
+            Exception, do_solve, [[1, 2], [1, 2]], 3, config,
+            portfolio=[['sh', '-c', 'echo "PARSE ERROR"; exit 3']])
+        self.failUnlessEqual(sorted(os.listdir(self.tmp_folder)),
+                             ['input.jsonl', 'invalid.jsonl'])
+
+    def test_cli_writes_json_lines(self):
+        output_file = os.path.join(self.tmp_folder, 'output.jsonl')
+        stdin, stdout = sys.stdin, sys.stdout
+        try:
+            with open(self.input_file) as sys.stdin:
+                with open(output_file, 'w') as sys.stdout:
+                    main('--stream -t {0} --sugar-jar {1}'.format(
+                        self.tmp_folder, sugarjar_path).split())
+        finally:
+            sys.stdin, sys.stdout = stdin, stdout
+        with open(output_file) as output_fp:
+            self.check_results([json.loads(line) for line in output_fp])
+
 
 def test_weighed_sum_problem_gets_converted_to_csp():
     for args, expected_result in [
@@ -216,6 +377,18 @@ def test_weighed_sum_problem_gets_converted_to_csp():
             )
 
 
+def test_streamed_csp_equals_csp_string():
+    variables = [[1,2,3], [1,2,3], [-4,-5]] * 50 + [[7]]
+    csp_file = tempfile.NamedTemporaryFile(mode='w+', delete=False)
+    try:
+        with csp_file as csp_fp:
+            write_weighted_sum_csp(variables, 5, csp_fp)
+        with open(csp_file.name) as csp_fp:
+            assert csp_fp.read() == weighted_sum_to_csp(variables, 5)
+    finally:
+        os.remove(csp_file.name)
+
+
 class TestSolveCsp(unittest.TestCase):
     def test_passes_and_returns_solvable(self):
         result = solve_csp(
@@ -232,9 +405,11 @@ class TestSolveCsp(unittest.TestCase):
                 'minisat_cpu_time',
                 'csp_to_cnf_time',
                 'minisat_time',
+                'decode_time',
                 'map_file_size',
                 'solution_list',
                 'satisfiable_bool',
+                'status',
                 'cnf_file_size'
             ])
         )
@@ -259,7 +434,8 @@ class TestSolveCsp(unittest.TestCase):
             set([
                 'csp_to_cnf_time',
                 'solution_list',
-                'satisfiable_bool'
+                'satisfiable_bool',
+                'status'
             ])
         )
         self.failUnlessEqual(
@@ -267,9 +443,457 @@ class TestSolveCsp(unittest.TestCase):
             False
         )
 
+    def test_timeout_returns_unknown(self):
+        tmp_folder = tempfile.mkdtemp()
+        try:
+            solve_csp_time, result = solve_csp(
+                csp_file=sample_csp_file_solvable,
+                remove_tmp_files=True,
+                csp_solver_config=dict(csp_solver_config,
+                                       tmp_folder=tmp_folder),
+                timeout=1e-9
+            )
+            self.failUnlessEqual(result['status'], 'UNKNOWN')
+            self.failUnlessEqual(result['satisfiable_bool'], None)
+            self.failUnlessEqual(result['limit_reached'], 'timeout')
+            assert 'csp_to_cnf_time' in result, result
+            self.failUnlessEqual(os.listdir(tmp_folder), [])
+        finally:
+            shutil.rmtree(tmp_folder)
+
+    def test_portfolio_reports_winner(self):
+        portfolio = get_minisat_portfolio(
+            csp_solver_config['minisat_path'], 3)
+        solve_csp_time, result = solve_csp(
+            csp_file=sample_csp_file_solvable,
+            remove_tmp_files=True,
+            csp_solver_config=csp_solver_config,
+            portfolio=portfolio
+        )
+        self.failUnlessEqual(result['satisfiable_bool'], True)
+        assert result['portfolio_winner'] in [
+            ' '.join(solver_cmd) for solver_cmd in portfolio], result
+
     # TODO: include test where minisat returns unsatisfiable
 
 
+def test_order_encoding_units_fix_value():
+    domain_ranges = [(-5, -4), (2, 2), (5, 6)]
+    values = [-5, -4, 2, 5, 6]
+    for value in values:
+        model = bytearray(4)
+        for literal in get_order_encoding_units(3, domain_ranges, value):
+            if literal > 0:
+                model[literal >> 3] |= 1 << (literal & 7)
+        assert decode_order_encoding(model, 3, domain_ranges) == value
+    assert get_order_encoding_units(3, domain_ranges, 3) is None
+    assert get_order_encoding_units(3, domain_ranges, 7) is None
+
+
+def test_sweep_equals_do_solve():
+    variables = [[-1, 0, 1], [-1,-2,-3], [-1, 0, 1], [-1,-2,-3]]
+    reference_values = list(range(-10, 4))
+    sweep_result = do_solve_sweep(
+        variables=variables,
+        reference_values=reference_values,
+        csp_solver_config=csp_solver_config
+    )
+    assert [result['reference_value'] for result
+            in sweep_result['results']] == reference_values
+    for result in sweep_result['results']:
+        expected = do_solve(
+            variables=variables,
+            reference_value=result['reference_value'],
+            csp_solver_config=csp_solver_config
+        )
+        assert result['satisfiable_bool'] == \
+            expected['satisfiable_bool'], result
+        if result['satisfiable_bool']:
+            assert sum(result['solution_list']) == \
+                result['reference_value'], result
+
+
+def test_order_encoding_bound_units():
+    domain_ranges = [(-5, -4), (2, 2), (5, 6)]
+    values = [-5, -4, 2, 5, 6]
+    for bound in range(-7, 9):
+        for upper in (True, False):
+            units = get_order_encoding_bound_units(
+                3, domain_ranges, bound, upper)
+            allowed = [value for value in values
+                       if (value <= bound if upper else value >= bound)]
+            if not allowed:
+                assert units is None, (bound, upper, units)
+                continue
+            # literal 3 + i is x <= values[i]
+            decoded = set(
+                value for value in values
+                if all((value <= values[abs(literal) - 3]) == (literal > 0)
+                       for literal in units))
+            assert decoded == set(allowed), (bound, upper, units)
+
+
+def test_write_cnf_with_clauses_updates_header():
+    tmp_folder = tempfile.mkdtemp()
+    try:
+        cnf_file = os.path.join(tmp_folder, 'problem.cnf')
+        target_file = os.path.join(tmp_folder, 'target.cnf')
+        with open(cnf_file, 'w') as cnf_fp:
+            cnf_fp.write("p cnf 3 2          \n1 -2 0\n2 3 0\n")
+        write_cnf_with_clauses(cnf_file, [[-1], [2, -3]], target_file)
+        with open(target_file) as target_fp:
+            assert target_fp.read() == \
+                "p cnf 3 4\n-1 0\n2 -3 0\n1 -2 0\n2 3 0\n"
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+def test_enumerates_all_solutions():
+    solutions = list(iter_weighted_sum_solutions(
+        variables=[[1,2], [1,2], [1,2]],
+        reference_value=4,
+        csp_solver_config=csp_solver_config
+    ))
+    assert sorted(solution['solution_list'] for solution in solutions) == \
+        [[1, 1, 2], [1, 2, 1], [2, 1, 1]], solutions
+    assert [solution['solution_index'] for solution in solutions] == \
+        [0, 1, 2]
+    assert all('latency' in solution for solution in solutions)
+
+
+def test_enumeration_stops_at_max_solutions():
+    solutions = list(iter_weighted_sum_solutions(
+        variables=[[-1, 0, 1]] * 4,
+        reference_value=0,
+        csp_solver_config=csp_solver_config,
+        max_solutions=5
+    ))
+    assert len(solutions) == 5
+    solution_lists = [tuple(solution['solution_list'])
+                      for solution in solutions]
+    assert len(set(solution_lists)) == 5
+    assert all(sum(solution_list) == 0 for solution_list in solution_lists)
+
+
+def test_optimize_finds_proven_optimum():
+    variables = [[1,2,3], [1,2,3], [0,2]]
+    objective = [1, -2, 3]
+    for reference_value in (None, 4, 6):
+        objective_values = [
+            sum(c * v for c, v in zip(objective, values))
+            for values in itertools.product(*variables)
+            if reference_value is None or sum(values) == reference_value]
+        for maximize in (False, True):
+            for search in ('binary', 'linear'):
+                result = do_optimize(
+                    variables=variables,
+                    objective=objective,
+                    csp_solver_config=csp_solver_config,
+                    reference_value=reference_value,
+                    maximize=maximize,
+                    search=search
+                )
+                expected = (max if maximize else min)(objective_values)
+                assert result['status'] == 'OPTIMAL', result
+                assert result['objective_value'] == expected, result
+                assert result['proven_bound'] == expected, result
+                assert sum(c * v for c, v in zip(
+                    objective, result['solution_list'])) == expected
+                assert result['iterations'] == len(result['trace'])
+
+
+def test_optimize_unsatisfiable():
+    result = do_optimize(
+        variables=[[1,2], [1,2]],
+        objective=[1, 1],
+        csp_solver_config=csp_solver_config,
+        reference_value=5
+    )
+    assert result['status'] == 'UNSATISFIABLE', result
+    assert result['satisfiable_bool'] == False, result
+
+
+def test_race_sat_solvers_takes_first_answer():
+    tmp_folder = tempfile.mkdtemp()
+    try:
+        cnf_file = os.path.join(tmp_folder, 'problem.cnf')
+        out_file = os.path.join(tmp_folder, 'problem.out')
+        with open(cnf_file, 'w') as cnf_fp:
+            cnf_fp.write("p cnf 1 1\n1 0\n")
+        # called as <command> <cnf> <model file>
+        portfolio = [
+            ['sh', '-c', 'sleep 30', 'slow'],
+            ['sh', '-c', 'exit 1', 'broken'],
+            ['sh', '-c', 'printf "SAT\\n1 0\\n" > "$2"; exit 10', 'fast'],
+        ]
+        b = time.time()
+        winner, returncode, _, _ = race_sat_solvers(
+            portfolio, cnf_file, out_file)
+        assert time.time() - b < 10
+        assert (winner, returncode) == (2, 10), (winner, returncode)
+        with open(out_file) as out_fp:
+            assert out_fp.read() == "SAT\n1 0\n"
+        assert sorted(os.listdir(tmp_folder)) == \
+            ['problem.cnf', 'problem.out']
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+def test_minisat_failures_are_not_reported_as_limits():
+    def run(script, deadline=None, memory_limit=None):
+        process = start_sat_solver(['sh', '-c', script], deadline,
+                                   memory_limit)
+        try:
+            wait_for_minisat(process, deadline, memory_limit)
+        except LimitReached as exc:
+            return exc.limit
+        except Exception as exc:
+            return str(exc)
+
+    parse_error = 'echo "PARSE ERROR! Unexpected char: x"; exit 3'
+    assert run(parse_error) == "Error executing minisat!"
+    assert run(parse_error, deadline=time.time() + 60) == \
+        "Error executing minisat!"
+    assert run(parse_error, memory_limit=1 << 30) == \
+        "Error executing minisat!"
+    assert run('kill -SEGV $$', time.time() + 60, 1 << 30) == \
+        "Error executing minisat!"
+
+    assert run('kill -XCPU $$', deadline=time.time() + 60) == 'timeout'
+    assert run('kill -ABRT $$', memory_limit=1 << 30) == 'memory'
+    assert run('echo INDETERMINATE', memory_limit=1 << 30) == 'memory'
+    assert run('echo INDETERMINATE', deadline=time.time() + 60) == \
+        'timeout'
+
+
+def test_race_sat_solvers_shares_memory_limit():
+    tmp_folder = tempfile.mkdtemp()
+    try:
+        cnf_file = os.path.join(tmp_folder, 'problem.cnf')
+        with open(cnf_file, 'w') as cnf_fp:
+            cnf_fp.write("p cnf 1 1\n1 0\n")
+        # prints its address space limit in KB
+        portfolio = [['sh', '-c',
+                      'ulimit -v; printf "SAT\\n1 0\\n" > "$2"; exit 10',
+                      'solver']] * 4
+        _, _, solver_output, _ = race_sat_solvers(
+            portfolio, cnf_file, os.path.join(tmp_folder, 'problem.out'),
+            memory_limit=4 << 30)
+        assert int(solver_output) == (1 << 30) // 1024, solver_output
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+def test_race_sat_solvers_raises_if_every_solver_fails():
+    tmp_folder = tempfile.mkdtemp()
+    try:
+        cnf_file = os.path.join(tmp_folder, 'problem.cnf')
+        with open(cnf_file, 'w') as cnf_fp:
+            cnf_fp.write("p cnf 1 1\n1 0\n")
+        portfolio = [['sh', '-c', 'echo "PARSE ERROR"; exit 3', 'broken']] * 2
+        try:
+            race_sat_solvers(portfolio, cnf_file,
+                             os.path.join(tmp_folder, 'problem.out'),
+                             deadline=time.time() + 60,
+                             memory_limit=1 << 30)
+        except LimitReached as exc:
+            raise AssertionError("reported as {0}".format(exc.limit))
+        except Exception as exc:
+            assert str(exc) == "No portfolio solver answered!", exc
+        else:
+            raise AssertionError("expected an exception")
+    finally:
+        shutil.rmtree(tmp_folder)
+
+
+class TestPythonDecoder(unittest.TestCase):
+    def setUp(self):
+        self.tmp_folder = tempfile.mkdtemp()
+        self.map_file = os.path.join(self.tmp_folder, 'problem.map')
+        self.out_file = os.path.join(self.tmp_folder, 'problem.out')
+        with open(self.map_file, 'w') as map_fp:
+            map_fp.write(
+                "int V1 1 1..3\n"
+                "int V2 3 -5 -4\n"
+                "int V3 4 2 5..6 9\n"
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_folder)
+
+    def write_model(self, model):
+        with open(self.out_file, 'w') as out_fp:
+            out_fp.write(model)
+
+    def test_decodes_order_encoding(self):
+        self.write_model("SAT\n-1 2 3 -4 -5 6 0\n")
+        self.failUnlessEqual(
+            list(iter_decoded_solution(self.out_file, self.map_file)),
+            [('V1', 2), ('V2', -5), ('V3', 6)]
+        )
+
+    def test_falls_back_to_upper_bound(self):
+        self.write_model("SAT\n-1 -2 -3 -4 -5 -6 0\n")
+        self.failUnlessEqual(
+            [v for _, v in iter_decoded_solution(
+                self.out_file, self.map_file)],
+            [3, -4, 9]
+        )
+
+    def test_reads_model_in_chunks(self):
+        self.write_model("SAT\n-1 2 3 -4 -5 6 12 -13 0\n")
+        for chunk_size in [1, 2, 3, 7, 1024]:
+            model = read_minisat_model(self.out_file, chunk_size=chunk_size)
+            self.failUnlessEqual(
+                [v for v in range(1, 14) if model[v >> 3] & 1 << (v & 7)],
+                [2, 3, 6, 12]
+            )
+
+    def test_unsat_has_no_model(self):
+        self.write_model("UNSAT\n")
+        self.failUnlessEqual(read_minisat_model(self.out_file), None)
+
+    def test_python_decoder_agrees_with_sugar(self):
+        result = do_solve(
+            variables=[
+                [1,2], [-1,-2,-3], [1,2,3], [-1,-2,-3], [1,2,3],
+                [-1,-3,-2], [1,2,3], [-1,-2,-3],
+            ],
+            reference_value=0,
+            csp_solver_config=csp_solver_config,
+            decoder='both'
+        )
+        assert result['solution_list'] == [2, -3, 1, -1, 2, -3, 3, -1]
+
+
+class TestSugarWorker(unittest.TestCase):
+    def request_with_reader(self, worker_script, reader_script):
+        import subprocess
+        sugar_worker = SugarWorker(sugarjar_path)
+        # stands in for the JVM, answers after worker_script
+        sugar_worker.process = subprocess.Popen(
+            ['sh', '-c', worker_script], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE)
+        reader = subprocess.Popen(['sh', '-c', reader_script])
+        try:
+            return sugar_worker._request('encode_stream', reader=reader)
+        finally:
+            sugar_worker._kill()
+            reader.wait()
+
+    def test_payload_size_is_in_bytes(self):
+        import subprocess
+        sugar_worker = SugarWorker(sugarjar_path)
+        sugar_worker.process = subprocess.Popen(
+            ['sh', '-c', 'read line; printf "ok 4\\n\\303\\244!\\n"; '
+                         'read line; printf "ok 2\\nhi"'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            self.failUnlessEqual(
+                [sugar_worker._request('decode'),
+                 sugar_worker._request('decode')],
+                [u'\xe4!\n', u'hi'])
+        finally:
+            sugar_worker._kill()
+
+    def test_compiled_worker_is_reused(self):
+        import hashlib
+        from csp_solver import SUGAR_WORKER_SOURCE, compile_sugar_worker
+        tmp_folder = tempfile.mkdtemp()
+        try:
+            class_folder = os.path.join(
+                tmp_folder, 'sugar_worker_{0}'.format(hashlib.sha1(
+                    SUGAR_WORKER_SOURCE.encode('utf-8')).hexdigest()[:12]))
+            os.mkdir(class_folder)
+            self.failUnlessEqual(
+                compile_sugar_worker(sugarjar_path, tmp_folder),
+                class_folder)
+        finally:
+            shutil.rmtree(tmp_folder)
+
+    def test_failed_cnf_reader_stops_the_request(self):
+        from csp_solver import SugarWorkerException
+        b = time.time()
+        self.failUnlessRaises(
+            SugarWorkerException, self.request_with_reader,
+            'read line; exec sleep 30', 'exit 3')
+        assert time.time() - b < 10
+
+    def test_finished_cnf_reader_does_not_stop_the_request(self):
+        self.failUnlessEqual(
+            self.request_with_reader(
+                'read line; sleep 0.3; printf "ok 2\\nhi"', 'exit 20'),
+            'hi')
+
+    def test_worker_gives_same_results_as_jvm_per_call(self):
+        with SugarWorker(sugarjar_path) as sugar_worker:
+            for variables, reference_value in [
+                ([[1,2], [1,2]], 4),
+                ([[1,2], [1,2]], 5),
+                ([[-1, 0, 1], [-1,-2,-3], [-1, 0, 1], [-1,-2,-3]], 0),
+            ]:
+                expected = do_solve(
+                    variables=variables,
+                    reference_value=reference_value,
+                    csp_solver_config=csp_solver_config
+                )
+                result = do_solve(
+                    variables=variables,
+                    reference_value=reference_value,
+                    csp_solver_config=csp_solver_config,
+                    sugar_worker=sugar_worker
+                )
+                self.failUnlessEqual(
+                    result['satisfiable_bool'],
+                    expected['satisfiable_bool']
+                )
+                self.failUnlessEqual(
+                    result['solution_list'],
+                    expected['solution_list']
+                )
+                self.failUnlessEqual(result['sugar_warmup_time'], 0.0)
+
+    def test_cnf_stream_gives_same_results(self):
+        for variables, reference_value in [
+            ([[1,2], [1,2]], 4),
+            ([[1,2], [1,2]], 5),
+            ([[-1, 0, 1], [-1,-2,-3], [-1, 0, 1], [-1,-2,-3]], 0),
+        ]:
+            expected = do_solve(
+                variables=variables,
+                reference_value=reference_value,
+                csp_solver_config=csp_solver_config
+            )
+            result = do_solve(
+                variables=variables,
+                reference_value=reference_value,
+                csp_solver_config=csp_solver_config,
+                cnf_stream=True
+            )
+            self.failUnlessEqual(
+                result['satisfiable_bool'],
+                expected['satisfiable_bool']
+            )
+            self.failUnlessEqual(
+                result['solution_list'],
+                expected['solution_list']
+            )
+            if expected['satisfiable_bool']:
+                assert result['cnf_file_size'] > 0, result
+
+    def test_worker_reports_decode_time(self):
+        with SugarWorker(sugarjar_path) as sugar_worker:
+            solve_csp_time, result = solve_csp(
+                csp_file=sample_csp_file_solvable,
+                remove_tmp_files=True,
+                csp_solver_config=csp_solver_config,
+                sugar_worker=sugar_worker
+            )
+        assert result['satisfiable_bool'] == True
+        assert 'decode_time' in result, result
+        assert 'sugar_warmup_time' in result, result
+
+
 def test_minisat_is_deterministic():
     for _ in range(20):
         result = do_solve(
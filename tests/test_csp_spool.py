@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from csp_solver import main
+from csp_spool import (
+    CLAIMED,
+    PENDING,
+    Spool,
+    run_worker
+)
+from tests.test_csp_solver import csp_solver_config, sugarjar_path
+
+
+def run_spool_worker(spool_dir):
+    run_worker(Spool(spool_dir), csp_solver_config, poll_interval=0.05,
+               exit_when_empty=True)
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.spool = Spool(self.spool_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+    def test_a_job_is_claimed_once(self):
+        job_id = self.spool.submit([[1, 2]], 2)
+        self.failUnlessEqual(self.spool.claim(), job_id)
+        self.failUnlessEqual(self.spool.claim(), None)
+        self.failUnlessEqual(self.spool.get_result(job_id), None)
+        self.spool.complete(job_id, {'id': job_id, 'status': 'SAT'})
+        self.failUnlessEqual(self.spool.get_result(job_id),
+                             {'id': job_id, 'status': 'SAT'})
+        self.failUnlessEqual(self.spool.stats(),
+                             {PENDING: 0, CLAIMED: 0, 'done': 1})
+
+    def test_oldest_job_first(self):
+        job_ids = [self.spool.submit([[1]], 1, job_id=job_id)
+                   for job_id in ('b', 'a', 'c')]
+        self.failUnlessEqual([self.spool.claim() for _ in job_ids],
+                             ['a', 'b', 'c'])
+
+    def test_expired_lease_is_requeued(self):
+        job_id = self.spool.submit([[1]], 1)
+        self.spool.claim()
+        self.failUnlessEqual(self.spool.requeue_expired(60), [])
+        time.sleep(0.05)
+        self.failUnlessEqual(self.spool.requeue_expired(0.01), [job_id])
+        self.failUnlessEqual(self.spool.claim(), job_id)
+
+    def test_workers_share_the_spool(self):
+        problems = [([[1, 2], [1, 2]], reference_value, {'backend': 'dp'})
+                    for reference_value in range(1, 7)]
+        problems.append(([[1, 2], [1, 2]], 4, {}))
+        job_ids = [self.spool.submit(variables, reference_value, **options)
+                   for variables, reference_value, options in problems]
+        # not queued by submit, which refuses the option
+        job_ids.append('bad-option')
+        self.spool._publish(PENDING, 'bad-option.json', dict(
+            id='bad-option', variables=[[1]], reference_value=1,
+            options={'tmp_folder': '/'}))
+
+        workers = [multiprocessing.Process(
+            target=run_spool_worker, args=(self.spool_dir,))
+            for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        results = self.spool.wait(job_ids, timeout=120)
+        for worker in workers:
+            worker.join()
+
+        self.failUnlessEqual(
+            [results[job_id].get('satisfiable_bool') for job_id in job_ids],
+            [False, True, True, True, False, False, True, None])
+        self.failUnlessEqual(results[job_ids[-1]]['status'], 'ERROR')
+        self.failUnlessEqual(
+            [results[job_id]['id'] for job_id in job_ids], job_ids)
+        self.failUnlessEqual(self.spool.stats(),
+                             {PENDING: 0, CLAIMED: 0, 'done': len(job_ids)})
+
+    def test_submit_checks_options(self):
+        self.failUnlessRaises(
+            ValueError, self.spool.submit, [[1]], 1, tmp_folder='/')
+        self.failUnlessRaises(
+            ValueError, self.spool.submit, csp='(int V1 1 2)',
+            backend='dp')
+        self.spool.submit(csp='(int V1 1 2)', timeout=10)
+        self.spool.submit([[1]], 1, backend='dp', timeout=10)
+        self.failUnlessEqual(self.spool.stats()[PENDING], 2)
+
+    def test_csp_job_with_weighted_sum_options_fails(self):
+        self.spool._publish(PENDING, 'a.json', dict(
+            id='a', csp='(int V1 1 2)', options={'presolve': True}))
+        run_worker(self.spool, csp_solver_config, exit_when_empty=True)
+        result = self.spool.get_result('a')
+        self.failUnlessEqual(result['status'], 'ERROR')
+        assert 'unsupported options for csp jobs: presolve' in \
+            result['error'], result
+
+    def test_worker_command(self):
+        job_id = self.spool.submit([[1, 2], [1, 2]], 3)
+        main(['worker', self.spool_dir, '--sugar-jar', sugarjar_path,
+              '--poll-interval', '0.05', '--exit-when-empty'])
+        self.failUnlessEqual(
+            self.spool.get_result(job_id)['satisfiable_bool'], True)
+        self.failUnless(os.path.exists(
+            os.path.join(self.spool_dir, 'done', job_id + '.json')))
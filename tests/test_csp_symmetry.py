@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import itertools
+import unittest
+
+from csp_symmetry import (
+    expand_value_counts,
+    get_domain_classes,
+    iter_value_count_csp
+)
+from csp_solver import do_solve
+from tests.test_csp_solver import csp_solver_config
+
+
+class TestValueCountModel(unittest.TestCase):
+    def test_domain_classes(self):
+        classes, variable_classes = get_domain_classes(
+            [[2, 1], [5], [1, 2], [1, 2, 2]])
+        self.failUnlessEqual(classes, [[[1, 2], 3], [[5], 1]])
+        self.failUnlessEqual(variable_classes, [0, 1, 0, 0])
+
+    def test_csp(self):
+        self.failUnlessEqual(
+            "".join(iter_value_count_csp([[0, 2], [5], [2, 0]], 7)),
+            "(int N1_1 0 2)\n"
+            "(int N1_2 0 2)\n"
+            "(int N2_1 0 1)\n"
+            "(weightedsum ( ( 1 N1_1 ) ( 1 N1_2 ) ) eq 2)\n"
+            "(weightedsum ( ( 1 N2_1 ) ) eq 1)\n"
+            "(weightedsum ( ( 2 N1_2 ) ( 5 N2_1 ) ) eq 7)"
+        )
+
+    def test_expand_keeps_variable_order(self):
+        variables = [[1, 2], [7], [1, 2], [1, 2]]
+        self.failUnlessEqual(
+            expand_value_counts(variables, [1, 2, 1]), [1, 7, 2, 2])
+
+
+class TestDoSolveValueCounts(unittest.TestCase):
+    def test_matches_brute_force(self):
+        variables = [[1, 2, 5], [-1, -3], [1, 2, 5], [1, 2, 5], [-1, -3]]
+        sums = set(sum(assignment)
+                   for assignment in itertools.product(*variables))
+        for reference_value in range(min(sums) - 1, max(sums) + 2):
+            result = do_solve(
+                variables=variables,
+                reference_value=reference_value,
+                value_counts=True,
+                csp_solver_config=csp_solver_config
+            )
+            self.failUnlessEqual(result['satisfiable_bool'],
+                                 reference_value in sums, reference_value)
+            self.failUnlessEqual(result['domain_class_count'], 2)
+            if result['satisfiable_bool']:
+                solution_list = result['solution_list']
+                self.failUnlessEqual(sum(solution_list), reference_value)
+                for value, variable in zip(solution_list, variables):
+                    assert value in variable, (value, variable)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from csp_solver import do_solve
+from csp_trace import (
+    JsonLinesExporter,
+    PrometheusTextfileExporter,
+    Tracer
+)
+from tests.test_csp_solver import csp_solver_config
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.spans = []
+        self.tracer = Tracer([self.spans.append])
+
+    def test_span_records_times(self):
+        with self.tracer.start_span('solve', unique_repr='x') as span:
+            subprocess.check_call(['true'])
+        self.failUnlessEqual(self.spans, [span])
+        span_dict = span.to_dict()
+        self.failUnlessEqual(
+            (span_dict['name'], span_dict['status'],
+             span_dict['unique_repr']),
+            ('solve', 'ok', 'x'))
+        assert span.end >= span.start
+        assert span.wall_time >= 0 and span.child_cpu_time >= 0
+        high_water = span.children_rss_high_water
+        assert high_water > 0, high_water
+
+        # a smaller child does not lower the mark
+        with self.tracer.start_span('solve') as span:
+            subprocess.check_call(['true'])
+        self.failUnlessEqual(span.children_rss_high_water, high_water)
+
+    def test_exception_sets_status_and_finish_counts_once(self):
+        try:
+            with self.tracer.start_span('decode') as span:
+                raise ValueError()
+        except ValueError:
+            pass
+        span.finish()
+        self.failUnlessEqual(
+            [(span.name, span.status) for span in self.spans],
+            [('decode', 'ValueError')])
+
+    def test_do_solve_reports_phases(self):
+        result = do_solve(
+            variables=[[1, 2], [1, 2]],
+            reference_value=4,
+            tracer=self.tracer,
+            csp_solver_config=csp_solver_config
+        )
+        assert result['satisfiable_bool'] == True, result
+        self.failUnlessEqual(
+            [span.name for span in self.spans],
+            ['generate', 'encode', 'solve', 'decode', 'cleanup', 'cleanup'])
+        self.failUnlessEqual(
+            len(set(span.attributes['unique_repr'] for span in self.spans)),
+            1)
+        self.failUnlessEqual(
+            set(span.status for span in self.spans), set(['ok']))
+
+
+class TestExporters(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_json_lines(self):
+        trace_file = os.path.join(self.folder, 'spans.jsonl')
+        tracer = Tracer([JsonLinesExporter(trace_file)])
+        for name in ('encode', 'solve'):
+            tracer.start_span(name, unique_repr='x').finish()
+        with open(trace_file) as trace_fp:
+            spans = [json.loads(line) for line in trace_fp]
+        self.failUnlessEqual(
+            [span['name'] for span in spans], ['encode', 'solve'])
+        assert 'child_cpu_time' in spans[0], spans[0]
+
+    def test_prometheus_textfile(self):
+        metrics_file = os.path.join(self.folder, 'csp_solver.prom')
+        tracer = Tracer([PrometheusTextfileExporter(metrics_file)])
+        for _ in range(3):
+            tracer.start_span('solve').finish()
+        tracer.start_span('solve').finish('timeout')
+        with open(metrics_file) as metrics_fp:
+            lines = metrics_fp.read().splitlines()
+        assert 'csp_solver_span_count_total{span="solve",status="ok"} 3' \
+            in lines, lines
+        assert 'csp_solver_span_count_total' \
+            '{span="solve",status="timeout"} 1' in lines, lines
+        assert any(line.startswith(
+            'csp_solver_span_wall_seconds_total{span="solve"} ')
+            for line in lines), lines
+        assert any(line.startswith(
+            'csp_solver_span_children_rss_high_water_bytes ')
+            for line in lines), lines
+        self.failUnlessEqual(os.listdir(self.folder), ['csp_solver.prom'])